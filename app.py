@@ -1,20 +1,44 @@
 # https://www.datacamp.com/tutorial/open-ai-function-calling-tutorial
 
 
-from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi import FastAPI, HTTPException, Query, Response, Body
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import os
-import requests
+import asyncio
 import subprocess
 import json
+import re
+import time
 from dotenv import load_dotenv
 from datetime import datetime
 from dateutil import parser
-from typing import Dict, Any
+from typing import Dict, Any, List
 import base64
 import numpy as np
 import pandas as pd
 import sqlite3, duckdb, httpx
+from llm import llm, LLMError
+import router
+from registry import ToolRegistry
+from dates import date_histogram, weekday_index
+from contacts import SortSpec, sort_contacts_file
+from logs import recent_first_lines, recent_files, extract_lines, LOG_ENCODING
+from docindex import markdown_titles, write_json_atomic
+from search import search_index, close_indexes
+from emails import EmailParseError, parse_headers, field_text, header_block, is_mbox, extract_batch
+from emails import extract_mailbox as extract_mailbox_file
+from ocr import read_card_number, read_card_numbers, IMAGE_EXTENSIONS, OCR_MIN_CONFIDENCE
+from formatter import prettier, format_files, format_directory, FormatterError
+import embeddings
+from embeddings import embed_texts, get_backend, EmbeddingError
+from similarity import top_pairs
+from vectorindex import similar_search as vector_search, close_vector_indexes
+from sqlengine import run_query, close_sources, SQLEngineError
+from pydantic import ValidationError
+from cache import tool_cache, schema_hash, normalize_task
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
@@ -24,7 +48,23 @@ from sklearn.metrics.pairwise import cosine_similarity
 
 load_dotenv() 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Blocking tool handlers run via asyncio.to_thread; size the pool for many tasks in flight
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_THREADS", "64"))))
+    # Warm the Prettier worker in the background; a failure here is retried on first use
+    warmup = asyncio.create_task(prettier.start())
+    warmup.add_done_callback(lambda task: task.cancelled() or task.exception())
+    yield
+    # Close the shared LLM connection pool, the search and vector indexes, the SQL pools and the Prettier worker on shutdown
+    await llm.aclose()
+    close_indexes()
+    close_vector_indexes()
+    close_sources()
+    await prettier.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +75,8 @@ app.add_middleware(
 )
 
 AIPROXY_TOKEN = os.getenv("AIPROXY_TOKEN")
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "32"))
+FORMAT_LLM_FALLBACK = os.getenv("FORMAT_LLM_FALLBACK", "0") != "0"
 
 # Tool for A1
 SCRIPT_RUNNER = {
@@ -67,17 +109,26 @@ FORMAT_FILE = {
         "type": "function",
         "function": {
             "name": "format_file",
-            "description": "Format a file using Prettier with specified version",
+            "description": "Format one or more files in-place using Prettier with specified version",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "path": {
                         "type": "string",
-                        "description": "Path to the file to format"
+                        "description": "Path to the file to format, or a directory to format every supported file in it"
                     },
                 "prettier_version": {
                     "type": "string",
                     "description": "Prettier version to use (e.g. '3.4.2')"
+                    },
+                "paths": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Optional further files to format in the same call"
+                    },
+                "pattern": {
+                    "type": "string",
+                    "description": "Optional glob selecting files when path is a directory, e.g. '**/*.md'"
                     }
                 }, "required": ["path", "prettier_version"]
             }
@@ -105,8 +156,16 @@ COUNT_DAYS = {
                         "type": "string",
                         "description": "Path to the output file where the number of that specific weekday will be written.",
                     },
+                    "start_date": {
+                        "type": ["string", "null"],
+                        "description": "Only count dates on or after this ISO date (YYYY-MM-DD), or null for no lower bound",
+                    },
+                    "end_date": {
+                        "type": ["string", "null"],
+                        "description": "Only count dates on or before this ISO date (YYYY-MM-DD), or null for no upper bound",
+                    },
                 },
-                "required": ["day_of_week", "input_file_path", "output_file_path"],
+                "required": ["day_of_week", "input_file_path", "output_file_path", "start_date", "end_date"],
                 "additionalProperties": False,
             },            
             "strict": True
@@ -118,7 +177,7 @@ SORT_CONTACTS = {
         "type": "function",
         "function": {
             "name": "sort_contacts",
-            "description": "Sort contacts in a JSON file by last name and then by first name",
+            "description": "Sort contacts in a JSON file by the given keys, by default last name and then first name",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -129,6 +188,23 @@ SORT_CONTACTS = {
                     "output_path": {
                         "type": "string",
                         "description": "Path to write the sorted contacts (e.g., '/data/contacts-sorted.json')"
+                    },
+                    "sort_keys": {
+                        "type": "array",
+                        "description": "Fields to sort by, most significant first. Defaults to last_name then first_name",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "field": {"type": "string", "description": "Contact field name, e.g. 'last_name'"},
+                                "descending": {"type": "boolean", "description": "Sort this field in descending order"}
+                            },
+                            "required": ["field"]
+                        }
+                    },
+                    "collation": {
+                        "type": "string",
+                        "enum": ["binary", "casefold", "locale"],
+                        "description": "How to compare text: exact code points (default), case-insensitive, or the server locale"
                     }
                 }, "required": ["input_path", "output_path"]
             }
@@ -155,6 +231,32 @@ LOGS_RECENT = {
                         "num_files": {
                             "type": "integer",
                             "description": "Number of recent log files to retrieve",
+                        },
+                        "pattern": {
+                            "type": "string",
+                            "description": "Optional glob relative to the directory, e.g. '*.log' or '**/*.log' to search subdirectories",
+                        },
+                        "extensions": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Optional file extensions to include, e.g. ['.log']",
+                        },
+                        "mode": {
+                            "type": "string",
+                            "enum": ["first", "last", "match"],
+                            "description": "Which lines to take from each file: the first lines (default), the last lines, or lines matching 'match'",
+                        },
+                        "lines": {
+                            "type": "integer",
+                            "description": "Number of lines to take from each file (default 1); the maximum number of matches in 'match' mode",
+                        },
+                        "match": {
+                            "type": "string",
+                            "description": "Regular expression selecting lines in 'match' mode, e.g. 'ERROR'",
+                        },
+                        "encoding": {
+                            "type": "string",
+                            "description": "Text encoding of the log files (default utf-8); undecodable bytes are replaced",
                         }
                     }, "required": ["log_dir_path", "output_file_path", "num_files"]
                 }
@@ -186,25 +288,90 @@ MARKDOWN_INDEX = {
             }
         }
 
+# Full-text search over the docs tree
+SEARCH_DOCS = {
+            "type": "function",
+            "function": {
+                "name": "search_docs",
+                "description": "Full-text search over the titles, headings and bodies of the Markdown documents in a directory, returning ranked matches.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "Search terms; every term must match, 'term*' matches a prefix"
+                        },
+                        "doc_dir_path": {
+                            "type": "string",
+                            "default": "/data/docs"
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "default": 10
+                        },
+                        "output_file_path": {
+                            "type": "string",
+                            "description": "Optional JSON file to save the results to"
+                        }
+                    },
+                    "required": ["query", "doc_dir_path"]
+                }
+            }
+        }
+
 # Tool or A7
 EMAIL_SENDER = {
         "type": "function",
         "function": {
             "name": "email_sender",
-            "description": "Extract the sender's email address and in response return just the sender's email address",
+            "description": "Extract the sender's email address (or another header) from an email and in response return just that value. An mbox file or a directory of .eml files extracts all headers of every message to a JSON file",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "input_location": {
                         "type": "string", 
-                        "description": "The relative input image location on user's device"
+                        "description": "The relative input email, mbox or .eml directory location on user's device"
                     },
                     "output_location": {
                         "type": "string", 
                         "description": "The relative output location on user's device"
                     },
+                    "field": {
+                        "type": ["string", "null"],
+                        "enum": ["from", "to", "cc", "date", "subject", None],
+                        "description": "Header to extract from a single email; defaults to the sender's address (from)"
+                    },
                 },
-                "required": ["input_location","output_location"],
+                "required": ["input_location","output_location","field"],
+                "additionalProperties": False,
+            },
+            "strict": True,
+        }
+    }
+
+# Mailbox-scale sender/recipient extraction
+EXTRACT_MAILBOX = {
+        "type": "function",
+        "function": {
+            "name": "extract_mailbox",
+            "description": "Extract the sender, recipients, date and subject of every message in an mbox file, a maildir or a directory of .eml files to a CSV or Parquet file",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "input_location": {
+                        "type": "string",
+                        "description": "The mbox file, maildir or .eml directory location on user's device"
+                    },
+                    "output_location": {
+                        "type": "string",
+                        "description": "The output .csv or .parquet location on user's device"
+                    },
+                    "use_llm": {
+                        "type": ["boolean", "null"],
+                        "description": "Whether to ask the LLM for the sender of messages whose headers cannot be parsed (default true)"
+                    },
+                },
+                "required": ["input_location", "output_location", "use_llm"],
                 "additionalProperties": False,
             },
             "strict": True,
@@ -216,7 +383,7 @@ IMAGE_EXTRACT = {
         "type": "function",
         "function": {
             "name": "get_completions_image",
-            "description": "Extract the 16-digit code from an image",
+            "description": "Extract the 16-digit code from an image, or from every image in a directory to a JSON file",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -253,8 +420,59 @@ SIMILARITY_EXTRACT = {
                         "type": "string", 
                         "description": "The relative output location on user's device"
                     },
+                    "backend": {
+                        "type": ["string", "null"],
+                        "enum": ["remote", "local", "hashing", None],
+                        "description": "Embedding backend: remote API, local sentence-transformers model or hashing; null for the server default"
+                    },
+                    "top_k": {
+                        "type": ["integer", "null"],
+                        "description": "Number of most similar pairs to return; null for the single best pair"
+                    },
+                    "mode": {
+                        "type": ["string", "null"],
+                        "enum": ["auto", "exact", "approximate", None],
+                        "description": "Exact or approximate (LSH) pair search; null picks by the number of comments"
+                    },
                 },
-                "required": ["input_location","output_location"],
+                "required": ["input_location","output_location","backend","top_k","mode"],
+                "additionalProperties": False,
+            },
+            "strict": True,
+        },
+    }
+
+SIMILAR_SEARCH = {
+        "type": "function",
+        "function": {
+            "name": "similar_search",
+            "description": "Find the lines of a text file (e.g. comments) most similar in meaning to a given text, using a persistent nearest-neighbour index",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "text": {
+                        "type": "string",
+                        "description": "The text to find neighbours of"
+                    },
+                    "k": {
+                        "type": ["integer", "null"],
+                        "description": "Number of neighbours to return; null for 10"
+                    },
+                    "input_location": {
+                        "type": ["string", "null"],
+                        "description": "The text file to search, one item per line; null for /data/comments.txt"
+                    },
+                    "output_location": {
+                        "type": ["string", "null"],
+                        "description": "Optional JSON file to save the results to"
+                    },
+                    "backend": {
+                        "type": ["string", "null"],
+                        "enum": ["remote", "local", "hashing", None],
+                        "description": "Embedding backend; null for the server default"
+                    },
+                },
+                "required": ["text", "k", "input_location", "output_location", "backend"],
                 "additionalProperties": False,
             },
             "strict": True,
@@ -266,7 +484,7 @@ QUERY_SQL = {
         "type": "function",
         "function": {
             "name": "query_sql",
-            "description": "Correctly identify the table and the column names of the table and correctly identify the SQL query that has to be run on the table as query.Identify the database file as filename.Identify the output file where the results of the SQL query will be saved as output_filename.",
+            "description": "Correctly identify the table and the column names of the table and correctly identify the SQL query that has to be run on the table as query.Identify the database file as filename.Identify the output file where the results of the SQL query will be saved as output_filename. The database is read-only; SQLite, DuckDB, CSV, Parquet and JSON files can be queried (a CSV/Parquet/JSON file is a table named after the file). The output is CSV, JSON or Parquet by its extension, or just the value for a single-value result.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -281,6 +499,12 @@ QUERY_SQL = {
                     "output_filename": {
                         "type": "string",
                         "description": "Name of the output file to save the SQL query results"
+                    },
+                    "engine": {
+                        "type": "string",
+                        "enum": ["auto", "sqlite", "duckdb"],
+                        "description": "Query engine; auto runs SQLite files on SQLite (DuckDB for very large ones) and other files on DuckDB",
+                        "default": "auto"
                     }
                 },
                 "required": ["query", "filename", "output_filename"],
@@ -288,9 +512,31 @@ QUERY_SQL = {
         }
     }
 
-tools = [SCRIPT_RUNNER, FORMAT_FILE, COUNT_DAYS, SORT_CONTACTS, LOGS_RECENT, MARKDOWN_INDEX, EMAIL_SENDER,IMAGE_EXTRACT, SIMILARITY_EXTRACT, QUERY_SQL]
+registry = ToolRegistry()
+
+async def format_with_prettier(paths: list, prettier_version: str):
+    # Format files in-place through the long-lived Prettier worker, all files in flight at once
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"File not found: {', '.join(missing)}")
+    results = await format_files(paths, prettier_version)
+    failed = [result for result in results if "error" in result]
+    if len(failed) == len(results):
+        raise HTTPException(status_code=400, detail=failed[0]["error"] if len(failed) == 1 else failed)
+    return Response(content=json.dumps({"engine": f"prettier@{prettier.version}", "results": results}),
+                    status_code=207 if failed else 200,
+                    media_type="application/json")
+
+async def format_directory_with_prettier(directory: str, prettier_version: str, pattern: str = None):
+    # Repository-wide formatting; files unchanged since they were last formatted are skipped by content hash
+    report = await format_directory(directory, prettier_version, pattern)
+    errors = report["summary"]["errors"]
+    return Response(content=json.dumps({"engine": f"prettier@{prettier.version}", **report}),
+                    status_code=207 if errors and errors < report["summary"]["files"] else 400 if errors else 200,
+                    media_type="application/json")
 
-def format_and_save_markdown(input_path: str, prettier_version: str, output_path: str):
+async def format_and_save_markdown(input_path: str, prettier_version: str, output_path: str):
+    # LLM rewrite, only used when no Prettier worker can be started (FORMAT_LLM_FALLBACK=1)
     # Read the unformatted markdown content
     with open(input_path, 'r', encoding='utf-8') as f:
         content = f.read()
@@ -303,40 +549,24 @@ def format_and_save_markdown(input_path: str, prettier_version: str, output_path
         "Markdown content:\n\n"
         f"{content}"
     )
-    # Prepare the request
-    url = "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {AIPROXY_TOKEN}"
-    }
-    data = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "You are an expert markdown formatter. Your task is to reformat the provided markdown "
-                    "text exactly as needed for a .md file. Output only the formatted markdown text with proper "
-                    "spacing and newlines, and remove any unnecessary indentation (such as extra spaces before list items). "
-                    "Do not include any additional commentary or markdown formatting wrappers."
-                )
-            },
-            {
-                "role": "user",
-                "content": refined_prompt
-            }
-        ]
-    }
-    # Send the request to the proxy API
-    response = requests.post(url, headers=headers, json=data).json()
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are an expert markdown formatter. Your task is to reformat the provided markdown "
+                "text exactly as needed for a .md file. Output only the formatted markdown text with proper "
+                "spacing and newlines, and remove any unnecessary indentation (such as extra spaces before list items). "
+                "Do not include any additional commentary or markdown formatting wrappers."
+            )
+        },
+        {
+            "role": "user",
+            "content": refined_prompt
+        }
+    ]
     try:
-        # Extract the formatted markdown text from the response.
-        if "choices" in response:
-            formatted_markdown = response["choices"][0]["message"]["content"]
-        elif "message" in response:
-            formatted_markdown = response["message"]["content"]
-        else:
-            raise ValueError("Unexpected response format: " + str(response))
+        # Send the request through the shared LLM client and extract the formatted markdown text
+        formatted_markdown = await llm.chat_content(messages)
         
         # Write the formatted markdown text to the output file
         with open(output_path, 'w', encoding='utf-8') as f:
@@ -351,134 +581,221 @@ def format_and_save_markdown(input_path: str, prettier_version: str, output_path
         raise HTTPException(status_code=500, detail=f"Error formatting markdown: {str(e)}")
     
 # Function to count number of days of a particular day from a text file containing a list of dates
-def count_days(date: str, input_location:str, output_location:str):
-    # Define possible date formats
-    date_formats = [
-        "%b %d, %Y",        # Apr 04, 2006
-        "%Y-%m-%d",         # 2017-01-09
-        "%d-%b-%Y",         # 17-Dec-2001
-        "%Y/%m/%d",         # 2006/04/12
-        "%Y/%m/%d %H:%M:%S" # 2006/04/12 21:29:21 (new format added)
-    ]
-    if date.lower() == "monday":
-        day = 0
-    elif date.lower() == "tuesday":
-        day = 1
-    elif date.lower() == "wednesday":
-        day = 2
-    elif date.lower() == "thursday":
-        day = 3
-    elif date.lower() == "friday":
-        day = 4
-    elif date.lower() == "saturday":
-        day = 5
-    elif date.lower() == "sunday":
-        day = 6
-    else:
+def count_days(date: str, input_location:str, output_location:str, start_date:str = None, end_date:str = None):
+    try:
+        day = weekday_index(date)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid day of the week")
-
-    count = 0
-    with open(input_location, "r") as file:
-        for line in file:
-            date_str = line.strip()
-            matched = False  # Track if the date matched a format
-            for fmt in date_formats:
-                try:
-                    parsed_date = datetime.strptime(date_str, fmt)
-                    if parsed_date.weekday() == day:
-                        count += 1
-                    matched = True
-                    break  # Stop checking once a format matches
-                except ValueError:
-                    pass  # Try the next format
-            if not matched:
-                raise HTTPException(status_code=400, detail=f"Invalid date format: {date_str}")
+    # The file is parsed once per (path, mtime, size); repeat questions are answered from its histogram
+    histogram = date_histogram(input_location)
+    count = histogram.count(day, start_date, end_date)
     with open(output_location, "w") as file:
-        file.write(str(count)) # .replace('"', ''))
-    file.close()
-    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location}),
+        file.write(str(count))
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location,
+                                        "count": count, "malformed_lines": histogram.data["malformed"],
+                                        "malformed_samples": histogram.data["malformed_samples"]}),
                     status_code=200,
                     media_type="application/json")
     
-def log_recent(log_dir_path:str, output_file_path:str, num_files:int):
-    # Get the first line of the 10 most recent log files
-    command = f"ls -t {log_dir_path} | head -n {num_files}"
-    result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    log_files = result.stdout.splitlines()
+def sort_contacts(input_file_path:str, output_file_path:str, sort_keys:list = None, collation:str = None):
+    try:
+        spec = SortSpec(sort_keys, collation or "binary")
+    except (ValueError, KeyError, TypeError) as ex:
+        raise HTTPException(status_code=400, detail=f"Invalid sort keys: {ex}")
+    try:
+        # Picks in-memory, parallel or external-merge sorting by size; the output bytes are the same
+        result = sort_contacts_file(input_file_path, output_file_path, spec)
+        return Response(
+            content=json.dumps({"message": "Contacts sorted successfully", **result}),
+            status_code=200,
+            media_type="application/json")
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail="Contacts file not found")
+    except Exception as ex:
+        raise HTTPException(status_code=500, detail=f"Error sorting contacts: {ex}")
+
+def log_recent(log_dir_path:str, output_file_path:str, num_files:int, pattern:str = None, extensions:list = None,
+               mode:str = None, lines:int = None, match:str = None, encoding:str = None):
+    # Get the first line (or first/last/matching lines) of the N most recent log files, most recent first
+    mode, lines = mode or "first", lines or 1
+    try:
+        if mode == "first" and lines == 1 and not encoding:
+            # Answered from the directory's incrementally maintained mtime index
+            recent = [(path, [line]) for path, line in recent_first_lines(log_dir_path, num_files, pattern, extensions)]
+        else:
+            paths = recent_files(log_dir_path, num_files, pattern, extensions)
+            recent = list(zip(paths, extract_lines(paths, mode, lines, match, encoding or LOG_ENCODING)))
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail=f"Log directory not found: {log_dir_path}")
+    except (ValueError, LookupError, re.error) as ex:
+        raise HTTPException(status_code=400, detail=f"Invalid log options: {ex}")
     with open(output_file_path, "w") as outfile:
-        for log_file in log_files:
-            with open(os.path.join(log_dir_path, log_file), "r") as infile:
-                outfile.write(infile.readline().strip())
-    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_file_path}),
+        for _, file_lines in recent:
+            for line in file_lines:
+                outfile.write(line + "\n")
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_file_path,
+                                        "files": [{"file": os.path.relpath(path, log_dir_path), "lines": len(file_lines)}
+                                                  for path, file_lines in recent]}),
                     status_code=200,
                     media_type="application/json")
 
 def markdown_index(doc_dir_path:str, output_file_path:str):
     # Find all Markdown(.md) files in doc_dir_path and for each file, extract the first occurance of each H1(#)
-    # heading and write it to the output_file_path as json format without the prefixpath
-    files = []
-    index_data = {}
-    for root, dirs, files in os.walk(doc_dir_path):
-        for file in files:
-            if file.endswith(".md"):
-                files.append(os.path.join(root, file))
-    with open(output_file_path, "w", encoding="utf-8") as outfile:
-        for file in files:
-            with open(file, "r", encoding="utf-8") as infile:
-                for line in infile:
-                    if line.startswith("# "):
-                        title = line[2:].strip()
-                        relative_path = os.path.relpath(file, doc_dir_path).replace("\\", "/")
-                        index_data[relative_path] = title
-                        break
-    with open(output_file_path, "w", encoding="utf-8") as outfile: 
-        json.dump(index_data, outfile, indent=2)
-    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_file_path}),
+    # heading and write it to the output_file_path as json format without the prefixpath.
+    # Unchanged files are answered from the persisted (path, mtime, size) manifest.
+    try:
+        stats = markdown_titles(doc_dir_path, output_file_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=400, detail=f"Docs directory not found: {doc_dir_path}")
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_file_path, **stats}),
                     status_code=200,
                     media_type="application/json")
 
-def email_sender(input_location:str, output_location:str):
-    with open(input_location,"rb") as f:
-        text = f.read().decode("utf-8")
-    f.close()
-    url = "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {AIPROXY_TOKEN}"
-    }
-    data = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {
-                "role": "system", 
-                "content": "Extract just the sender's email address from this email and return just the sender's email address."
-            },
-            {
-                "role": "user",
-                "content": text
-            }
-        ]
-    }
-    response = requests.post(url, headers=headers, data=json.dumps(data)).json()
+def search_docs(doc_dir_path:str, query:str, limit:int = 10, output_file_path:str = None):
+    # Ranked full-text matches from the incrementally maintained FTS5 index of doc_dir_path
+    try:
+        start = time.perf_counter()
+        results = search_index(doc_dir_path).search(query, max(1, limit))
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=400, detail=f"Docs directory not found: {doc_dir_path}")
+    if output_file_path:
+        write_json_atomic(results, output_file_path)
+    return Response(content=json.dumps({"query": query, "results": results, "elapsed_ms": elapsed_ms}),
+                    status_code=200,
+                    media_type="application/json")
+
+async def email_sender(input_location:str, output_location:str, field:str = None):
+    # Headers are parsed locally (RFC 2047 aware); the LLM only sees the header block of malformed emails
+    field = field or "from"
+    if os.path.isdir(input_location) or await asyncio.to_thread(is_mbox, input_location):
+        summary = await asyncio.to_thread(extract_batch, input_location, output_location)
+        return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location,
+                                            **summary}),
+                        status_code=200,
+                        media_type="application/json")
+    raw = await asyncio.to_thread(header_block, input_location)
+    try:
+        value, engine = field_text(parse_headers(raw), field), "local"
+    except EmailParseError:
+        value, engine = await llm_email_field(raw.decode("utf-8", errors="replace"), field), "llm"
     with open(output_location,"w") as f:
-        f.write(response["choices"][0]["message"]["content"].replace(" ","").replace('"',''))
-    f.close()
-    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location}),
+        f.write(value)
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location,
+                                        "engine": engine}),
                     status_code=200,
-                    media_type="application/json")        
+                    media_type="application/json")
+
+async def llm_email_field(text:str, field:str):
+    if field == "from":
+        instruction = "Extract just the sender's email address from this email and return just the sender's email address."
+    else:
+        instruction = f"Extract just the value of the {field.title()} header from this email and return just that value."
+    messages = [
+        {
+            "role": "system", 
+            "content": instruction
+        },
+        {
+            "role": "user",
+            "content": text
+        }
+    ]
+    response = await llm.chat(messages)
+    content = response["choices"][0]["message"]["content"]
+    return content.replace(" ","").replace('"','') if field == "from" else content.strip()
+
+async def extract_mailbox(input_location:str, output_location:str, use_llm:bool = True):
+    # Chunks are parsed across a process pool; unparseable messages go to the LLM in batches
+    if not os.path.exists(input_location):
+        raise HTTPException(status_code=400, detail=f"Mailbox not found: {input_location}")
+    loop = asyncio.get_running_loop()
+
+    def resolve(texts:list):
+        return asyncio.run_coroutine_threadsafe(llm_email_senders(texts), loop).result()
+
+    try:
+        summary = await asyncio.to_thread(extract_mailbox_file, input_location, output_location,
+                                          resolve if use_llm is not False else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location,
+                                        **summary}),
+                    status_code=200,
+                    media_type="application/json")
+
+async def llm_email_senders(texts:list):
+    # One request for a whole batch of header blocks; returns the sender address (or None) per block
+    numbered = "\n\n".join(f"### Email {i}\n{text}" for i, text in enumerate(texts))
+    messages = [
+        {
+            "role": "system",
+            "content": "Each numbered item is the header block of an email. Reply with a JSON object "
+                       "{\"senders\": [...]} holding, in order, just the sender's email address of each item, or null if it has none."
+        },
+        {
+            "role": "user",
+            "content": numbered
+        }
+    ]
+    try:
+        content = await llm.chat_content(messages, response_format={"type": "json_object"})
+        senders = json.loads(content).get("senders", [])
+    except (LLMError, ValueError, AttributeError):
+        return [None] * len(texts)
+    if not isinstance(senders, list) or len(senders) != len(texts):
+        return [None] * len(texts)
+    return [sender.replace(" ","").replace('"','') if isinstance(sender, str) and "@" in sender else None for sender in senders]
 
 # Below is the code for OpenAI - Text Extraction from image
 # https://colab.research.google.com/drive/1bK0b1XMrZWImtw01T1w9NGraDkiVi8mS#scrollTo=RR_q1bi8kfHH
-def get_completions_image(input_location:str, output_location:str):
+async def get_completions_image(input_location:str, output_location:str):
+    # Card numbers are read locally (template OCR + Luhn check); the LLM only sees images read with low confidence
+    if os.path.isdir(input_location):
+        return await get_completions_images(input_location, output_location)
+    try:
+        result = await asyncio.to_thread(read_card_number, input_location)
+    except (OSError, ValueError):
+        result = None
+    if result is not None and result.confident:
+        number, engine = result["number"], "local"
+    else:
+        number, engine = await llm_card_number(input_location), "llm"
+    with open(output_location,"w") as f:
+        f.write(number)
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location,
+                                        "engine": engine, "confidence": result["confidence"] if result else None}),
+                    status_code=200,
+                    media_type="application/json")
+
+async def get_completions_images(input_dir:str, output_location:str):
+    # Batch OCR of every image in a directory across the process pool, LLM calls only for low-confidence reads
+    paths = sorted(entry.path for entry in os.scandir(input_dir)
+                   if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    results = await asyncio.to_thread(read_card_numbers, paths)
+
+    async def resolve(path:str, result:dict):
+        if result.get("number") is not None and result["confidence"] >= OCR_MIN_CONFIDENCE:
+            return {"number": result["number"], "engine": "local", "confidence": result["confidence"]}
+        try:
+            return {"number": await llm_card_number(path), "engine": "llm", "confidence": result["confidence"]}
+        except LLMError as e:
+            return {"number": None, "engine": "llm", "error": str(e)}
+
+    resolved = await asyncio.gather(*(resolve(path, result) for path, result in zip(paths, results)))
+    output = {os.path.relpath(path, input_dir): entry for path, entry in zip(paths, resolved)}
+    with open(output_location,"w") as f:
+        json.dump(output, f, indent=2)
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location,
+                                        "images": len(paths), "llm_calls": sum(1 for e in resolved if e["engine"] == "llm")}),
+                    status_code=200,
+                    media_type="application/json")
+
+async def llm_card_number(input_location:str):
     with open(input_location,"rb") as f:
         img_data = f.read()
         base64_img = base64.b64encode(img_data).decode("utf-8")
     f.close()
-    url = "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {AIPROXY_TOKEN}"
-    }
     # Stronger prompt instructing for a 16-digit continuous number
     prompt_text = (
         "You are a highly accurate extraction system. I am providing an image that contains a dummy credit card number "
@@ -487,34 +804,26 @@ def get_completions_image(input_location:str, output_location:str):
         "Do NOT include any spaces, punctuation, line breaks, or additional commentary. For example, if the number is 3580146805161976, "
         "simply return '3580146805161976'."
     )
-    data = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {
-                "role": "user", 
-                "content": [
-                    {
-                        "type":"text",
-                        "text": prompt_text, #"Extract the 16 digit code from this imI am working on a cybersecurity project that involves detecting and masking sensitive information, such as dummy credit card numbers, from an image. I need you to extract patterns resembling credit card numbers (e.g., 16-digit sequences) from a given text. In the response, just return the 16-digit code."
-                    },
-                    {
-                        "type":"image_url",
-                        "image_url":{
-                            "detail": "low",
-                            "url": f"data:image/png;base64,{base64_img}"
-                        }
+    messages = [
+        {
+            "role": "user", 
+            "content": [
+                {
+                    "type":"text",
+                    "text": prompt_text, #"Extract the 16 digit code from this imI am working on a cybersecurity project that involves detecting and masking sensitive information, such as dummy credit card numbers, from an image. I need you to extract patterns resembling credit card numbers (e.g., 16-digit sequences) from a given text. In the response, just return the 16-digit code."
+                },
+                {
+                    "type":"image_url",
+                    "image_url":{
+                        "detail": "low",
+                        "url": f"data:image/png;base64,{base64_img}"
                     }
-                ]
-            },
-        ]
-    }
-    response = requests.post(url, headers=headers, data=json.dumps(data)).json()
-    with open(output_location,"w") as f:
-        f.write(str(response["choices"][0]["message"]["content"]))  #.replace(" ",""))
-    f.close()
-    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_location}),
-                    status_code=200,
-                    media_type="application/json")
+                }
+            ]
+        },
+    ]
+    response = await llm.chat(messages)
+    return str(response["choices"][0]["message"]["content"])  #.replace(" ",""))
 
 # def get_similar_comments(input_location:str, output_location:str):
 #     with open(input_location,"r") as f:
@@ -555,74 +864,179 @@ def get_completions_image(input_location:str, output_location:str):
 #                     status_code=200,
 #                     media_type="application/json")
 
-async def get_similar_comments(input_location: str, output_location: str):
+async def get_similar_comments(input_location: str, output_location: str, backend: str = None,
+                               top_k: int = None, mode: str = None):
     # Read comments from the input file
     with open(input_location, "r") as f:
         comments = [line.strip() for line in f if line.strip()]
-    # Generate OpenAI embeddings
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                "https://aiproxy.sanand.workers.dev/openai/v1/embeddings",
-                headers={
-                    "Authorization": f"Bearer {AIPROXY_TOKEN}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "text-embedding-3-small",
-                    "input": comments
-                },
-                timeout=30
-            )
-            response.raise_for_status()
-            embeddings_data = response.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"OpenAI API error: {e.response.text}"
-            )
-    # Extract and normalize embeddings
-    embeddings = np.array([item['embedding'] for item in embeddings_data['data']])
-    # Calculate cosine similarity matrix
-    similarity = np.dot(embeddings, embeddings.T)
-    np.fill_diagonal(similarity, -np.inf)  # Ignore self-similarity
-    # Find indices of maximum similarity
-    max_index = np.argmax(similarity)
-    i, j = np.unravel_index(max_index, similarity.shape)
-    # Sort the pair alphabetically before writing
-    sorted_pair = sorted([comments[i], comments[j]])
-    # Write to output file
+    if len(comments) < 2:
+        raise HTTPException(status_code=400, detail="At least two comments are required")
+    # Normalized embeddings, only comments missing from the vector cache are embedded
+    try:
+        vectors, stats = await embed_texts(comments, get_backend(backend), job=input_location)
+    except EmbeddingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LLMError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"OpenAI API error: {e}"
+        )
+    # Top pairs by cosine similarity, tiled (or LSH-bucketed) instead of the full N x N matrix
+    try:
+        pairs, mode = await asyncio.to_thread(top_pairs, vectors, max(1, top_k or 1), mode or "auto")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Sort each pair alphabetically before writing; several pairs are separated by a blank line
+    found = [{"pair": sorted([comments[i], comments[j]]), "similarity_score": score} for i, j, score in pairs]
+    if not found:
+        raise HTTPException(status_code=400, detail="No similar pair found")
     with open(output_location, "w") as f:
-        f.write("\n".join(sorted_pair))
+        f.write("\n\n".join("\n".join(item["pair"]) for item in found))
     return Response(
         content=json.dumps({
             "status": "Success",
-            "pair_found": sorted_pair,
-            "similarity_score": float(similarity[i, j])
+            "pair_found": found[0]["pair"],
+            "similarity_score": found[0]["similarity_score"],
+            "pairs": found,
+            "mode": mode,
+            "embeddings": stats
         }),
         status_code=200,
         media_type="application/json"
     )
 
-def query_sql(filename:str, query:str, output_filename:str):
-    if not filename.endswith('.db'):
-        return None
-    conn = sqlite3.connect(filename) if filename.endswith('.db') else duckdb.connect(filename)
-    cur = conn.cursor()
-    cur.execute(query)
-    # result = cur.fetchall()
-    result = cur.fetchone()[0]
-    # If there are no sales, set total_sales to 0
-    result = result if result else 0
-    # Make the result value upto two-decimal
-    result = round(result, 2)
-    conn.close()
-    with open(output_filename, 'w') as file:
-        file.write(str(result))
-    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_filename}),
+async def similar_search(text: str, k: int = None, input_location: str = None, output_location: str = None,
+                         backend: str = None):
+    # k nearest lines of input_location from its persistent vector index, synced when the file changes
+    input_location = input_location or "/data/comments.txt"
+    try:
+        start = time.perf_counter()
+        results, stats = await vector_search(input_location, text, max(1, k or 10), backend)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail=f"File not found: {input_location}")
+    except EmbeddingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {e}")
+    if output_location:
+        write_json_atomic(results, output_location)
+    return Response(content=json.dumps({"text": text, "results": results, "elapsed_ms": elapsed_ms, **stats}),
+                    status_code=200,
+                    media_type="application/json")
+
+def query_sql(filename:str, query:str, output_filename:str, engine:str = None):
+    # Read-only query on a pooled connection; the full result is streamed to output_filename
+    # (CSV/JSON/JSON lines/Parquet by extension, the bare value for a single-value result)
+    try:
+        summary = run_query(filename, query, output_filename, engine)
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail=f"Database file not found: {filename}")
+    except (SQLEngineError, sqlite3.Error, duckdb.Error) as e:
+        raise HTTPException(status_code=400, detail=f"SQL error: {e}")
+    return Response(content=json.dumps({"status": "Successfully Created", "output_file destination": output_filename,
+                                        **summary}, default=str),
                     status_code=200,
                     media_type="application/json")
 
+# Tool registry: each schema above is bound to its handler once; handlers receive validated arguments
+
+# For A1
+@registry.tool(SCRIPT_RUNNER)
+async def tool_script_runner(args):
+    command = ["uv", "run", args.script_url, *args.args]
+    try:
+        # Run without blocking the event loop
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Script execution failed: {stderr.decode() or stdout.decode()}"
+            )
+        return Response(
+                content=json.dumps({"output": stdout.decode()}),
+                status_code=200,
+                media_type="application/json"
+            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unknown error: {str(e)}")
+
+# For A2
+@registry.tool(FORMAT_FILE, inputs=["path"], outputs=["path"])
+async def tool_format_file(args):
+    paths = [args.path] + [path for path in args.paths or [] if path != args.path]
+    try:
+        await prettier.start()
+    except FormatterError as e:
+        if not FORMAT_LLM_FALLBACK or len(paths) > 1 or os.path.isdir(args.path):
+            raise HTTPException(status_code=503, detail=str(e))
+        if not os.path.exists(args.path):
+            raise HTTPException(status_code=400, detail=f"File not found: {args.path}")
+        return await format_and_save_markdown(args.path, args.prettier_version, args.path)
+    if os.path.isdir(args.path):
+        return await format_directory_with_prettier(args.path, args.prettier_version, args.pattern)
+    return await format_with_prettier(paths, args.prettier_version)
+
+# For A3
+@registry.tool(COUNT_DAYS, inputs=["input_file_path"], outputs=["output_file_path"])
+def tool_count_days(args):
+    return count_days(args.day_of_week, args.input_file_path, args.output_file_path, args.start_date, args.end_date)
+
+# For A4
+@registry.tool(SORT_CONTACTS, inputs=["input_path"], outputs=["output_path"])
+def tool_sort_contacts(args):
+    return sort_contacts(args.input_path, args.output_path, args.sort_keys, args.collation)
+
+# For A5
+@registry.tool(LOGS_RECENT, inputs=["log_dir_path"], outputs=["output_file_path"])
+def tool_logs_recent(args):
+    return log_recent(args.log_dir_path, args.output_file_path, args.num_files, args.pattern, args.extensions,
+                      args.mode, args.lines, args.match, args.encoding)
+
+# For A6
+@registry.tool(MARKDOWN_INDEX, inputs=["doc_dir_path"], outputs=["output_file_path"])
+def tool_markdown_index(args):
+    return markdown_index(args.doc_dir_path, args.output_file_path)
+
+@registry.tool(SEARCH_DOCS, inputs=["doc_dir_path"], outputs=["output_file_path"])
+def tool_search_docs(args):
+    return search_docs(args.doc_dir_path, args.query, args.limit, args.output_file_path)
+
+# For A7
+@registry.tool(EMAIL_SENDER, inputs=["input_location"], outputs=["output_location"])
+async def tool_email_sender(args):
+    return await email_sender(args.input_location, args.output_location, args.field)
+
+@registry.tool(EXTRACT_MAILBOX, inputs=["input_location"], outputs=["output_location"])
+async def tool_extract_mailbox(args):
+    return await extract_mailbox(args.input_location, args.output_location, args.use_llm)
+
+# For A8
+@registry.tool(IMAGE_EXTRACT, inputs=["input_location"], outputs=["output_location"])
+async def tool_get_completions_image(args):
+    return await get_completions_image(args.input_location, args.output_location)
+
+# For A9
+@registry.tool(SIMILARITY_EXTRACT, inputs=["input_location"], outputs=["output_location"])
+async def tool_get_similar_comments(args):
+    return await get_similar_comments(args.input_location, args.output_location, args.backend, args.top_k, args.mode)
+
+@registry.tool(SIMILAR_SEARCH, inputs=["input_location"], outputs=["output_location"])
+async def tool_similar_search(args):
+    return await similar_search(args.text, args.k, args.input_location, args.output_location, args.backend)
+
+# For A10
+@registry.tool(QUERY_SQL, inputs=["filename"], outputs=["output_filename"])
+def tool_query_sql(args):
+    return query_sql(filename=args.filename, query=args.query, output_filename=args.output_filename, engine=args.engine)
+
+tools = registry.schemas()
+TOOLS_HASH = schema_hash(tools)
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
@@ -638,237 +1052,232 @@ def read_file(path:str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
-@app.post("/run")
-def task_runner(task:str):
-    url = "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {AIPROXY_TOKEN}"
-    }
- 
-    data = {   
-        "model": "gpt-4o-mini",
-        "messages": [
-            {
-                "role": "user",
-                "content": task
-            },
-            {
-                "role": "system",
-                "content": """You are an assistant who has to do a variety of tasks.
+SYSTEM_PROMPT = """You are an assistant who has to do a variety of tasks.
 - Use script_runner for installing packages and running scripts from URLs
 - Use format_file for formatting files with Prettier
 - Use task_runner for tasks involving writing a code
 - Use sort_contacts for sorting contacts in a JSON file by last name and then by first name
 - Use get_completions_image to run the get_completions_image function and save output to a file
 - Use email_sender to run the email_sender function and save output to a file
+- Use extract_mailbox to extract senders and recipients of every message in a mailbox to a CSV or Parquet file
 - Use get_similar_comments to run the get_similar_comments function and save output to a file
 - Use query_sql to run a SQL query and save the result to a file
 - Use logs_recent to retrieve the most recent log files from a directory and save their content to an output file
-- Use markdown_index to index the contents of a directory and save the index to a file"""
-            }
-        ],
-        "tools": tools,
-        "tool_choice": "auto"
-    }
+- Use markdown_index to index the contents of a directory and save the index to a file
+- Use search_docs to search the contents of Markdown documents in a directory
+- Use similar_search to find the lines of a file (e.g. comments) most similar to a given text"""
+
+@app.get("/search")
+def search_endpoint(q:str, dir:str = "/data/docs", limit:int = 10):
+    return search_docs(dir, q, limit)
+
+@app.get("/similar")
+async def similar_endpoint(text:str, k:int = 10, source:str = "/data/comments.txt", backend:str = None):
+    return await similar_search(text, k, source, None, backend)
+
+@app.get("/router/stats")
+async def get_router_stats():
+    return router.router_stats()
+
+@app.get("/embeddings/progress")
+async def get_embedding_progress():
+    return embeddings.progress()
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return await asyncio.to_thread(tool_cache.stats)
+
+@app.delete("/cache")
+async def clear_cache():
+    await asyncio.to_thread(tool_cache.clear)
+    return {"status": "Cache cleared"}
+
+@app.post("/run")
+async def task_runner(task:str):
+    # Known task shapes are routed locally without an LLM round trip
+    routed = router.route(task)
+    if routed:
+        function_name, arguments = routed
+        message = {"tool_calls": [{"function": {"name": function_name, "arguments": arguments}}]}
+        return await dispatch(message)
+    # Then previously planned tool calls for the same (normalized) task; SQLite I/O stays off the event loop
+    cached = await asyncio.to_thread(tool_cache.get, task, TOOLS_HASH)
+    if cached is not None:
+        return await dispatch({"tool_calls": [{"function": call} for call in cached]})
+    message = await plan_tool_calls(task)
+    response = await dispatch(message)
+    # Only cache plans that executed successfully
+    tool_calls = [
+        {"name": call["function"]["name"], "arguments": parse_arguments(call["function"]["arguments"])}
+        for call in message.get("tool_calls", [])
+    ]
+    if tool_calls and response.status_code == 200:
+        await asyncio.to_thread(tool_cache.put, task, TOOLS_HASH, tool_calls)
+    return response
+
+@app.post("/run/batch")
+async def batch_runner(tasks: List[str] = Body(...), concurrency: int = BATCH_CONCURRENCY):
+    # Run many tasks with bounded concurrency, streaming one NDJSON line per task as soon as it finishes
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # Identical tasks share one run (and one LLM planning call) instead of racing on the same outputs
+    groups = {}
+    for index, task in enumerate(tasks):
+        groups.setdefault(normalize_task(task), []).append(index)
+
+    async def run(indices:list):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await task_runner(tasks[indices[0]])
+                status_code, result = response.status_code, response_payload(response)
+            except HTTPException as e:
+                status_code, result = e.status_code, {"detail": e.detail}
+            except Exception as e:
+                status_code, result = 500, {"detail": str(e)}
+            return indices, status_code, result, round((time.perf_counter() - start) * 1000, 3)
+
+    async def stream():
+        pending = [asyncio.create_task(run(indices)) for indices in groups.values()]
+        try:
+            for next_done in asyncio.as_completed(pending):
+                indices, status_code, result, elapsed_ms = await next_done
+                for index in indices:
+                    yield json.dumps({"index": index, "task": tasks[index], "status_code": status_code,
+                                      "elapsed_ms": elapsed_ms, "result": result}) + "\n"
+        finally:
+            # Stop outstanding work if the client disconnects
+            for task in pending:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def parse_arguments(arguments):
+    # If arguments is a string, parse it; otherwise, assume it's already a dict.
+    return json.loads(arguments) if isinstance(arguments, str) else arguments
+
+async def plan_tool_calls(task:str):
+    messages = [
+        {
+            "role": "user",
+            "content": task
+        },
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        }
+    ]
 
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-    except requests.RequestException as e:
+        res_json = await llm.chat(messages, tools=tools, tool_choice="auto")
+    except LLMError as e:
         raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
-    # if not response.ok:
-    #     raise HTTPException(status_code=response.status_code, detail=response.text)
     
     try:
-        res_json = response.json()
         message = res_json['choices'][0]['message']
         # tool_calls = message.get('tool_calls', [])
     except (KeyError, IndexError) as e:
         raise HTTPException(status_code=500, detail=f"Error parsing response: {e}\nResponse: {res_json}")
-    
-    try:
-        function_name = message['tool_calls'][0]['function']['name'] # Extract the function name
-
-        # For A1
-        if function_name == "script_runner":
-            arguments = message['tool_calls'][0]['function']['arguments']
-            # If arguments is a string, parse it; otherwise, assume it's already a dict.
-            if isinstance(arguments, str):
-                func_args = json.loads(arguments)
-            else:
-                func_args = arguments
-            script_url = func_args['script_url']
-            email = func_args['args'][0]
-            command = ["uv","run",script_url, email]
-            try:
-                result = subprocess.run(command, capture_output=True, text=True, check=True)
-                return Response(
-                        content=json.dumps({"output": result.stdout}),
-                        status_code=200,
-                        media_type="application/json"
-                    )
-            except subprocess.CalledProcessError as e:
-                raise HTTPException(
-                        status_code=400,
-                        detail=f"Script execution failed: {e.stderr or e.stdout}"
-                )
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Unknown error: {str(e)}")
-
-        # For A2
-        elif function_name == "format_file":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            path = arguments['path']
-            version = arguments['prettier_version']
-            # Checking if the file exists
-            if not os.path.exists(path):
-                    raise HTTPException(status_code=400, detail=f"File not found: {path}")
-            return format_and_save_markdown(path, version, path)
-        
-            # Use proper formatting command
-            # command = [
-            #     "npx", 
-            #     f"prettier@{version}",
-            #     "--write",
-            #     path
-            # ]
-            # try:
-            #     result = subprocess.run(command, capture_output=True, text=True, check=True)
-            #     return Response(
-            #             content=json.dumps({"output": result.stdout}),
-            #             status_code=200,
-            #             media_type="application/json"
-            #         )
-            # except subprocess.CalledProcessError as e:
-            #     raise HTTPException(
-            #             status_code=400,
-            #             detail=f"Script execution failed: {e.stderr or e.stdout}"
-            #     )
-            # except Exception as e:
-            #     raise HTTPException(status_code=500, detail=f"Formatter error: {str(e)}")
-
-        # For A3
-        elif function_name == "count_days":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            day = arguments['day_of_week']
-            input_file_path = arguments['input_file_path']
-            output_file_path = arguments['output_file_path']
-            return count_days(day, input_file_path, output_file_path)
-
-        # For A4
-        elif function_name == "sort_contacts":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            # Parse and validate arguments
-            arguments = json.loads(raw_arguments) if isinstance(raw_arguments, str) else raw_arguments
-            # Check required parameters exist
-            if 'input_path' not in arguments or 'output_path' not in arguments:
-                missing = [k for k in ['input_path', 'output_path'] if k not in arguments]
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Missing parameters: {', '.join(missing)}"
-                )
-            input_file_path = arguments['input_path']
-            output_file_path = arguments['output_path']
-            try:
-                with open(input_file_path, "r") as f:
-                    contacts = json.load(f)
-                # sorted_contacts = sorted(
-                #     contacts, key=lambda contact: (contact.get("last_name", ""), contact.get("first_name", ""))
-                # )
-                contacts.sort(key=lambda c: (c["last_name"], c["first_name"]))
-                with open(output_file_path, "w") as f:
-                    json.dump(contacts, f) # changed to contacts
-                return Response(
-                    content=json.dumps({"message": "Contacts sorted successfully", "sorted_count": len(contacts)}),
-                    status_code=200,
-                    media_type="application/json")
-            except FileNotFoundError:
-                raise HTTPException(status_code=400, detail="Contacts file not found")
-            except Exception as ex:
-                raise HTTPException(status_code=500, detail=f"Error sorting contacts: {ex}")
-
-        # For A5
-        elif function_name == "logs_recent":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            log_dir_path = arguments['log_dir_path']
-            output_file_path = arguments['output_file_path']
-            num_files = arguments['num_files']
-            return log_recent(log_dir_path, output_file_path, num_files)
-
-        # For A6
-        elif function_name == "markdown_index":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            doc_dir_path = arguments['doc_dir_path']
-            output_file_path = arguments['output_file_path']
-            return markdown_index(doc_dir_path, output_file_path)
-
-        # For A7
-        elif function_name == "email_sender":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            input_location = arguments['input_location']
-            output_location = arguments['output_location']
-            return email_sender(input_location, output_location)
-
-        # For A8
-        elif function_name == "get_completions_image":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            input_location = arguments['input_location']
-            output_location = arguments['output_location']
-            return get_completions_image(input_location, output_location)
-
-        # For A9
-        elif function_name == "get_similar_comments":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            input_location = arguments['input_location']
-            output_location = arguments['output_location']
-            return get_similar_comments(input_location, output_location)
-
-        # For A10
-        elif function_name == "query_sql":
-            raw_arguments = message['tool_calls'][0]['function']['arguments']
-            if isinstance(raw_arguments, str):
-                arguments = json.loads(raw_arguments)
-            else:
-                arguments = raw_arguments
-            query = arguments['query']
-            filename = arguments['filename']
-            output_filename = arguments['output_filename']
-            return query_sql(query, filename, output_filename)
+    return message
 
-        else:
-            raise HTTPException(status_code=500, detail=f"Unknown function: {function_name}")
+def call_paths(function_name:str, arguments:dict):
+    # Input and output paths of a call; None for tools without declared I/O, which run as a barrier
+    tool = registry.get(function_name)
+    if tool is None or tool.inputs is None or not isinstance(arguments, dict):
+        return None
+    def paths(keys):
+        return {os.path.normpath(os.path.abspath(arguments[k])) for k in keys if isinstance(arguments.get(k), str)}
+    return paths(tool.inputs), paths(tool.outputs)
+
+def paths_overlap(a:set, b:set):
+    # Same path, or one is a directory containing the other
+    return any(x == y or x.startswith(y + os.sep) or y.startswith(x + os.sep) for x in a for y in b)
+
+def plan_dependencies(calls:list):
+    # Returns, for each call, the indices of the calls it must wait for. Every edge points from an earlier
+    # call to a later one, so the listed order is kept wherever two calls touch the same path: a reader
+    # waits for an earlier writer, a writer for earlier readers and writers; barriers order against everything.
+    io = [call_paths(name, arguments) for name, arguments in calls]
+    deps = [set() for _ in calls]
+    for j in range(len(calls)):
+        for i in range(j):
+            if io[i] is None or io[j] is None:
+                deps[j].add(i)
+                continue
+            (reads_i, writes_i), (reads_j, writes_j) = io[i], io[j]
+            if paths_overlap(writes_i, reads_j | writes_j) or paths_overlap(reads_i, writes_j):
+                deps[j].add(i)
+    return deps
+
+def response_payload(response):
+    if isinstance(response, Response):
+        try:
+            return json.loads(response.body)
+        except ValueError:
+            return response.body.decode()
+    return response
+
+async def dispatch(message:dict):
+    tool_calls = message.get('tool_calls') or []
+    if not tool_calls:
+        raise HTTPException(status_code=500, detail=f"Error executing script: no tool_calls in response: {message}")
+    if len(tool_calls) == 1:
+        start = time.perf_counter()
+        response = await execute_tool_call(tool_calls[0])
+        if isinstance(response, Response):
+            response.headers["X-Tool-Elapsed-Ms"] = f"{(time.perf_counter() - start) * 1000:.3f}"
+        return response
+    return await run_tool_calls(tool_calls)
 
+async def run_tool_calls(tool_calls:list):
+    # Execute every tool call, independent ones concurrently and dependent ones in order
+    start = time.perf_counter()
+    calls = [(call['function']['name'], parse_arguments(call['function']['arguments'])) for call in tool_calls]
+    deps = plan_dependencies(calls)
+    results = [None] * len(calls)
+    tasks = []
+
+    async def run(i:int):
+        name, arguments = calls[i]
+        entry = {"id": tool_calls[i].get("id", i), "name": name, "arguments": arguments, "depends_on": sorted(deps[i])}
+        results[i] = entry
+        if not all([await tasks[d] for d in deps[i]]):
+            entry.update(status="skipped", detail="A dependency failed")
+            return False
+        call_start = time.perf_counter()
+        try:
+            entry.update(status="success", result=response_payload(await execute_tool_call(tool_calls[i])))
+        except HTTPException as e:
+            entry.update(status="error", status_code=e.status_code, detail=e.detail)
+        except Exception as e:
+            entry.update(status="error", status_code=500, detail=str(e))
+        entry["elapsed_ms"] = round((time.perf_counter() - call_start) * 1000, 3)
+        return entry["status"] == "success"
+
+    tasks.extend(asyncio.create_task(run(i)) for i in range(len(calls)))
+    await asyncio.gather(*tasks)
+    ok = all(entry["status"] == "success" for entry in results)
+    return Response(
+        content=json.dumps({
+            "status": "success" if ok else "partial",
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+            "results": results,
+        }),
+        status_code=200 if ok else 207,
+        media_type="application/json")
+
+async def execute_tool_call(call:dict):
+    function_name = call['function']['name'] # Extract the function name
+    tool = registry.get(function_name)
+    if tool is None:
+        raise HTTPException(status_code=500, detail=f"Unknown function: {function_name}")
+    try:
+        return await tool.run(call['function']['arguments'])
+    except ValidationError as ex:
+        raise HTTPException(status_code=400, detail=f"Invalid arguments for {function_name}: {ex}")
+    except HTTPException:
+        raise
     except Exception as ex:
-        raise HTTPException(status_code=500, detail=f"Error executing script: {ex}")   
+        raise HTTPException(status_code=500, detail=f"Error executing script: {ex}")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,83 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "faker",
+#     "orjson",
+# ]
+# ///
+
+# Benchmark sort_contacts modes on get_contacts-style data scaled up to tens of millions of rows.
+# Usage: uv run bench_contacts.py --sizes 1000000 10000000 50000000 --modes memory parallel external
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from faker import Faker
+
+import contacts
+
+
+def write_contacts(path: str, rows: int, seed: int = 0, chunk: int = 100_000):
+    # Same shape as datagen.get_contacts, drawn from a name pool so generation stays fast at 50M rows
+    fake = Faker()
+    fake.seed_instance(seed)
+    first_names = [fake.first_name() for _ in range(5000)]
+    last_names = [fake.last_name() for _ in range(5000)]
+    domains = [fake.free_email_domain() for _ in range(50)]
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for start in range(0, rows, chunk):
+            batch = []
+            for i in range(start, min(rows, start + chunk)):
+                first, last = rng.choice(first_names), rng.choice(last_names)
+                email = f"{first.lower()}.{last.lower()}{i}@{rng.choice(domains)}"
+                batch.append(json.dumps({"first_name": first, "last_name": last, "email": email}))
+            f.write((", " if start else "") + ", ".join(batch))
+        f.write("]")
+
+
+def run(mode: str, input_path: str, output_path: str):
+    spec = contacts.SortSpec()
+    if mode == "external":
+        return contacts.external_sort_contacts(input_path, output_path, spec)
+    with open(input_path, "rb" if contacts.orjson is not None else "r") as f:
+        data = contacts.load_json(f)
+    workers = 1 if mode == "memory" else contacts.CONTACTS_SORT_WORKERS
+    data = contacts.sort_in_memory(data, spec, workers=workers)
+    contacts._write_json_array(map(json.dumps, data), output_path)
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark contact sorting modes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 5_000_000, 10_000_000, 50_000_000])
+    parser.add_argument("--modes", nargs="+", default=["memory", "parallel", "external"],
+                        choices=["memory", "parallel", "external"])
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Directory for generated files")
+    args = parser.parse_args()
+    # Let --modes alone decide between serial and parallel in-memory sorting
+    contacts.CONTACTS_PARALLEL_THRESHOLD = 0
+
+    print(f"workers={contacts.CONTACTS_SORT_WORKERS} memory_budget={contacts.CONTACTS_SORT_MEMORY} "
+          f"orjson={'yes' if contacts.orjson is not None else 'no'}")
+    print(f"{'rows':>12} {'mode':>10} {'seconds':>10} {'rows/s':>14}")
+    for rows in args.sizes:
+        input_path = os.path.join(args.dir, f"bench-contacts-{rows}.json")
+        output_path = os.path.join(args.dir, f"bench-contacts-{rows}-sorted.json")
+        if not os.path.exists(input_path):
+            write_contacts(input_path, rows)
+        for mode in args.modes:
+            start = time.perf_counter()
+            count = run(mode, input_path, output_path)
+            elapsed = time.perf_counter() - start
+            print(f"{count:>12} {mode:>10} {elapsed:>10.2f} {count / elapsed:>14,.0f}")
+        os.remove(output_path)
+
+
+if __name__ == "__main__":
+    main()
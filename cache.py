@@ -0,0 +1,116 @@
+# Persistent cache of the LLM's tool_calls output, keyed on normalized task text and the tools schema.
+# Stored in SQLite so a restarted container is already warm for recurring tasks.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from threading import Lock
+
+CACHE_DIR = os.getenv("CACHE_DIR", "/data/.cache")
+TOOL_CACHE_PATH = os.getenv("TOOL_CACHE_PATH", os.path.join(CACHE_DIR, "tool_calls.sqlite"))
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", str(7 * 24 * 60 * 60)))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "10000"))
+
+
+def normalize_task(task: str) -> str:
+    # Collapse whitespace and unicode variants; paths and quoted values are case-sensitive so case is kept
+    task = unicodedata.normalize("NFKC", task)
+    return re.sub(r"\s+", " ", task).strip().rstrip(".!?").strip()
+
+
+def schema_hash(tools: list) -> str:
+    return hashlib.sha256(json.dumps(tools, sort_keys=True).encode()).hexdigest()
+
+
+class ToolCallCache:
+    def __init__(self, path: str = TOOL_CACHE_PATH, ttl: float = TOOL_CACHE_TTL,
+                 max_entries: int = TOOL_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS tool_calls (
+                key TEXT PRIMARY KEY,
+                task TEXT NOT NULL,
+                tool_calls TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0)""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tool_calls_last_used ON tool_calls (last_used)")
+        return self._conn
+
+    @staticmethod
+    def key(task: str, tools_hash: str) -> str:
+        return hashlib.sha256(f"{tools_hash}\0{normalize_task(task)}".encode()).hexdigest()
+
+    def get(self, task: str, tools_hash: str):
+        # Returns the cached [{"name": ..., "arguments": {...}}, ...] or None
+        key, now = self.key(task, tools_hash), time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT tool_calls, created_at FROM tool_calls WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM tool_calls WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE tool_calls SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, task: str, tools_hash: str, tool_calls: list):
+        key, now = self.key(task, tools_hash), time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tool_calls (key, task, tool_calls, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, normalize_task(task), json.dumps(tool_calls), now, now))
+            self._evict(now)
+
+    def _evict(self, now: float):
+        # Drop expired entries, then the least recently used ones beyond the size cap
+        self.conn.execute("DELETE FROM tool_calls WHERE created_at < ?", (now - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM tool_calls WHERE key IN "
+            "(SELECT key FROM tool_calls ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM tool_calls")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM tool_calls").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+tool_cache = ToolCallCache()
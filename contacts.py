@@ -0,0 +1,267 @@
+# Contact sorting engine for sort_contacts.
+# - Sort order is a list of (field, direction) keys with binary, casefold or locale collation.
+# - Files are decoded with orjson when installed; records are re-encoded exactly like json.dump,
+#   so every mode produces byte-identical output.
+# - Large in-memory sorts are partitioned across a process pool and k-way merged.
+# - Arrays too large to load at once use an external merge: incremental parsing, memory-bounded
+#   runs spilled to temp files (sorted in the pool) and a stable k-way merge.
+
+import heapq
+import json
+import locale
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import total_ordering
+from threading import Lock
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CONTACTS_SORT_MEMORY = int(os.getenv("CONTACTS_SORT_MEMORY", str(256 * 1024 * 1024)))
+CONTACTS_STREAM_THRESHOLD = int(os.getenv("CONTACTS_STREAM_THRESHOLD", str(64 * 1024 * 1024)))
+CONTACTS_MERGE_FAN_IN = int(os.getenv("CONTACTS_MERGE_FAN_IN", "64"))
+CONTACTS_SORT_WORKERS = int(os.getenv("CONTACTS_SORT_WORKERS", str(os.cpu_count() or 1)))
+CONTACTS_PARALLEL_THRESHOLD = int(os.getenv("CONTACTS_PARALLEL_THRESHOLD", "500000"))
+READ_CHUNK = 1 << 20
+# Rough in-memory cost of a run entry relative to its serialized size (str objects, key tuple, list slot)
+ENTRY_OVERHEAD = 3
+
+WHITESPACE = " \t\n\r"
+DEFAULT_SORT_KEYS = [{"field": "last_name", "descending": False}, {"field": "first_name", "descending": False}]
+COLLATIONS = ("binary", "casefold", "locale")
+
+# Locale collation uses the process-wide LC_COLLATE, configured once at startup
+if os.getenv("SORT_LOCALE"):
+    locale.setlocale(locale.LC_COLLATE, os.getenv("SORT_LOCALE"))
+
+
+@total_ordering
+class Descending:
+    # Inverts comparisons so mixed-direction keys still sort with a single stable pass
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class SortSpec:
+    def __init__(self, keys: list = None, collation: str = "binary"):
+        keys = keys or DEFAULT_SORT_KEYS
+        if collation not in COLLATIONS:
+            raise ValueError(f"Unknown collation: {collation}")
+        self.fields = [key["field"] if isinstance(key, dict) else key for key in keys]
+        self.directions = [bool(key.get("descending")) if isinstance(key, dict) else False for key in keys]
+        self.collation = collation
+        # All keys in one direction sort with reverse=True; only mixed directions need the wrapper
+        self.reverse = all(self.directions)
+        self.mixed = any(self.directions) and not self.reverse
+
+    def _collate(self, value):
+        if not isinstance(value, str) or self.collation == "binary":
+            return value
+        if self.collation == "casefold":
+            return value.casefold()
+        return locale.strxfrm(value)
+
+    def raw_key(self, contact: dict) -> list:
+        # Plain, JSON-serializable key values (run files store these)
+        return [self._collate(contact[field]) for field in self.fields]
+
+    def order_key(self, raw: list):
+        if self.mixed:
+            return tuple(Descending(v) if d else v for v, d in zip(raw, self.directions))
+        return tuple(raw)
+
+
+def load_json(f):
+    if orjson is not None:
+        return orjson.loads(f.read())
+    return json.load(f)
+
+
+def iter_json_array(f, chunk_size: int = READ_CHUNK):
+    # Yield the elements of a top-level JSON array from a text file without loading it whole
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    fill()
+    skip_whitespace()
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    skip_whitespace()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+    while True:
+        skip_whitespace()
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+            # A value ending exactly at the buffer edge (e.g. a number) may continue in the next chunk
+            if end == len(buf) and not eof:
+                raise json.JSONDecodeError("Incomplete value", buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        pos = end
+        yield item
+        skip_whitespace()
+        if pos >= len(buf):
+            raise ValueError("Unterminated JSON array")
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise ValueError(f"Expected ',' or ']' in JSON array, got {buf[pos]!r}")
+        pos += 1
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=CONTACTS_SORT_WORKERS)
+        return _pool
+
+
+def _sort_entries(entries: list, spec: SortSpec) -> list:
+    entries.sort(key=lambda entry: spec.order_key(entry[0]), reverse=spec.reverse)
+    return entries
+
+
+def _merge(sources: list, spec: SortSpec):
+    # heapq.merge is stable across sources, which keeps ties in input order like list.sort
+    return heapq.merge(*sources, key=lambda entry: spec.order_key(entry[0]), reverse=spec.reverse)
+
+
+def _write_json_array(records, output_path: str, tmp_dir: str = None):
+    # Same bytes as json.dump(list, f): "[" + ", ".join(records) + "]", written atomically
+    tmp_dir = tmp_dir or os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_output = tempfile.mkstemp(prefix="contacts-sorted-", suffix=".json", dir=tmp_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as out:
+        out.write("[")
+        for i, record in enumerate(records):
+            if i:
+                out.write(", ")
+            out.write(record)
+        out.write("]")
+    os.replace(tmp_output, output_path)
+
+
+def sort_in_memory(contacts: list, spec: SortSpec, workers: int = CONTACTS_SORT_WORKERS) -> list:
+    if workers <= 1 or len(contacts) < CONTACTS_PARALLEL_THRESHOLD:
+        return sorted(contacts, key=lambda contact: spec.order_key(spec.raw_key(contact)), reverse=spec.reverse)
+    # Partition (key, index) pairs across processes, then k-way merge the sorted partitions
+    entries = [(spec.raw_key(contact), i) for i, contact in enumerate(contacts)]
+    size = -(-len(entries) // workers)
+    partitions = [entries[i:i + size] for i in range(0, len(entries), size)]
+    sorted_partitions = list(_get_pool().map(_sort_entries, partitions, [spec] * len(partitions)))
+    return [contacts[i] for _, i in _merge(sorted_partitions, spec)]
+
+
+def _write_run(entries: list, tmp_dir: str) -> str:
+    # One "<key json>\t<record json>" line per entry; JSON escapes tabs, so the first tab is the separator
+    fd, path = tempfile.mkstemp(prefix="contacts-run-", suffix=".tsv", dir=tmp_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for key, record in entries:
+            f.write(json.dumps(key))
+            f.write("\t")
+            f.write(record)
+            f.write("\n")
+    return path
+
+
+def _sort_and_write_run(entries: list, spec: SortSpec, tmp_dir: str) -> str:
+    return _write_run(_sort_entries(entries, spec), tmp_dir)
+
+
+def _read_run(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            key, record = line.rstrip("\n").split("\t", 1)
+            yield json.loads(key), record
+
+
+def _merge_runs(paths: list, spec: SortSpec, tmp_dir: str) -> str:
+    merged = _write_run(_merge([_read_run(path) for path in paths], spec), tmp_dir)
+    for path in paths:
+        os.remove(path)
+    return merged
+
+
+def external_sort_contacts(input_path: str, output_path: str, spec: SortSpec = None,
+                           memory_budget: int = CONTACTS_SORT_MEMORY, workers: int = CONTACTS_SORT_WORKERS) -> int:
+    spec = spec or SortSpec()
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    count, runs, in_flight = 0, [], deque()
+    pool = _get_pool() if workers > 1 else None
+    # Up to `workers` runs are held at once, so each gets an equal share of the budget
+    run_budget = max(1, memory_budget // workers) if pool is not None else memory_budget
+    with tempfile.TemporaryDirectory(prefix="contacts-sort-", dir=output_dir) as tmp_dir:
+        with open(input_path, "r", encoding="utf-8") as f:
+            entries, size = [], 0
+            for contact in iter_json_array(f):
+                record = json.dumps(contact)
+                entries.append((spec.raw_key(contact), record))
+                size += len(record) * ENTRY_OVERHEAD
+                count += 1
+                if size >= run_budget:
+                    # Sort and spill full runs in the pool while parsing continues, with at most
+                    # `workers` runs in flight so parsing can't outpace the pool and pile up runs in memory
+                    if pool is not None:
+                        if len(in_flight) >= workers:
+                            runs.append(in_flight.popleft().result())
+                        in_flight.append(pool.submit(_sort_and_write_run, entries, spec, tmp_dir))
+                    else:
+                        runs.append(_sort_and_write_run(entries, spec, tmp_dir))
+                    entries, size = [], 0
+        runs.extend(run.result() for run in in_flight)
+        _sort_entries(entries, spec)
+        # Bound the number of open files with multi-pass merging
+        while len(runs) > CONTACTS_MERGE_FAN_IN:
+            runs = [_merge_runs(runs[i:i + CONTACTS_MERGE_FAN_IN], spec, tmp_dir)
+                    for i in range(0, len(runs), CONTACTS_MERGE_FAN_IN)]
+        sources = [_read_run(path) for path in runs] + [iter(entries)]
+        _write_json_array((record for _, record in _merge(sources, spec)), output_path, tmp_dir)
+    return count
+
+
+def sort_contacts_file(input_path: str, output_path: str, spec: SortSpec = None) -> dict:
+    spec = spec or SortSpec()
+    if os.path.getsize(input_path) > CONTACTS_STREAM_THRESHOLD:
+        return {"sorted_count": external_sort_contacts(input_path, output_path, spec), "mode": "external"}
+    with open(input_path, "rb" if orjson is not None else "r") as f:
+        contacts = load_json(f)
+    contacts = sort_in_memory(contacts, spec)
+    _write_json_array(map(json.dumps, contacts), output_path)
+    mode = "parallel" if CONTACTS_SORT_WORKERS > 1 and len(contacts) >= CONTACTS_PARALLEL_THRESHOLD else "memory"
+    return {"sorted_count": len(contacts), "mode": mode}
@@ -0,0 +1,196 @@
+# Vectorized date-counting engine for count_days.
+# Lines are grouped by a cheap shape signature (digits -> d, letters -> a), each group is parsed in bulk
+# with pandas using the matching format, and weekday histograms are accumulated chunk by chunk.
+# Histograms are memoized per (path, mtime, size) in memory and in a JSON sidecar under CACHE_DIR.
+
+import bisect
+import hashlib
+import json
+import os
+import string
+import tempfile
+from collections import Counter, OrderedDict
+from datetime import date
+from itertools import islice
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+DATES_CHUNK_LINES = int(os.getenv("DATES_CHUNK_LINES", "1000000"))
+MAX_MALFORMED_SAMPLES = 20
+DATES_INDEX_DIR = os.path.join(os.getenv("CACHE_DIR", "/data/.cache"), "dates")
+DATES_INDEX_MEMORY = int(os.getenv("DATES_INDEX_MEMORY", "128"))
+# Bumped when parsing changes, so sidecars written by an older version are re-parsed
+DATES_INDEX_VERSION = 2
+
+SIGNATURE_TABLE = str.maketrans(string.digits + string.ascii_letters, "d" * 10 + "a" * 52)
+DATE_FORMATS = {
+    "aaa dd, dddd": "%b %d, %Y",                 # Apr 04, 2006
+    "dddd-dd-dd": "%Y-%m-%d",                    # 2017-01-09
+    "dd-aaa-dddd": "%d-%b-%Y",                   # 17-Dec-2001
+    "dddd/dd/dd": "%Y/%m/%d",                    # 2006/04/12
+    "dddd/dd/dd dd:dd:dd": "%Y/%m/%d %H:%M:%S",  # 2006/04/12 21:29:21
+    "dddd-dd-dd dd:dd:dd": "%Y-%m-%d %H:%M:%S",  # 2006-04-12 21:29:21
+    "dddd-dd-ddadd:dd:dd": "%Y-%m-%dT%H:%M:%S",  # 2006-04-12T21:29:21
+}
+
+
+def weekday_index(day: str) -> int:
+    # Accepts "wednesday", "Wednesdays", "wed", ...
+    day = day.strip().lower().rstrip("s")
+    for index, name in enumerate(WEEKDAYS):
+        if len(day) >= 3 and name.startswith(day):
+            return index
+    raise ValueError(f"Invalid day of the week: {day}")
+
+
+def _wall_time(value):
+    # Timestamp as written in the line, its UTC offset dropped
+    return value.tz_localize(None) if isinstance(value, pd.Timestamp) and value.tzinfo is not None else value
+
+
+def _parse_group(values: pd.Series, fmt: str):
+    # Naive timestamps in local wall time: a line with an offset counts on the day written in it, so the
+    # weekday totals and the per-day histogram (and with it date-range counts) always agree
+    fmt = fmt or "mixed"
+    try:
+        parsed = pd.to_datetime(values, format=fmt, errors="coerce")
+    except ValueError:
+        # Different offsets (or offset and naive) in one group: pandas only combines them in UTC
+        parsed = pd.to_datetime(pd.Series([_wall_time(pd.to_datetime(value, format=fmt, errors="coerce"))
+                                           for value in values], index=values.index, dtype=object))
+    if getattr(parsed.dt, "tz", None) is not None:
+        parsed = parsed.dt.tz_localize(None)
+    return parsed
+
+
+def count_weekdays(path: str, chunk_lines: int = DATES_CHUNK_LINES) -> dict:
+    weekdays = np.zeros(7, dtype=np.int64)
+    days = Counter()
+    total, malformed, samples = 0, 0, []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        offset = 0
+        while True:
+            # Stream fixed-size chunks so memory stays flat on huge files
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                break
+            values = pd.Series([line.strip() for line in lines], dtype=object)
+            values = values[values != ""]
+            signatures = pd.Series([value.translate(SIGNATURE_TABLE) for value in values], index=values.index)
+            for signature, positions in signatures.groupby(signatures, sort=False).indices.items():
+                group = values.iloc[positions]
+                parsed = _parse_group(group, DATE_FORMATS.get(signature))
+                valid = parsed.notna().to_numpy()
+                weekdays += np.bincount(parsed[valid].dt.dayofweek.to_numpy(), minlength=7)
+                # Per-calendar-day counts back the month and date-range histograms
+                unique_days, day_counts = np.unique(parsed[valid].to_numpy().astype("datetime64[D]"), return_counts=True)
+                days.update(dict(zip(unique_days.astype(str).tolist(), day_counts.tolist())))
+                total += int(valid.sum())
+                if not valid.all():
+                    bad = group[~valid]
+                    malformed += len(bad)
+                    for index, value in bad.items():
+                        if len(samples) >= MAX_MALFORMED_SAMPLES:
+                            break
+                        samples.append({"line": offset + int(index) + 1, "value": value})
+            offset += len(lines)
+    day_keys = sorted(days)
+    months = Counter()
+    for key in day_keys:
+        months[key[:7]] += days[key]
+    return {
+        "weekdays": [int(count) for count in weekdays],
+        "months": dict(months),
+        "day_keys": day_keys,
+        "day_counts": [days[key] for key in day_keys],
+        "total": total,
+        "malformed": malformed,
+        "malformed_samples": sorted(samples, key=lambda sample: sample["line"]),
+    }
+
+
+class DateHistogram:
+    # Parsed histogram of one date file, with per-weekday prefix sums for O(log n) date-range counts
+    def __init__(self, data: dict):
+        self.data = data
+        self.day_keys = data["day_keys"]
+        counts = np.asarray(data["day_counts"], dtype=np.int64)
+        weekday_of = np.array([date.fromisoformat(key).weekday() for key in self.day_keys], dtype=np.int8)
+        # Row 7 holds all weekdays together
+        per_weekday = np.zeros((8, len(counts)), dtype=np.int64)
+        per_weekday[weekday_of, np.arange(len(counts))] = counts
+        per_weekday[7] = counts
+        self.prefix = np.concatenate([np.zeros((8, 1), dtype=np.int64), np.cumsum(per_weekday, axis=1)], axis=1)
+
+    def count(self, weekday: int = None, start: str = None, end: str = None) -> int:
+        # Inclusive ISO date bounds; with no bounds the weekday count is a plain lookup
+        if start is None and end is None:
+            return self.data["weekdays"][weekday] if weekday is not None else self.data["total"]
+        lo = bisect.bisect_left(self.day_keys, start[:10]) if start else 0
+        hi = bisect.bisect_right(self.day_keys, end[:10]) if end else len(self.day_keys)
+        row = 7 if weekday is None else weekday
+        return int(self.prefix[row, hi] - self.prefix[row, lo])
+
+
+_memory = OrderedDict()
+_memory_lock = Lock()
+
+
+def _sidecar_path(path: str) -> str:
+    return os.path.join(DATES_INDEX_DIR, hashlib.sha1(path.encode()).hexdigest() + ".json")
+
+
+def _load_sidecar(path: str, key: list):
+    try:
+        with open(_sidecar_path(path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if data.get("key") == key else None
+    except (OSError, ValueError):
+        return None
+
+
+def _save_sidecar(path: str, data: dict):
+    # Best effort and atomic: a read-only or missing cache dir only costs a re-parse next time.
+    # The temp file is unique, so concurrent count_days calls on one file never share it.
+    try:
+        os.makedirs(DATES_INDEX_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=DATES_INDEX_DIR, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, _sidecar_path(path))
+    except BaseException as e:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        if not isinstance(e, OSError):
+            raise
+
+
+def date_histogram(path: str) -> DateHistogram:
+    # Keyed by path, mtime and size so any change to the file invalidates the index
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = [path, stat.st_mtime_ns, stat.st_size, DATES_INDEX_VERSION]
+    with _memory_lock:
+        histogram = _memory.get(path)
+        if histogram is not None and histogram.data["key"] == key:
+            _memory.move_to_end(path)
+            return histogram
+    data = _load_sidecar(path, key)
+    if data is None:
+        data = {"key": key, **count_weekdays(path)}
+        _save_sidecar(path, data)
+    histogram = DateHistogram(data)
+    with _memory_lock:
+        _memory[path] = histogram
+        _memory.move_to_end(path)
+        while len(_memory) > DATES_INDEX_MEMORY:
+            _memory.popitem(last=False)
+    return histogram
@@ -0,0 +1,134 @@
+# Incremental Markdown H1 indexer for markdown_index.
+# The tree is walked with os.scandir, and only the prefix of each file up to its first "# " heading is read,
+# on a bounded thread pool. Titles are memoized in a (path, mtime, size) manifest persisted under CACHE_DIR,
+# so re-indexing a large tree only reads the files that changed since the last run.
+
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+DOCS_IO_WORKERS = int(os.getenv("DOCS_IO_WORKERS", "16"))
+DOCS_INDEX_DIR = os.path.join(os.getenv("CACHE_DIR", "/data/.cache"), "docs")
+DOCS_EXTENSIONS = (".md",)
+
+
+def iter_markdown(root: str, extensions: tuple = DOCS_EXTENSIONS, on_directory=None):
+    # Yield (relative path, mtime_ns, size) for every Markdown file under root, "/"-separated.
+    # on_directory(directory, prefix) is called before each directory is listed.
+    stack = [(root, "")]
+    while stack:
+        directory, prefix = stack.pop()
+        if on_directory is not None:
+            on_directory(directory, prefix)
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        # Symlinked directories are not followed, so a link cycle can't loop the walk
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, prefix + entry.name + "/"))
+                        elif entry.name.endswith(extensions) and entry.is_file():
+                            stat = entry.stat()
+                            yield prefix + entry.name, stat.st_mtime_ns, stat.st_size
+                    except OSError:
+                        continue
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            if directory == root:
+                raise
+            continue
+
+
+def first_heading(path: str):
+    # Title of the first "# " line; reading stops there, so long documents only cost their prefix
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if line.startswith(b"# "):
+                    return line[2:].decode("utf-8", errors="replace").strip()
+    except OSError:
+        pass
+    return None
+
+
+_manifests = {}
+_manifests_lock = Lock()
+
+
+def _manifest_path(root: str) -> str:
+    return os.path.join(DOCS_INDEX_DIR, hashlib.sha1(root.encode()).hexdigest() + ".json")
+
+
+def _load_manifest(root: str) -> dict:
+    with _manifests_lock:
+        if root in _manifests:
+            return _manifests[root]
+    try:
+        with open(_manifest_path(root), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data["entries"] if data.get("root") == root else {}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _save_manifest(root: str, entries: dict):
+    # Best effort and atomic: a read-only or missing cache dir only costs a full re-read next time
+    with _manifests_lock:
+        _manifests[root] = entries
+    try:
+        os.makedirs(DOCS_INDEX_DIR, exist_ok=True)
+        write_json_atomic({"root": root, "entries": entries}, _manifest_path(root), indent=None)
+    except OSError:
+        pass
+
+
+def write_json_atomic(data, output_path: str, indent: int = 2):
+    # A unique temp file beside the target, so concurrent writers never share one; removed on failure
+    fd, tmp_output = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)),
+                                      prefix=f".{os.path.basename(output_path)}.", suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent)
+        os.chmod(tmp_output, 0o644)
+        os.replace(tmp_output, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_output)
+        except OSError:
+            pass
+        raise
+
+
+def build_index(root: str, workers: int = DOCS_IO_WORKERS) -> tuple:
+    # Returns ({relative path: title}, stats); files without an H1 are left out of the index
+    root = os.path.abspath(root)
+    previous = _load_manifest(root)
+    entries, stale = {}, []
+    for relative, mtime_ns, size in iter_markdown(root):
+        cached = previous.get(relative)
+        if cached is not None and cached[0] == mtime_ns and cached[1] == size:
+            entries[relative] = cached
+        else:
+            entries[relative] = [mtime_ns, size, None]
+            stale.append(relative)
+    if stale:
+        paths = [os.path.join(root, relative) for relative in stale]
+        if len(paths) == 1:
+            titles = [first_heading(paths[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+                titles = list(pool.map(first_heading, paths))
+        for relative, title in zip(stale, titles):
+            entries[relative][2] = title
+    if stale or len(entries) != len(previous):
+        _save_manifest(root, entries)
+    index = {relative: entries[relative][2] for relative in sorted(entries) if entries[relative][2] is not None}
+    return index, {"files": len(entries), "read": len(stale), "reused": len(entries) - len(stale)}
+
+
+def markdown_titles(root: str, output_path: str) -> dict:
+    index, stats = build_index(root)
+    write_json_atomic(index, output_path)
+    return {**stats, "indexed": len(index)}
@@ -0,0 +1,411 @@
+# Local email header extraction for email_sender.
+# Only the header block of a message is read, so bodies and attachments are never loaded. Headers are
+# parsed with the stdlib email package: a fast compat32 pass with RFC 2047 decoding of encoded words,
+# retried with the stricter (and ~6x slower) policy.default parser when it finds no sender. Batch mode streams an mbox file or a directory of .eml files one message at a time.
+# Mailbox mode splits an mbox (at message boundaries) or a maildir into chunks parsed across a process
+# pool and streams the rows to CSV or Parquet; messages that need the LLM are resolved in batches as they
+# turn up, so memory stays bounded however many are malformed.
+# Both modes name a message by its relative path, or "<mbox name>@<byte offset of its From line>", so their
+# outputs can be joined on source.
+
+import csv
+import json
+import os
+import re
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from email.utils import getaddresses, parsedate_to_datetime
+from threading import Lock
+
+from logs import iter_files
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EMAIL_MAX_HEADER_BYTES = int(os.getenv("EMAIL_MAX_HEADER_BYTES", str(256 * 1024)))
+HEADER_FIELDS = ("from", "to", "cc", "date", "subject")
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", str(os.cpu_count() or 1)))
+EMAIL_CHUNK_BYTES = int(os.getenv("EMAIL_CHUNK_BYTES", str(32 * 1024 * 1024)))
+EMAIL_CHUNK_FILES = int(os.getenv("EMAIL_CHUNK_FILES", "2000"))
+EMAIL_LLM_BATCH = int(os.getenv("EMAIL_LLM_BATCH", "50"))
+EMAIL_LLM_MAX_MESSAGES = int(os.getenv("EMAIL_LLM_MAX_MESSAGES", "1000"))
+# Header text sent to the LLM per unparseable message
+EMAIL_LLM_HEADER_CHARS = 2000
+MAILBOX_COLUMNS = ("source", "from", "from_name", "to", "cc", "date", "subject", "engine", "error")
+
+FOLD_RE = re.compile(r"\r?\n(?=[ \t])")
+
+_fast_parser = BytesHeaderParser()
+_parser = BytesHeaderParser(policy=policy.default)
+
+
+class EmailParseError(ValueError):
+    pass
+
+
+def read_header_block(f, max_bytes: int = EMAIL_MAX_HEADER_BYTES) -> bytes:
+    # Lines up to (not including) the first blank line, capped at max_bytes
+    lines, size = [], 0
+    for line in f:
+        if not line.strip(b"\r\n"):
+            break
+        lines.append(line)
+        size += len(line)
+        if size >= max_bytes:
+            break
+    return b"".join(lines)
+
+
+def _decode(value):
+    # RFC 2047 encoded words ("=?utf-8?q?...?=") to text
+    if value is None:
+        return None
+    # Unfold continuation lines (RFC 5322 2.2.3)
+    value = FOLD_RE.sub("", str(value))
+    if "=?" not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except (HeaderParseError, LookupError, UnicodeError, ValueError):
+        return value
+
+
+def _fast_addresses(message, name: str) -> list:
+    # Split the raw header first so decoded display names containing "," or "<" cannot break it
+    pairs = getaddresses([str(value) for value in message.get_all(name) or []])
+    return [(_decode(display), address) for display, address in pairs if "@" in address]
+
+
+def _addresses(message, name: str) -> list:
+    # [(display name, address)] from an address header; unparseable structured headers fall back to getaddresses
+    values = message.get_all(name) or []
+    pairs = []
+    for value in values:
+        try:
+            pairs.extend((address.display_name, address.addr_spec) for address in value.addresses)
+        except (AttributeError, HeaderParseError, IndexError, ValueError):
+            pairs.extend(getaddresses([str(value)]))
+    return [(display, address) for display, address in pairs if "@" in address]
+
+
+def _date(message):
+    value = message.get("Date")
+    if value is None:
+        return None
+    try:
+        return parsedate_to_datetime(str(value)).isoformat()
+    except (TypeError, ValueError, IndexError):
+        return str(value)
+
+
+def _headers(message, addresses, decode) -> dict:
+    senders = addresses(message, "From")
+    if not senders:
+        return None
+    return {
+        "from": senders[0][1],
+        "from_name": senders[0][0] or None,
+        "to": [address for _, address in addresses(message, "To")],
+        "cc": [address for _, address in addresses(message, "Cc")],
+        "date": _date(message),
+        "subject": decode(message.get("Subject")),
+    }
+
+
+def parse_headers(raw: bytes) -> dict:
+    # {"from", "from_name", "to", "cc", "date", "subject"}; raises EmailParseError without a usable From
+    try:
+        headers = _headers(_fast_parser.parsebytes(raw), _fast_addresses, _decode)
+        if headers is None:
+            headers = _headers(_parser.parsebytes(raw), _addresses, lambda value: None if value is None else str(value))
+    except (HeaderParseError, IndexError, ValueError) as e:
+        raise EmailParseError(f"Unparseable headers: {e}")
+    if headers is None:
+        raise EmailParseError("No sender address in the From header")
+    return headers
+
+
+def field_text(headers: dict, field: str = "from") -> str:
+    # Plain-text value of one field as written to an output file
+    value = headers.get(field)
+    if isinstance(value, list):
+        return ", ".join(value)
+    return value or ""
+
+
+def header_block(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return read_header_block(f)
+
+
+def is_mbox(path: str) -> bool:
+    # A .mbox file, or one holding more than one message: a single message saved with its "From " envelope
+    # line is still one email. Reading stops at the second envelope line.
+    if path.endswith(".mbox"):
+        return True
+    with open(path, "rb") as f:
+        if f.read(5) != b"From ":
+            return False
+        f.readline()
+        return any(line.startswith(b"From ") for line in f)
+
+
+def iter_mbox(path: str, start: int = 0, end: int = None):
+    # Yield ("<name>@<offset>", header block) per message whose "From " line starts in [start, end); bodies
+    # are skipped line by line, so memory stays bounded. The last one may read past end to finish its headers.
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        pos = start
+        if start:
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())
+        offset, lines, size, in_headers = None, [], 0, False
+        for line in iter(f.readline, b""):
+            if line.startswith(b"From "):
+                if offset is not None:
+                    yield f"{name}@{offset}", b"".join(lines)
+                    offset = None
+                if end is not None and pos >= end:
+                    break
+                offset, lines, size, in_headers = pos, [], 0, True
+            elif in_headers:
+                if not line.strip(b"\r\n") or size >= EMAIL_MAX_HEADER_BYTES:
+                    in_headers = False
+                else:
+                    lines.append(line)
+                    size += len(line)
+            pos += len(line)
+        if offset is not None:
+            yield f"{name}@{offset}", b"".join(lines)
+
+
+def iter_messages(path: str):
+    # Yield (source, header block) for an mbox file or every .eml file under a directory
+    if os.path.isdir(path):
+        for relative, entry in sorted(iter_files(path, "**/*.eml"), key=lambda item: item[0]):
+            yield relative, header_block(entry.path)
+    else:
+        yield from iter_mbox(path)
+
+
+def _tmp_output(output_path: str) -> str:
+    # A unique temp file beside the output, renamed over it once complete
+    fd, tmp_output = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)),
+                                      prefix=f".{os.path.basename(output_path)}.", suffix=".tmp")
+    os.close(fd)
+    os.chmod(tmp_output, 0o644)
+    return tmp_output
+
+
+def _discard(tmp_output: str):
+    try:
+        os.unlink(tmp_output)
+    except OSError:
+        pass
+
+
+def extract_batch(path: str, output_path: str) -> dict:
+    # Stream one JSON record per message into a JSON array (written atomically); malformed messages
+    # are recorded with an "error" instead of stopping the batch
+    count, failed = 0, 0
+    tmp_output = _tmp_output(output_path)
+    try:
+        with open(tmp_output, "w", encoding="utf-8") as out:
+            out.write("[")
+            for source, block in iter_messages(path):
+                try:
+                    record = {"source": source, **parse_headers(block)}
+                except EmailParseError as e:
+                    record = {"source": source, "error": str(e)}
+                    failed += 1
+                out.write((",\n" if count else "\n") + json.dumps(record, ensure_ascii=False))
+                count += 1
+            out.write("\n]\n" if count else "]\n")
+        os.replace(tmp_output, output_path)
+    except BaseException:
+        _discard(tmp_output)
+        raise
+    return {"messages": count, "malformed": failed}
+
+
+def _row(source: str, block: bytes):
+    # (row, None) for a parsed message, (row, header text) for one that needs the LLM
+    try:
+        headers = parse_headers(block)
+    except EmailParseError as e:
+        return (source, None, None, None, None, None, None, "error", str(e)), \
+            block[:EMAIL_LLM_HEADER_CHARS * 4].decode("utf-8", errors="replace")[:EMAIL_LLM_HEADER_CHARS]
+    return (source, headers["from"], headers["from_name"], ", ".join(headers["to"]), ", ".join(headers["cc"]),
+            headers["date"], headers["subject"], "local", None), None
+
+
+def _parse_rows(messages) -> tuple:
+    rows, malformed = [], []
+    for source, block in messages:
+        row, text = _row(source, block)
+        rows.append(row)
+        if text is not None:
+            malformed.append((len(rows) - 1, text))
+    return rows, malformed
+
+
+def _parse_mbox_chunk(path: str, start: int, end: int) -> tuple:
+    return _parse_rows(iter_mbox(path, start, end))
+
+
+def _parse_files_chunk(root: str, relatives: list) -> tuple:
+    return _parse_rows((relative, header_block(os.path.join(root, relative))) for relative in relatives)
+
+
+def mailbox_chunks(path: str) -> list:
+    # (function, args) per chunk: byte ranges of an mbox, or file lists of a maildir / .eml directory
+    if not os.path.isdir(path):
+        size = os.path.getsize(path)
+        return [(_parse_mbox_chunk, (path, start, min(size, start + EMAIL_CHUNK_BYTES)))
+                for start in range(0, size, EMAIL_CHUNK_BYTES)]
+    if os.path.isdir(os.path.join(path, "cur")) or os.path.isdir(os.path.join(path, "new")):
+        # Maildir: delivered messages live in cur/ and new/ (tmp/ holds deliveries in progress)
+        relatives = sorted(relative for sub in ("cur", "new") if os.path.isdir(os.path.join(path, sub))
+                           for relative, _ in iter_files(path, f"{sub}/*"))
+    else:
+        relatives = sorted(relative for relative, _ in iter_files(path, "**/*.eml"))
+    return [(_parse_files_chunk, (path, relatives[i:i + EMAIL_CHUNK_FILES]))
+            for i in range(0, len(relatives), EMAIL_CHUNK_FILES)]
+
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        self.f = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(MAILBOX_COLUMNS)
+
+    def write(self, rows: list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path: str):
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in MAILBOX_COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows: list):
+        if rows:
+            columns = list(zip(*rows))
+            self.writer.write_table(pyarrow.table(
+                {column: pyarrow.array(values, pyarrow.string()) for column, values in zip(MAILBOX_COLUMNS, columns)},
+                schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _writer(path: str, tmp_path: str):
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise ValueError("Parquet output requires pyarrow; use a .csv output instead")
+        return _ParquetWriter(tmp_path)
+    return _CsvWriter(tmp_path)
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EMAIL_WORKERS)
+        return _pool
+
+
+def _run_chunks(chunks: list, workers: int):
+    # Chunk results in order, with at most 2 * workers chunks in flight so memory stays bounded
+    if workers <= 1 or len(chunks) <= 1:
+        for fn, args in chunks:
+            yield fn(*args)
+        return
+    pool, pending = _get_pool(), deque()
+    for fn, args in chunks:
+        pending.append(pool.submit(fn, *args))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def extract_mailbox(path: str, output_path: str, resolve=None, workers: int = EMAIL_WORKERS) -> dict:
+    # Parse every message of an mbox / maildir / .eml directory into one CSV or Parquet row.
+    # resolve(texts) -> [sender or None] is called with batches of unparseable header blocks (e.g. an LLM)
+    # as soon as EMAIL_LLM_BATCH of them are queued, so at most one batch of header text is held at a time;
+    # past EMAIL_LLM_MAX_MESSAGES they are written unresolved.
+    start = time.perf_counter()
+    tmp_output = _tmp_output(output_path)
+    try:
+        writer = _writer(output_path, tmp_output)
+    except BaseException:
+        _discard(tmp_output)
+        raise
+    count, malformed, resolved, submitted, pending, chunks = 0, 0, 0, 0, [], None
+
+    def flush():
+        # Resolve the queued (row, header text) pairs and write their rows
+        nonlocal resolved
+        senders = list(resolve([text for _, text in pending]) or [])
+        rows = []
+        for i, (row, _) in enumerate(pending):
+            sender = senders[i] if i < len(senders) else None
+            if sender:
+                row = (row[0], sender) + (None,) * 5 + ("llm", None)
+                resolved += 1
+            rows.append(row)
+        writer.write(rows)
+        pending.clear()
+    try:
+        chunks = mailbox_chunks(path)
+        for rows, bad in _run_chunks(chunks, workers):
+            queued = set()
+            for index, text in bad:
+                if resolve is not None and submitted < EMAIL_LLM_MAX_MESSAGES:
+                    pending.append((rows[index], text))
+                    queued.add(index)
+                    submitted += 1
+                    if len(pending) >= EMAIL_LLM_BATCH:
+                        flush()
+            writer.write([row for index, row in enumerate(rows) if index not in queued])
+            count += len(rows)
+            malformed += len(bad)
+        if pending:
+            flush()
+        writer.close()
+        os.replace(tmp_output, output_path)
+    except BaseException:
+        # Parsing, the LLM or the writer failed: leave no partial output behind
+        try:
+            writer.close()
+        except Exception:
+            pass
+        _discard(tmp_output)
+        raise
+    elapsed = time.perf_counter() - start
+    return {
+        "messages": count,
+        "malformed": malformed - resolved,
+        "llm_resolved": resolved,
+        "chunks": len(chunks),
+        "workers": min(workers, len(chunks)) if chunks else 0,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_second": round(count / elapsed, 1) if elapsed > 0 else None,
+    }
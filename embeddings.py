@@ -0,0 +1,438 @@
+# Pluggable text embeddings with a persistent vector cache for get_similar_comments.
+# Backends: the remote embeddings endpoint (default), a local sentence-transformers model when installed,
+# and a dependency-light hashing backend (scikit-learn HashingVectorizer over character n-grams).
+# Vectors are L2-normalized and cached per backend/model, keyed by a 16-byte content hash, in an
+# append-only memory-mapped float32 (or float16) array; only texts missing from the cache are embedded.
+# Remote requests go through one EmbeddingScheduler per endpoint and model: token-budgeted batches, several
+# in flight on the shared client, AIMD concurrency that backs off on rate limits and honours Retry-After.
+# Each batch is cached as soon as it arrives, so an interrupted run resumes where it stopped.
+
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+from functools import lru_cache
+from threading import Lock
+
+import numpy as np
+
+from llm import llm, LLMError, RETRY_STATUS, backoff_delay
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "remote")
+EMBEDDING_REMOTE_MODEL = os.getenv("EMBEDDING_REMOTE_MODEL", "text-embedding-3-small")
+EMBEDDING_LOCAL_MODEL = os.getenv("EMBEDDING_LOCAL_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_HASHING_DIM = int(os.getenv("EMBEDDING_HASHING_DIM", "1024"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+# Per-request token budget, and the per-input limit of the embedding models (longer inputs are truncated)
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "8191"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "8"))
+EMBEDDING_CACHE_DIR = os.path.join(os.getenv("CACHE_DIR", "/data/.cache"), "embeddings")
+# float16 halves the cache but shifts cosine scores in the third decimal
+EMBEDDING_CACHE_DTYPE = np.dtype(os.getenv("EMBEDDING_CACHE_DTYPE", "float32"))
+DIGEST_DTYPE = np.dtype("S16")
+
+
+class EmbeddingError(Exception):
+    pass
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    # tiktoken's encoding for the model, or None (no tiktoken, or its BPE files can't be loaded)
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except (OSError, ValueError):
+            return None
+    except (OSError, ValueError):
+        return None
+
+
+def count_tokens(text: str, model: str = EMBEDDING_REMOTE_MODEL) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        # Conservative estimate: English averages about 4 bytes per token
+        return len(text.encode("utf-8")) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int = EMBEDDING_MAX_INPUT_TOKENS, model: str = EMBEDDING_REMOTE_MODEL) -> str:
+    encoding = _encoding(model)
+    if encoding is None:
+        data = text.encode("utf-8")
+        return data[:max_tokens * 3].decode("utf-8", errors="ignore") if len(data) // 3 + 1 > max_tokens else text
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+
+
+def token_batches(texts: list, max_tokens: int = EMBEDDING_BATCH_TOKENS, max_inputs: int = EMBEDDING_BATCH_SIZE,
+                  model: str = EMBEDDING_REMOTE_MODEL) -> list:
+    # Consecutive index lists, each within both the token budget and the input count
+    batches, tokens = [], 0
+    for index, text in enumerate(texts):
+        size = count_tokens(text, model)
+        if not batches or tokens + size > max_tokens or len(batches[-1]) >= max_inputs:
+            batches.append([])
+            tokens = 0
+        batches[-1].append(index)
+        tokens += size
+    return batches
+
+
+class Backend:
+    async def embed(self, texts: list) -> np.ndarray:
+        raise NotImplementedError
+
+    async def stream(self, texts: list):
+        # (indices, vectors) per batch as batches complete
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            yield list(range(start, start + len(batch))), await self.embed(batch)
+
+
+class EmbeddingScheduler:
+    # Sends token-budgeted batches with up to `concurrency` requests in flight. A rate limit halves the
+    # in-flight limit and pauses every sender for Retry-After (or a jittered backoff); each success adds
+    # 1/limit back, up to `concurrency`. Other retryable errors back off without touching the limit.
+    def __init__(self, client=llm, model: str = EMBEDDING_REMOTE_MODEL, concurrency: int = EMBEDDING_CONCURRENCY,
+                 batch_tokens: int = EMBEDDING_BATCH_TOKENS, batch_inputs: int = EMBEDDING_BATCH_SIZE,
+                 max_retries: int = EMBEDDING_MAX_RETRIES):
+        self.client = client
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.batch_tokens = batch_tokens
+        self.batch_inputs = batch_inputs
+        self.max_retries = max_retries
+        self.limit = float(self.concurrency)
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0}
+        self._condition = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Created on first use (inside the event loop) and shared by every stream on this scheduler
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def _acquire(self):
+        async with self.condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def _send(self, indices: list, texts: list) -> tuple:
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            try:
+                self.stats["requests"] += 1
+                vectors = await self.client.embeddings(texts, model=self.model, max_retries=0)
+            except LLMError as e:
+                if e.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, e.retry_after)
+                self.stats["retries"] += 1
+                if e.status_code == 429:
+                    self.stats["rate_limited"] += 1
+                    self.limit = max(1.0, self.limit / 2)
+                    self.resume_at = max(self.resume_at, time.monotonic() + delay)
+            else:
+                self.limit = min(float(self.concurrency), self.limit + 1 / self.limit)
+                if len(vectors) != len(texts):
+                    raise LLMError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+                return indices, _normalize(vectors)
+            finally:
+                await self._release()
+            await asyncio.sleep(delay)
+
+    async def stream(self, texts: list):
+        # (indices, vectors) per batch in completion order; pending batches are cancelled on error
+        texts = [truncate_tokens(text, model=self.model) for text in texts]
+        batches = token_batches(texts, self.batch_tokens, self.batch_inputs, self.model)
+        tasks = [asyncio.create_task(self._send(indices, [texts[i] for i in indices])) for indices in batches]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def embed(self, texts: list) -> np.ndarray:
+        # All vectors, in input order
+        vectors = [None] * len(texts)
+        async for indices, batch in self.stream(texts):
+            for index, vector in zip(indices, batch):
+                vectors[index] = vector
+        return np.array(vectors, dtype=np.float32)
+
+
+class RemoteBackend(Backend):
+    def __init__(self, model: str = EMBEDDING_REMOTE_MODEL, client=llm):
+        self.model = model
+        self.name = f"remote:{model}"
+        self.scheduler = EmbeddingScheduler(client, model)
+
+    async def embed(self, texts: list) -> np.ndarray:
+        return await self.scheduler.embed(texts)
+
+    def stream(self, texts: list):
+        return self.scheduler.stream(texts)
+
+
+class SentenceTransformerBackend(Backend):
+    _models = {}
+    _lock = Lock()
+
+    def __init__(self, model: str = EMBEDDING_LOCAL_MODEL):
+        if SentenceTransformer is None:
+            raise EmbeddingError("The local embedding backend requires sentence-transformers")
+        self.model = model
+        self.name = f"local:{model}"
+
+    def _encode(self, texts: list) -> np.ndarray:
+        # One model instance per process, loaded on first use
+        with self._lock:
+            if self.model not in self._models:
+                self._models[self.model] = SentenceTransformer(self.model, device="cpu")
+        return self._models[self.model].encode(texts, batch_size=64, normalize_embeddings=True)
+
+    async def embed(self, texts: list) -> np.ndarray:
+        return _normalize(await asyncio.to_thread(self._encode, texts))
+
+
+class HashingBackend(Backend):
+    # Stateless, so vectors depend only on the text and can be cached like model embeddings
+    def __init__(self, dim: int = EMBEDDING_HASHING_DIM):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.vectorizer = HashingVectorizer(n_features=dim, analyzer="char_wb", ngram_range=(2, 4),
+                                            alternate_sign=False, norm="l2")
+        self.name = f"hashing:char_wb-2-4:{dim}"
+
+    async def embed(self, texts: list) -> np.ndarray:
+        return _normalize(await asyncio.to_thread(lambda: self.vectorizer.transform(texts).toarray()))
+
+
+BACKENDS = {"remote": RemoteBackend, "local": SentenceTransformerBackend, "hashing": HashingBackend}
+
+# One remote backend per endpoint and model, so concurrent requests share its scheduler's AIMD limit
+# and rate-limit pause instead of each starting at full concurrency
+_remote_backends = {}
+_backends_lock = Lock()
+
+
+def remote_backend(model: str = EMBEDDING_REMOTE_MODEL, client=llm) -> RemoteBackend:
+    key = (client.base_url, model)
+    with _backends_lock:
+        if key not in _remote_backends:
+            _remote_backends[key] = RemoteBackend(model, client)
+        return _remote_backends[key]
+
+
+def get_backend(name: str = None):
+    name = name or EMBEDDING_BACKEND
+    if name not in BACKENDS:
+        raise EmbeddingError(f"Unknown embedding backend: {name}")
+    if name == "remote":
+        return remote_backend()
+    return BACKENDS[name]()
+
+
+def digests(texts: list) -> np.ndarray:
+    return np.array([hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest() for text in texts],
+                    dtype=DIGEST_DTYPE)
+
+
+class VectorCache:
+    # Append-only on disk: keys.bin holds one digest per row, vectors.bin the rows (memory-mapped),
+    # meta.json the committed row count and dimension (written last, so a torn append is ignored)
+    def __init__(self, namespace: str, dtype: np.dtype = EMBEDDING_CACHE_DTYPE):
+        self.namespace = namespace
+        self.dtype = np.dtype(dtype)
+        self.dir = os.path.join(EMBEDDING_CACHE_DIR, hashlib.sha1(f"{namespace}:{self.dtype}".encode()).hexdigest())
+        self.lock = Lock()
+        self.dim, self.count = None, 0
+        self.vectors = np.zeros((0, 0), dtype=self.dtype)
+        self.sorted_keys, self.order = np.zeros(0, dtype=DIGEST_DTYPE), np.zeros(0, dtype=np.int64)
+        # Keys appended since the last lookup; merged into sorted_keys in one sort when next needed
+        self._unsorted = []
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def _load(self):
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.dim, self.count = meta["dim"], meta["count"]
+        if not self.count:
+            return
+        keys = np.fromfile(self._path("keys.bin"), dtype=DIGEST_DTYPE, count=self.count)
+        self.vectors = np.memmap(self._path("vectors.bin"), dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _merge_unsorted(self):
+        # One stable sort of the sorted index plus every pending batch (rows in file order, so the result
+        # matches a cold _load), instead of an O(n) insert per appended batch
+        if not self._unsorted:
+            return
+        indexed = len(self.sorted_keys)
+        keys = np.concatenate([self.sorted_keys, *self._unsorted])
+        order = np.concatenate([self.order, np.arange(indexed, self.count, dtype=np.int64)])
+        merged = np.argsort(keys, kind="stable")
+        self.sorted_keys, self.order, self._unsorted = keys[merged], order[merged], []
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        # Row per key, -1 where missing
+        with self.lock:
+            self._merge_unsorted()
+            if not self.count:
+                return np.full(len(keys), -1, dtype=np.int64)
+            positions = np.minimum(np.searchsorted(self.sorted_keys, keys), self.count - 1)
+            found = self.sorted_keys[positions] == keys
+            return np.where(found, self.order[positions], -1)
+
+    def rows(self, rows: np.ndarray) -> np.ndarray:
+        with self.lock:
+            return self.vectors[rows]
+
+    def append(self, keys: np.ndarray, vectors: np.ndarray):
+        if not len(keys):
+            return
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        with self.lock:
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                raise EmbeddingError(f"Embedding dimension changed from {self.dim} to {vectors.shape[1]}")
+            os.makedirs(self.dir, exist_ok=True)
+            item = self.dtype.itemsize * vectors.shape[1]
+            for name, data, size in (("keys.bin", keys, DIGEST_DTYPE.itemsize), ("vectors.bin", vectors, item)):
+                with open(self._path(name), "ab") as f:
+                    # Drop anything past the committed rows (a previously interrupted append)
+                    f.truncate(self.count * size)
+                    f.write(np.ascontiguousarray(data).tobytes())
+            fd, tmp_path = tempfile.mkstemp(dir=self.dir, prefix=".meta.json.", suffix=".tmp")
+            try:
+                with open(fd, "w", encoding="utf-8") as f:
+                    json.dump({"namespace": self.namespace, "dtype": str(self.dtype), "dim": int(vectors.shape[1]),
+                               "count": self.count + len(keys)}, f)
+                os.replace(tmp_path, self._path("meta.json"))
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+            # Queue the keys for the next lookup's merge and widen the memmap view; nothing is re-read
+            self._unsorted.append(np.array(keys, dtype=DIGEST_DTYPE))
+            self.dim, self.count = int(vectors.shape[1]), self.count + len(keys)
+            self.vectors = np.memmap(self._path("vectors.bin"), dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+
+
+_caches = {}
+_caches_lock = Lock()
+
+
+def vector_cache(namespace: str) -> VectorCache:
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = VectorCache(namespace)
+        return _caches[namespace]
+
+
+# Progress of running embed_texts calls, for GET /embeddings/progress. Keyed "<job>#<n>" so concurrent
+# calls with the same job name (e.g. the same input file) each keep their own entry
+jobs = {}
+_jobs_lock = Lock()
+_job_ids = itertools.count(1)
+
+
+def _progress(job: str, embedded: int = 0, **values):
+    # Adds `embedded` to the running count; a no-op once the entry is gone
+    with _jobs_lock:
+        entry = jobs.get(job)
+        if entry is not None:
+            entry.update(values)
+            entry["embedded"] = entry.get("embedded", 0) + embedded
+
+
+def progress() -> dict:
+    # A snapshot of the running jobs
+    with _jobs_lock:
+        return {job: dict(entry) for job, entry in jobs.items()}
+
+
+async def embed_rows(texts: list, backend=None, job: str = None) -> tuple:
+    # (cache, cache row per text, stats); only texts missing from the cache are embedded
+    backend = backend or get_backend()
+    cache = vector_cache(backend.name)
+    keys = await asyncio.to_thread(digests, texts)
+    rows = await asyncio.to_thread(cache.lookup, keys)
+    hits = int(np.count_nonzero(rows >= 0))
+    missing = {}
+    for index in np.where(rows < 0)[0]:
+        missing.setdefault(keys[index], texts[index])
+    scheduler = backend.scheduler if isinstance(backend, RemoteBackend) else None
+    before = dict(scheduler.stats) if scheduler else {}
+    if missing:
+        name = job or backend.name
+        job = f"{name}#{next(_job_ids)}"
+        pending_keys, pending = list(missing), list(missing.values())
+        with _jobs_lock:
+            jobs[job] = {"job": name, "backend": backend.name, "texts": len(texts), "cached": hits,
+                         "pending": len(pending), "embedded": 0}
+        try:
+            async for indices, vectors in backend.stream(pending):
+                await asyncio.to_thread(cache.append, np.array([pending_keys[i] for i in indices], dtype=DIGEST_DTYPE),
+                                        vectors)
+                _progress(job, embedded=len(indices))
+        finally:
+            with _jobs_lock:
+                jobs.pop(job, None)
+        rows = await asyncio.to_thread(cache.lookup, keys)
+    stats = {"backend": backend.name, "texts": len(texts), "cached": hits, "embedded": len(missing)}
+    if scheduler:
+        # The scheduler is shared, so report only this call's requests (approximate under concurrency)
+        stats.update({key: value - before[key] for key, value in scheduler.stats.items()})
+    return cache, rows, stats
+
+
+async def embed_texts(texts: list, backend=None, job: str = None) -> tuple:
+    # (vectors in the cache dtype, one row per text, stats)
+    cache, rows, stats = await embed_rows(texts, backend, job)
+    return await asyncio.to_thread(cache.rows, rows), stats
@@ -0,0 +1,328 @@
+# File formatting for format_file through long-lived Prettier workers.
+# A Node process (prettier_worker.js) loads Prettier once and formats sources sent over its stdin pipe
+# as NDJSON requests, so each file costs a pipe round trip instead of an npx start-up. Requests are
+# multiplexed by id, so many files can be in flight at once, spread over a small pool of workers.
+# A requested version other than the worker's falls back to a one-shot `npx prettier@<version>` run.
+# Directory mode records each file's formatted-content hash under CACHE_DIR and skips files whose
+# content still matches it.
+
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from logs import iter_files
+
+PRETTIER_WORKER_SCRIPT = os.getenv(
+    "PRETTIER_WORKER_SCRIPT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prettier_worker.js"))
+PRETTIER_NODE = os.getenv("PRETTIER_NODE", "node")
+PRETTIER_TIMEOUT = float(os.getenv("PRETTIER_TIMEOUT", "60"))
+PRETTIER_START_TIMEOUT = float(os.getenv("PRETTIER_START_TIMEOUT", "30"))
+# Upper bound on one request/response line, i.e. on the size of a formatted file
+PRETTIER_MAX_BYTES = int(os.getenv("PRETTIER_MAX_BYTES", str(256 * 1024 * 1024)))
+PRETTIER_WORKERS = int(os.getenv("PRETTIER_WORKERS", str(min(4, os.cpu_count() or 1))))
+FORMAT_CONCURRENCY = int(os.getenv("FORMAT_CONCURRENCY", "64"))
+CACHE_DIR = os.getenv("CACHE_DIR", "/data/.cache")
+FORMAT_CACHE_DIR = os.path.join(CACHE_DIR, "format")
+FORMAT_EXTENSIONS = (".md", ".markdown", ".mdx", ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".json", ".css",
+                     ".scss", ".less", ".html", ".vue", ".yaml", ".yml", ".graphql")
+FORMAT_EXCLUDE_DIRS = {"node_modules", ".git", ".hg", ".svn"}
+
+
+class FormatterError(Exception):
+    pass
+
+
+async def _global_node_path() -> str:
+    # Globally installed modules (npm install -g prettier) are not on Node's default require path
+    if os.getenv("NODE_PATH"):
+        return os.getenv("NODE_PATH")
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "npm", "root", "-g", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        stdout, _ = await proc.communicate()
+        return stdout.decode().strip()
+    except OSError:
+        return ""
+
+
+class PrettierWorker:
+    def __init__(self, script: str = PRETTIER_WORKER_SCRIPT):
+        self.script = script
+        self.version = None
+        self._proc = None
+        self._reader = None
+        self._loop = None
+        self._pending = {}
+        self._ids = itertools.count()
+        self._start_lock = None
+
+    @property
+    def running(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None and self._loop is asyncio.get_running_loop()
+
+    async def start(self):
+        # Idempotent; (re)starts the worker if it is not running on the current event loop
+        loop = asyncio.get_running_loop()
+        if self._start_lock is None or self._loop is not loop:
+            self._start_lock, self._loop = asyncio.Lock(), loop
+        async with self._start_lock:
+            if self.running:
+                return
+            await self.close()
+            self._loop = loop
+            try:
+                self._proc = await asyncio.create_subprocess_exec(
+                    PRETTIER_NODE, self.script,
+                    stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+                    env={**os.environ, "NODE_PATH": await _global_node_path()}, limit=PRETTIER_MAX_BYTES)
+                ready = json.loads(await asyncio.wait_for(self._proc.stdout.readline(), PRETTIER_START_TIMEOUT) or "{}")
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                await self.close()
+                raise FormatterError(f"Prettier worker failed to start: {e}")
+            if not ready.get("ready"):
+                await self.close()
+                raise FormatterError(f"Prettier worker failed to start: {ready.get('error', 'no response')}")
+            self.version = ready["version"]
+            self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        proc = self._proc
+        try:
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._pending.pop(response.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(FormatterError(response["error"]))
+                else:
+                    future.set_result(response["formatted"])
+        except (ValueError, asyncio.LimitOverrunError) as e:
+            error = FormatterError(f"Prettier worker protocol error: {e}")
+        else:
+            error = FormatterError("Prettier worker exited")
+        # Fail everything still in flight; the next request restarts the worker
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        if proc.returncode is None:
+            proc.kill()
+
+    async def format(self, source: str, filepath: str) -> str:
+        await self.start()
+        request_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        try:
+            self._proc.stdin.write(json.dumps({"id": request_id, "filepath": filepath, "source": source}).encode() + b"\n")
+            await self._proc.stdin.drain()
+            return await asyncio.wait_for(future, PRETTIER_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise FormatterError(f"Prettier worker request failed: {e!r}")
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def close(self):
+        proc, reader = self._proc, self._reader
+        self._proc, self._reader = None, None
+        if proc is not None and proc.returncode is None:
+            try:
+                proc.stdin.close()
+                await asyncio.wait_for(proc.wait(), 5)
+            except (OSError, RuntimeError, asyncio.TimeoutError):
+                proc.kill()
+        if reader is not None and not reader.done():
+            try:
+                reader.cancel()
+            except RuntimeError:
+                # Started on an event loop that has since been closed
+                pass
+
+
+async def npx_format(source: str, filepath: str, version: str) -> str:
+    # One-shot fallback for versions the worker does not have
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "npx", "--yes", f"prettier@{version}", "--stdin-filepath", filepath,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await asyncio.wait_for(proc.communicate(source.encode()), PRETTIER_TIMEOUT)
+    except (OSError, asyncio.TimeoutError) as e:
+        raise FormatterError(f"npx prettier@{version} failed: {e!r}")
+    if proc.returncode != 0:
+        raise FormatterError(stderr.decode(errors="replace").strip() or f"npx prettier@{version} failed")
+    return stdout.decode()
+
+
+class PrettierPool:
+    # A few workers so CPU-bound formatting runs in parallel; each request goes to the least busy one
+    def __init__(self, size: int = PRETTIER_WORKERS):
+        self.workers = [PrettierWorker() for _ in range(max(1, size))]
+
+    @property
+    def version(self):
+        return self.workers[0].version
+
+    async def start(self):
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+
+    async def format(self, source: str, filepath: str) -> str:
+        worker = min(self.workers, key=lambda worker: len(worker._pending))
+        return await worker.format(source, filepath)
+
+    async def close(self):
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+
+
+prettier = PrettierPool()
+
+
+async def format_source(source: str, filepath: str, version: str = None) -> str:
+    await prettier.start()
+    if version and version != prettier.version:
+        return await npx_format(source, filepath, version)
+    return await prettier.format(source, filepath)
+
+
+def _read_text(path: str) -> str:
+    # newline="" keeps the file's line endings exactly as Prettier would see them on stdin
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+def _write_text(path: str, text: str, mode: int = None):
+    # Atomic replace through a unique temp file beside path (removed on failure); keeps the original mode
+    mode = os.stat(path).st_mode & 0o7777 if mode is None else mode
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.",
+                                    suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+async def format_file_in_place(path: str, version: str = None, known: list = None) -> dict:
+    # Returns {"changed", "skipped", "hash"}; unchanged files are not rewritten.
+    # known is the [version, hash, mtime_ns, size] recorded after the file was last formatted.
+    stat = os.stat(path)
+    if known and known[0] == version and known[2:] == [stat.st_mtime_ns, stat.st_size]:
+        return {"changed": False, "skipped": True, "hash": known[1]}
+    source = await asyncio.to_thread(_read_text, path)
+    if known and known[0] == version and known[1] == _digest(source):
+        return {"changed": False, "skipped": True, "hash": known[1]}
+    formatted = await format_source(source, path, version)
+    if formatted != source:
+        await asyncio.to_thread(_write_text, path, formatted)
+    return {"changed": formatted != source, "skipped": False, "hash": _digest(formatted)}
+
+
+async def _format_files(paths: list, version: str = None, known: dict = None) -> list:
+    # [{"path", "changed", "skipped", "hash", "elapsed_ms"} or {"path", "error", "elapsed_ms"}] in input order.
+    # Files are formatted concurrently (at most FORMAT_CONCURRENCY open at once) across the worker pool.
+    known = known or {}
+    semaphore = asyncio.Semaphore(FORMAT_CONCURRENCY)
+
+    async def one(path: str) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = {"path": path, **await format_file_in_place(path, version, known.get(path))}
+            except (OSError, UnicodeDecodeError, FormatterError) as e:
+                result = {"path": path, "error": str(e)}
+            result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            return result
+    return list(await asyncio.gather(*(one(path) for path in paths)))
+
+
+async def format_files(paths: list, version: str = None) -> list:
+    # [{"path", "changed", "skipped", "elapsed_ms"} or {"path", "error", "elapsed_ms"}] in input order
+    results = await _format_files(paths, version)
+    for result in results:
+        result.pop("hash", None)
+    return results
+
+
+def _hashes_path(root: str) -> str:
+    return os.path.join(FORMAT_CACHE_DIR, hashlib.sha1(root.encode()).hexdigest() + ".json")
+
+
+def _load_hashes(root: str) -> dict:
+    try:
+        with open(_hashes_path(root), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data["entries"] if data.get("root") == root else {}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _save_hashes(root: str, entries: dict):
+    # Best effort and atomic: a read-only or missing cache dir only costs re-hashing next time
+    try:
+        os.makedirs(FORMAT_CACHE_DIR, exist_ok=True)
+        _write_text(_hashes_path(root), json.dumps({"root": root, "entries": entries}), mode=0o644)
+    except OSError:
+        pass
+
+
+def _excluded(entry: os.DirEntry) -> bool:
+    # Dependency and VCS directories, and this service's own cache (under /data by default)
+    return entry.name in FORMAT_EXCLUDE_DIRS or os.path.abspath(entry.path) == os.path.abspath(CACHE_DIR)
+
+
+def iter_formattable(root: str, pattern: str = None) -> list:
+    # Absolute paths of files Prettier can format; excluded directories are pruned, never listed
+    extensions = None if pattern else list(FORMAT_EXTENSIONS)
+    return sorted(os.path.join(root, relative)
+                  for relative, _ in iter_files(root, pattern or "**/*", extensions, prune=_excluded))
+
+
+async def format_directory(root: str, version: str = None, pattern: str = None) -> dict:
+    # Format every matching file under root; files whose content hash matches the last formatted output
+    # (for the same Prettier version) are skipped without a worker round trip
+    root = os.path.abspath(root)
+    start = time.perf_counter()
+    paths = await asyncio.to_thread(iter_formattable, root, pattern)
+    hashes = await asyncio.to_thread(_load_hashes, root)
+    known = {os.path.join(root, relative): entry for relative, entry in hashes.items()}
+    results = await _format_files(paths, version, known)
+    # A full run replaces the recorded hashes (dropping deleted files); a pattern run only updates its matches
+    entries = dict(hashes) if pattern else {}
+    for result in results:
+        relative = os.path.relpath(result["path"], root).replace(os.sep, "/")
+        entries.pop(relative, None)
+        if "error" not in result:
+            try:
+                stat = os.stat(result["path"])
+                entries[relative] = [version, result["hash"], stat.st_mtime_ns, stat.st_size]
+            except OSError:
+                pass
+        result["path"] = relative
+        result.pop("hash", None)
+    await asyncio.to_thread(_save_hashes, root, entries)
+    summary = {
+        "files": len(results),
+        "changed": sum(1 for result in results if result.get("changed")),
+        "unchanged": sum(1 for result in results if result.get("changed") is False),
+        "skipped": sum(1 for result in results if result.get("skipped")),
+        "errors": sum(1 for result in results if "error" in result),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+    return {"summary": summary, "results": results}
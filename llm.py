@@ -0,0 +1,133 @@
+# Shared async client for the aiproxy OpenAI-compatible API.
+# One pooled (HTTP/2 when available) connection is reused by /run and every tool handler,
+# with a concurrency cap, timeouts and retry with jittered exponential backoff.
+
+import asyncio
+import os
+import random
+
+import httpx
+from dotenv import load_dotenv
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+load_dotenv()
+
+AIPROXY_BASE = os.getenv("AIPROXY_BASE", "https://aiproxy.sanand.workers.dev/openai/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "64"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+# Status codes worth retrying: timeouts, rate limits and transient upstream failures
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status_code: int = 500, retry_after: str = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, retry_after: str = None) -> float:
+    # Honour the server's Retry-After (seconds) when given, otherwise "full jitter" exponential backoff
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+class LLMClient:
+    def __init__(self, base_url: str = AIPROXY_BASE, token: str = None, concurrency: int = LLM_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES):
+        self.base_url = base_url
+        self.token = token
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._client = None
+        self._semaphore = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=HTTP2,
+                headers={"Content-Type": "application/json"},
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_KEEPALIVE),
+                timeout=httpx.Timeout(self.timeout, connect=LLM_CONNECT_TIMEOUT),
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _headers(self) -> dict:
+        token = self.token or os.getenv("AIPROXY_TOKEN")
+        return {"Authorization": f"Bearer {token}"}
+
+    async def post(self, path: str, payload: dict, max_retries: int = None) -> dict:
+        # max_retries=0 hands retryable errors (with their Retry-After) to a caller that schedules its own retries
+        max_retries = self.max_retries if max_retries is None else max_retries
+        last_error = None
+        for attempt in range(max_retries + 1):
+            retry_after = None
+            async with self.semaphore:
+                try:
+                    response = await self.client.post(path, json=payload, headers=self._headers())
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    last_error = LLMError(f"API request failed: {e!r}", 504)
+                else:
+                    if response.status_code < 400:
+                        return response.json()
+                    retry_after = response.headers.get("Retry-After")
+                    last_error = LLMError(f"API error {response.status_code}: {response.text}", response.status_code,
+                                          retry_after)
+                    if response.status_code not in RETRY_STATUS:
+                        raise last_error
+            # Sleep outside the semaphore so waiting retries don't hold a slot
+            if attempt < max_retries:
+                await asyncio.sleep(backoff_delay(attempt, retry_after))
+        raise last_error
+
+    async def chat(self, messages: list, model: str = LLM_MODEL, **kwargs) -> dict:
+        return await self.post("/chat/completions", {"model": model, "messages": messages, **kwargs})
+
+    async def chat_content(self, messages: list, model: str = LLM_MODEL, **kwargs) -> str:
+        # Convenience wrapper returning just the assistant's text
+        response = await self.chat(messages, model=model, **kwargs)
+        if "choices" in response:
+            return response["choices"][0]["message"]["content"]
+        if "message" in response:
+            return response["message"]["content"]
+        raise LLMError("Unexpected response format: " + str(response))
+
+    async def embeddings(self, inputs: list, model: str = "text-embedding-3-small", max_retries: int = None) -> list:
+        response = await self.post("/embeddings", {"model": model, "input": inputs}, max_retries=max_retries)
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item.get("index", 0))]
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+llm = LLMClient()
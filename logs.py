@@ -0,0 +1,404 @@
+# In-process log scanner for logs_recent.
+# Walks the directory with os.scandir, keeps the N most recent files in a heap (O(n log N)) using
+# nanosecond mtimes, and reads first lines concurrently with bounded I/O parallelism.
+
+import ctypes
+import ctypes.util
+import fnmatch
+import heapq
+import mmap
+import os
+import re
+import select
+import struct
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+LOG_IO_WORKERS = int(os.getenv("LOG_IO_WORKERS", "16"))
+# Longer lines are truncated so one huge or binary "line" cannot blow up memory
+LOG_MAX_LINE_BYTES = int(os.getenv("LOG_MAX_LINE_BYTES", str(64 * 1024)))
+LOG_ENCODING = os.getenv("LOG_ENCODING", "utf-8")
+
+
+def glob_regex(pattern: str):
+    # fnmatch-style pattern on "/"-separated relative paths where "**/" also matches zero directories
+    parts = pattern.split("**/")
+    regex = "(?:.*/)?".join(fnmatch.translate(part).replace(r"\Z", "").replace("(?s:", "(?:", 1) for part in parts)
+    return re.compile(f"(?s:{regex})\\Z")
+
+
+def iter_files(root: str, pattern: str = None, extensions: list = None, prune=None):
+    # Yields (relative_path, DirEntry) for regular files; patterns containing "/" or "**" recurse.
+    # Directories for which prune(entry) is true are not descended into.
+    recursive = bool(pattern) and ("/" in pattern or "**" in pattern)
+    matcher = glob_regex(pattern) if pattern else None
+    extensions = tuple(ext if ext.startswith(".") else f".{ext}" for ext in extensions or [])
+    stack = [(root, "")]
+    while stack:
+        directory, prefix = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                relative = prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not (prune and prune(entry)):
+                        stack.append((entry.path, relative + "/"))
+                    continue
+                if not entry.is_file():
+                    continue
+                if extensions and not entry.name.endswith(extensions):
+                    continue
+                if matcher and not matcher.match(relative):
+                    continue
+                yield relative, entry
+
+
+def most_recent(root: str, n: int, pattern: str = None, extensions: list = None) -> list:
+    # (mtime_ns, path) of the n most recently modified files, newest first; ties broken by path
+    candidates = ((entry.stat().st_mtime_ns, entry.path) for _, entry in iter_files(root, pattern, extensions))
+    return heapq.nlargest(n, candidates)
+
+
+# Line extraction works on a read-only mmap, touching only the pages around the requested lines.
+# Undecodable bytes are always replaced (U+FFFD), so the same file yields the same text every time.
+
+def _decode(raw: bytes, encoding: str) -> str:
+    return raw[:LOG_MAX_LINE_BYTES].decode(encoding, errors="replace").rstrip("\r")
+
+
+def _map(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def head_lines(path: str, k: int = 1, encoding: str = LOG_ENCODING) -> list:
+    lines = []
+    with open(path, "rb") as f:
+        m = _map(f)
+        if m is None:
+            return lines
+        with m:
+            pos = 0
+            while len(lines) < k and pos < len(m):
+                end = m.find(b"\n", pos)
+                end = len(m) if end == -1 else end
+                lines.append(_decode(m[pos:min(end, pos + LOG_MAX_LINE_BYTES)], encoding))
+                pos = end + 1
+    return lines
+
+
+def tail_lines(path: str, k: int = 1, encoding: str = LOG_ENCODING) -> list:
+    lines = []
+    with open(path, "rb") as f:
+        m = _map(f)
+        if m is None:
+            return lines
+        with m:
+            end = len(m) - 1 if m[-1:] == b"\n" else len(m)
+            while len(lines) < k and end >= 0:
+                start = m.rfind(b"\n", 0, end) + 1
+                lines.append(_decode(m[max(start, end - LOG_MAX_LINE_BYTES):end], encoding))
+                end = start - 1
+    return lines[::-1]
+
+
+def grep_lines(path: str, pattern: str, k: int = None, encoding: str = LOG_ENCODING) -> list:
+    # Lines matching a regex, searched directly over the mapped bytes; at most k lines when given
+    regex = re.compile(pattern.encode(encoding), re.MULTILINE)
+    lines, last_start = [], -1
+    with open(path, "rb") as f:
+        m = _map(f)
+        if m is None:
+            return lines
+        with m:
+            for match in regex.finditer(m):
+                start = m.rfind(b"\n", 0, match.start()) + 1
+                if start == last_start:
+                    continue
+                end = m.find(b"\n", match.start())
+                end = len(m) if end == -1 else end
+                lines.append(_decode(m[start:min(end, start + LOG_MAX_LINE_BYTES)], encoding))
+                last_start = start
+                if k and len(lines) >= k:
+                    break
+    return lines
+
+
+def first_line(path: str) -> str:
+    lines = head_lines(path, 1)
+    return lines[0].strip() if lines else ""
+
+
+def _pool_map(fn, items: list, workers: int = LOG_IO_WORKERS) -> list:
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+def read_first_lines(paths: list, workers: int = LOG_IO_WORKERS) -> list:
+    return _pool_map(first_line, paths, workers)
+
+
+def extract_lines(paths: list, mode: str = "first", k: int = 1, pattern: str = None,
+                  encoding: str = LOG_ENCODING) -> list:
+    # Per path, the first k, last k or (up to k) matching lines
+    if mode == "first":
+        fn = lambda path: head_lines(path, k, encoding)
+    elif mode == "last":
+        fn = lambda path: tail_lines(path, k, encoding)
+    elif mode == "match":
+        if not pattern:
+            raise ValueError("A match pattern is required")
+        re.compile(pattern.encode(encoding))
+        fn = lambda path: grep_lines(path, pattern, k, encoding)
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    return _pool_map(fn, paths)
+
+
+# Incrementally maintained per-directory index of (mtime, size, first line), kept current by
+# inotify on Linux and by re-stat polling elsewhere, so repeat queries stay in memory. Queued inotify
+# events are drained before every query, so a file written just before a query is always seen; polling
+# re-stats on every query unless LOG_INDEX_POLL_INTERVAL allows some staleness.
+
+LOG_INDEX_ENABLED = os.getenv("LOG_INDEX_ENABLED", "1") != "0"
+LOG_INDEX_INOTIFY = os.getenv("LOG_INDEX_INOTIFY", "1") != "0"
+LOG_INDEX_POLL_INTERVAL = float(os.getenv("LOG_INDEX_POLL_INTERVAL", "0"))
+LOG_INDEX_MAX = int(os.getenv("LOG_INDEX_MAX", "32"))
+
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x400, 0x800, 0x4000, 0x8000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher(Thread):
+    def __init__(self, index):
+        super().__init__(daemon=True, name=f"log-index:{index.root}")
+        self.index = index
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.prefixes = {}
+        self.watched = set()
+        self._stop_event = Event()
+        # Serializes reads of the fd between the watcher thread and drain()
+        self._read_lock = Lock()
+
+    def watch(self, directory: str, prefix: str):
+        if directory in self.watched:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.prefixes[wd] = prefix
+        self.watched.add(directory)
+
+    def stop(self):
+        self._stop_event.set()
+        if not self.is_alive():
+            self._close()
+
+    def _close(self):
+        # Under the read lock, so drain() never reads a closed (or reused) descriptor
+        with self._read_lock:
+            if self.fd >= 0:
+                os.close(self.fd)
+                self.fd = -1
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                ready, _, _ = select.select([self.fd], [], [], 1.0)
+                if ready:
+                    self.drain()
+        finally:
+            self._close()
+            self.index.watcher_stopped()
+
+    def drain(self):
+        # Apply every queued event now (non-blocking); events for writes that have returned are already queued
+        with self._read_lock:
+            while self.fd >= 0:
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except (BlockingIOError, OSError):
+                    return
+                if not data:
+                    return
+                self._handle(data)
+
+    def _handle(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_ISDIR and not self.index.recursive and not mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+            if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED) or mask & IN_ISDIR:
+                # Lost events or directory changes: rebuild from a full scan on the next query
+                self.index.invalidate()
+                if wd in self.prefixes and mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    self.watched.discard(os.path.join(self.index.root, self.prefixes.pop(wd)).rstrip("/"))
+                continue
+            if wd in self.prefixes and name:
+                self.index.update(self.prefixes[wd] + os.fsdecode(name))
+
+
+class LogIndex:
+    def __init__(self, root: str, recursive: bool):
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        # relative path -> [mtime_ns, size, first line or None]
+        self.entries = {}
+        self.lock = Lock()
+        self.dirty = True
+        self.last_scan = 0.0
+        self.watcher = None
+        if LOG_INDEX_INOTIFY and sys.platform.startswith("linux"):
+            try:
+                self.watcher = InotifyWatcher(self)
+            except (OSError, AttributeError):
+                self.watcher = None
+
+    def invalidate(self):
+        self.dirty = True
+
+    def watcher_stopped(self):
+        self.watcher = None
+        self.dirty = True
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+
+    def _scan(self):
+        # Full re-stat; first lines are kept for files whose (mtime, size) did not change
+        seen = {}
+        stack = [(self.root, "")]
+        while stack:
+            directory, prefix = stack.pop()
+            if self.watcher is not None:
+                # Watch before listing so changes made during the scan are not missed
+                try:
+                    self.watcher.watch(directory, prefix)
+                except OSError:
+                    # e.g. out of inotify watches: fall back to polling
+                    self.watcher.stop()
+                    self.watcher = None
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            stack.append((entry.path, relative + "/"))
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        seen[relative] = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entries = {}
+            for relative, (mtime, size) in seen.items():
+                old = self.entries.get(relative)
+                first = old[2] if old and old[0] == mtime and old[1] == size else None
+                entries[relative] = [mtime, size, first]
+            self.entries = entries
+        watcher = self.watcher
+        if watcher is not None and not watcher.is_alive() and watcher.fd >= 0:
+            watcher.start()
+
+    def update(self, relative: str):
+        # Apply one watcher event by re-stating just that path
+        try:
+            stat = os.stat(os.path.join(self.root, relative))
+        except FileNotFoundError:
+            with self.lock:
+                self.entries.pop(relative, None)
+            return
+        with self.lock:
+            old = self.entries.get(relative)
+            if old is None or old[0] != stat.st_mtime_ns or old[1] != stat.st_size:
+                self.entries[relative] = [stat.st_mtime_ns, stat.st_size, None]
+
+    def refresh(self):
+        now = time.monotonic()
+        watcher = self.watcher
+        watching = watcher is not None and watcher.is_alive()
+        if watching:
+            watcher.drain()
+        # With inotify the index is current once queued events are drained, unless events were lost;
+        # polling re-stats at most once per interval
+        if self.dirty or (not watching and now - self.last_scan >= LOG_INDEX_POLL_INTERVAL):
+            self.dirty = False
+            self.last_scan = now
+            try:
+                self._scan()
+            except OSError:
+                self.dirty = True
+                raise
+
+    def most_recent(self, n: int, pattern: str = None, extensions: list = None) -> list:
+        self.refresh()
+        matcher = glob_regex(pattern) if pattern else None
+        extensions = tuple(ext if ext.startswith(".") else f".{ext}" for ext in extensions or [])
+        with self.lock:
+            candidates = [(entry[0], relative) for relative, entry in self.entries.items()
+                          if (not extensions or relative.endswith(extensions))
+                          and (not matcher or matcher.match(relative))]
+        return heapq.nlargest(n, candidates)
+
+    def first_lines(self, relatives: list) -> list:
+        with self.lock:
+            cached = {relative: self.entries[relative][2] for relative in relatives if relative in self.entries}
+        missing = [relative for relative in relatives if cached.get(relative) is None]
+        lines = dict(zip(missing, read_first_lines([os.path.join(self.root, r) for r in missing])))
+        with self.lock:
+            for relative, line in lines.items():
+                if relative in self.entries:
+                    self.entries[relative][2] = line
+        return [cached.get(relative) if cached.get(relative) is not None else lines[relative] for relative in relatives]
+
+
+_indexes = OrderedDict()
+_indexes_lock = Lock()
+
+
+def log_index(root: str, recursive: bool = False) -> LogIndex:
+    key = (os.path.abspath(root), recursive)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            if not os.path.isdir(key[0]):
+                raise FileNotFoundError(root)
+            index = _indexes[key] = LogIndex(root, recursive)
+            while len(_indexes) > LOG_INDEX_MAX:
+                _indexes.popitem(last=False)[1].close()
+        _indexes.move_to_end(key)
+        return index
+
+
+def recent_files(root: str, n: int, pattern: str = None, extensions: list = None) -> list:
+    # Paths of the n most recent files, newest first
+    if not LOG_INDEX_ENABLED:
+        return [path for _, path in most_recent(root, n, pattern, extensions)]
+    index = log_index(root, bool(pattern) and ("/" in pattern or "**" in pattern))
+    return [os.path.join(index.root, relative) for _, relative in index.most_recent(n, pattern, extensions)]
+
+
+def recent_first_lines(root: str, n: int, pattern: str = None, extensions: list = None) -> list:
+    # [(path, first line)] of the n most recent files, newest first
+    if not LOG_INDEX_ENABLED:
+        paths = [path for _, path in most_recent(root, n, pattern, extensions)]
+        return list(zip(paths, read_first_lines(paths)))
+    recursive = bool(pattern) and ("/" in pattern or "**" in pattern)
+    index = log_index(root, recursive)
+    relatives = [relative for _, relative in index.most_recent(n, pattern, extensions)]
+    return [(os.path.join(index.root, relative), line) for relative, line in zip(relatives, index.first_lines(relatives))]
@@ -0,0 +1,230 @@
+# Local OCR of card numbers for get_completions_image.
+# Text lines are found from the ink profile of the image (distance from the background colour). Each line is
+# decoded by dynamic programming over its columns against digit templates rendered with Pillow at the
+# line's height, so touching glyphs need no segmentation. Runs of 12-19 digits that pass the Luhn check
+# are card-number candidates; the weakest glyph match is the candidate's confidence.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from threading import Lock
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "0.8"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# Extra TrueType fonts to build templates from, ":"-separated; Pillow's default font is always tried
+OCR_FONTS = [path for path in os.getenv("OCR_FONTS", "").split(":") if path]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+DIGITS = "0123456789"
+# Ink below this fraction of the text contrast counts as background
+INK_THRESHOLD = 0.25
+HEIGHT_TOLERANCE = 2
+
+
+class OCRResult(dict):
+    # {"number", "confidence", "candidates"}; number is None when nothing Luhn-valid was read
+    @property
+    def confident(self) -> bool:
+        return self["number"] is not None and self["confidence"] >= OCR_MIN_CONFIDENCE
+
+
+def luhn_valid(number: str) -> bool:
+    if not number.isdigit():
+        return False
+    total = 0
+    for i, digit in enumerate(int(c) for c in reversed(number)):
+        if i % 2:
+            digit = digit * 2 - 9 if digit > 4 else digit * 2
+        total += digit
+    return total % 10 == 0
+
+
+def _font(source, size: int):
+    if source is None:
+        return ImageFont.load_default(size=size)
+    return ImageFont.truetype(source, size)
+
+
+@lru_cache(maxsize=256)
+def digit_templates(source, size: int):
+    # [(digit, ink map)] cropped to each glyph's columns and to the common digit rows, or None
+    try:
+        font = _font(source, size)
+    except (OSError, ValueError):
+        return None
+    pad = size
+    canvas = Image.new("L", (size * 3, size * 3), 0)
+    glyphs = []
+    for digit in DIGITS:
+        canvas.paste(0, (0, 0, *canvas.size))
+        ImageDraw.Draw(canvas).text((pad, pad), digit, fill=255, font=font)
+        ink = np.asarray(canvas, dtype=np.float32) / 255.0
+        cols, rows = np.where(ink.max(0) > 0)[0], np.where(ink.max(1) > 0)[0]
+        if not len(cols):
+            return None
+        glyphs.append((digit, ink, cols[0], cols[-1] + 1, rows[0], rows[-1] + 1))
+    top, bottom = min(g[4] for g in glyphs), max(g[5] for g in glyphs)
+    return [(digit, ink[top:bottom, left:right]) for digit, ink, left, right, _, _ in glyphs]
+
+
+@lru_cache(maxsize=64)
+def templates_for_height(height: int, tolerance: int = HEIGHT_TOLERANCE) -> list:
+    # Template sets from every font and size whose digits are within `tolerance` rows of `height`
+    # (faint anti-aliased or compressed edges can shift the measured line height by a row or two)
+    sets = []
+    for source in [None] + OCR_FONTS:
+        for size in range(max(4, height - tolerance - 2), (height + tolerance) * 2 + 4):
+            templates = digit_templates(source, size)
+            if templates is not None and abs(templates[0][1].shape[0] - height) <= tolerance:
+                sets.append(templates)
+    return sets
+
+
+def ink_map(image: Image.Image) -> np.ndarray:
+    # 0..1 ink per pixel: distance from the dominant (background) colour, scaled by the text contrast
+    pixels = np.asarray(image.convert("RGB"), dtype=np.float32)
+    background = np.median(pixels.reshape(-1, 3), axis=0)
+    distance = np.abs(pixels - background).sum(axis=2)
+    contrast = np.percentile(distance[distance > distance.max() * INK_THRESHOLD], 90) if distance.max() > 0 else 1.0
+    return np.clip(distance / max(contrast, 1e-6), 0.0, 1.0)
+
+
+def _runs(mask: np.ndarray, max_gap: int = 0) -> list:
+    # [(start, end)] of True runs, bridging gaps of up to max_gap
+    runs = []
+    for index in np.where(mask)[0]:
+        if runs and index - runs[-1][1] <= max_gap:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1])
+    return [tuple(run) for run in runs]
+
+
+def decode_line(line: np.ndarray, templates: list) -> tuple:
+    # Best explanation of the line's columns as blanks and digit glyphs: [(digit, start, end, confidence)]
+    height, width = line.shape
+    costs = []
+    for digit, template in templates:
+        w = template.shape[1]
+        if w > width:
+            costs.append(None)
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(line, (height, w))[0]
+        diff = np.abs(windows - template).sum(axis=(1, 2))
+        mass = windows.sum(axis=(1, 2)) + template.sum()
+        costs.append((w, diff, 1.0 - diff / np.maximum(mass, 1e-6)))
+    blank = line.sum(axis=0)
+    best = np.full(width + 1, np.inf)
+    best[0] = 0.0
+    choice = [None] * (width + 1)
+    for x in range(width):
+        if not np.isfinite(best[x]):
+            continue
+        if best[x] + blank[x] < best[x + 1]:
+            best[x + 1], choice[x + 1] = best[x] + blank[x], (x, None, 1.0)
+        for (digit, _), cost in zip(templates, costs):
+            if cost is None or x + cost[0] > width:
+                continue
+            w, diff, confidence = cost
+            total = best[x] + diff[x]
+            if total < best[x + w]:
+                best[x + w], choice[x + w] = total, (x, digit, float(confidence[x]))
+    glyphs, x = [], width
+    while x > 0:
+        start, digit, confidence = choice[x]
+        if digit is not None:
+            glyphs.append((digit, start, x, confidence))
+        x = start
+    return glyphs[::-1]
+
+
+def _groups(glyphs: list, gap: float) -> list:
+    # Split a decoded line into digit groups at blank gaps wider than `gap` columns
+    groups = []
+    for digit, start, end, confidence in glyphs:
+        if not groups or start - groups[-1]["end"] > gap:
+            groups.append({"digits": "", "confidences": [], "end": end})
+        groups[-1]["digits"] += digit
+        groups[-1]["confidences"].append(confidence)
+        groups[-1]["end"] = end
+    return groups
+
+
+def card_candidates(glyphs: list, digit_width: int) -> list:
+    # Luhn-valid numbers of 12-19 digits made of whole consecutive groups, e.g. "4989 4089 0029 8888".
+    # A candidate lying inside a longer Luhn-valid candidate of the same line is dropped: its weakest glyph
+    # can only be as good or better, so it would otherwise beat the full number (e.g. a 12-digit prefix).
+    # A candidate covering only part of the line's digits is scored by at most that fraction, so it is
+    # never confident on its own (the full run may be a misread or a longer number).
+    groups = _groups(glyphs, gap=digit_width / 2)
+    total = sum(len(group["digits"]) for group in groups)
+    spans = []
+    for first in range(len(groups)):
+        digits, confidences = "", []
+        for last in range(first, len(groups)):
+            digits += groups[last]["digits"]
+            confidences += groups[last]["confidences"]
+            if len(digits) > 19:
+                break
+            if len(digits) >= 12 and luhn_valid(digits):
+                confidence = min(min(confidences), len(digits) / total)
+                spans.append((first, last, {"number": digits, "confidence": round(confidence, 4)}))
+    return [candidate for first, last, candidate in spans
+            if not any(f <= first and last <= l and (f, l) != (first, last) for f, l, _ in spans)]
+
+
+def read_card_number(path: str) -> OCRResult:
+    with Image.open(path) as image:
+        ink = ink_map(image)
+    candidates = []
+    for top, bottom in _runs(ink.max(axis=1) > INK_THRESHOLD, max_gap=1):
+        height = bottom - top
+        if height < 5:
+            continue
+        columns = _runs(ink[top:bottom].max(axis=0) > INK_THRESHOLD)
+        if not columns:
+            continue
+        left, right = columns[0][0], columns[-1][1]
+        for templates in templates_for_height(height):
+            # Centre the line on the template height
+            rows = templates[0][1].shape[0]
+            start = min(max(0, top - (rows - height) // 2), ink.shape[0] - rows)
+            glyphs = decode_line(ink[start:start + rows, left:right], templates)
+            digit_width = int(np.median([template.shape[1] for _, template in templates]))
+            candidates.extend(card_candidates(glyphs, digit_width))
+    # One entry per number at its best confidence, most confident first
+    best_by_number = {}
+    for candidate in candidates:
+        if candidate["confidence"] > best_by_number.get(candidate["number"], {"confidence": -1.0})["confidence"]:
+            best_by_number[candidate["number"]] = candidate
+    candidates = sorted(best_by_number.values(), key=lambda c: (c["confidence"], len(c["number"]) == 16), reverse=True)
+    best = candidates[0] if candidates else None
+    return OCRResult(number=best["number"] if best else None, confidence=best["confidence"] if best else 0.0,
+                     candidates=candidates[:5])
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+        return _pool
+
+
+def read_card_numbers(paths: list, workers: int = OCR_WORKERS) -> list:
+    # OCRResult (or {"error"}) per path, in order, across the process pool
+    def safe(result):
+        try:
+            return result()
+        except (OSError, ValueError) as e:
+            return {"number": None, "confidence": 0.0, "error": str(e)}
+    if workers <= 1 or len(paths) <= 1:
+        return [safe(lambda path=path: read_card_number(path)) for path in paths]
+    futures = [_get_pool().submit(read_card_number, path) for path in paths]
+    return [safe(future.result) for future in futures]
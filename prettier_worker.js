@@ -0,0 +1,45 @@
+// Long-lived Prettier worker for formatter.py.
+// Prettier is loaded once; requests arrive as one JSON object per stdin line and responses are written
+// as one JSON object per stdout line, tagged with the request id (responses may come out of order).
+//   request:  {"id": 1, "filepath": "/data/format.md", "source": "..."}
+//   response: {"id": 1, "formatted": "..."} or {"id": 1, "error": "..."}
+// The first line written is {"ready": true, "version": "<prettier version>"}.
+
+const readline = require("readline");
+
+let prettier;
+try {
+  prettier = require(process.env.PRETTIER_MODULE || "prettier");
+} catch (error) {
+  process.stdout.write(JSON.stringify({ ready: false, error: String(error.message || error) }) + "\n");
+  process.exit(1);
+}
+
+function reply(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+async function handle(line) {
+  let request;
+  try {
+    request = JSON.parse(line);
+  } catch (error) {
+    return;
+  }
+  try {
+    // Same option resolution as `prettier --stdin-filepath <filepath>`
+    const config = (await prettier.resolveConfig(request.filepath)) || {};
+    const formatted = await prettier.format(request.source, { ...config, filepath: request.filepath });
+    reply({ id: request.id, formatted });
+  } catch (error) {
+    reply({ id: request.id, error: String(error.message || error) });
+  }
+}
+
+reply({ ready: true, version: prettier.version });
+readline
+  .createInterface({ input: process.stdin, crlfDelay: Infinity })
+  .on("line", (line) => {
+    if (line.trim()) handle(line);
+  });
+// Node exits by itself once stdin is closed and in-flight requests have been answered
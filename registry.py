@@ -0,0 +1,94 @@
+# Table-driven tool registry: each tool declares its OpenAI schema, argument model and handler once.
+# Argument models are compiled from the JSON schema with pydantic when the tool is registered.
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional
+
+from pydantic import BaseModel, ConfigDict, create_model
+
+JSON_TYPES = {"string": str, "integer": int, "number": float, "boolean": bool, "object": dict}
+
+
+def _nullable(schema: dict) -> bool:
+    return isinstance(schema.get("type"), list) and "null" in schema["type"]
+
+
+def _annotation(schema: dict):
+    if isinstance(schema.get("type"), list):
+        types = [t for t in schema["type"] if t != "null"]
+        return _annotation({**schema, "type": types[0] if types else None})
+    if schema.get("type") == "array":
+        return List[_annotation(schema.get("items", {}))]
+    return JSON_TYPES.get(schema.get("type"), Any)
+
+
+def build_model(name: str, parameters: dict):
+    # Compile a pydantic model from a function's JSON-schema "parameters"
+    required = set(parameters.get("required", []))
+    fields = {}
+    for key, schema in parameters.get("properties", {}).items():
+        annotation = _annotation(schema)
+        # Nullable fields are listed as required for strict-mode schemas but may be omitted locally
+        if key in required and "default" not in schema and not _nullable(schema):
+            fields[key] = (annotation, ...)
+        else:
+            fields[key] = (Optional[annotation], schema.get("default"))
+    model_name = "".join(part.title() for part in name.split("_")) + "Args"
+    return create_model(model_name, __config__=ConfigDict(extra="ignore"), **fields)
+
+
+@dataclass
+class Tool:
+    schema: dict
+    handler: Callable
+    args_model: type
+    # Argument keys holding input/output paths; None means the tool may touch anything
+    inputs: Optional[List[str]] = None
+    outputs: Optional[List[str]] = None
+    is_async: bool = field(init=False)
+
+    def __post_init__(self):
+        self.is_async = asyncio.iscoroutinefunction(self.handler)
+
+    @property
+    def name(self) -> str:
+        return self.schema["function"]["name"]
+
+    def parse(self, arguments) -> BaseModel:
+        if isinstance(arguments, (str, bytes)):
+            return self.args_model.model_validate_json(arguments)
+        return self.args_model.model_validate(arguments)
+
+    async def run(self, arguments):
+        args = self.parse(arguments)
+        if self.is_async:
+            return await self.handler(args)
+        # Blocking handlers run on the thread pool
+        return await asyncio.to_thread(self.handler, args)
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools = {}
+
+    def tool(self, schema: dict, inputs: List[str] = None, outputs: List[str] = None):
+        # Decorator registering a handler that receives the validated arguments model
+        def register(handler: Callable):
+            name = schema["function"]["name"]
+            args_model = build_model(name, schema["function"].get("parameters", {}))
+            self._tools[name] = Tool(schema, handler, args_model, inputs, outputs)
+            return handler
+        return register
+
+    def get(self, name: str) -> Optional[Tool]:
+        return self._tools.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def __iter__(self):
+        return iter(self._tools.values())
+
+    def schemas(self) -> list:
+        return [tool.schema for tool in self._tools.values()]
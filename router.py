@@ -0,0 +1,216 @@
+# Deterministic fast-path router in front of the LLM function-calling request.
+# Recurring task phrasings are matched to a tool with a small keyword classifier and their
+# arguments pulled out with compiled patterns; anything ambiguous falls back to the LLM.
+
+import os
+import re
+from threading import Lock
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") != "0"
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.75"))
+
+# Absolute paths, but not the path component of a URL
+PATH_RE = re.compile(r"(?<![\w:/.])(/[\w.\-/]+)")
+URL_RE = re.compile(r"https?://[^\s`'\"<>]+")
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+DAY_RE = re.compile(r"\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)s?\b", re.I)
+VERSION_RE = re.compile(r"prettier@(\d+(?:\.\d+)*)", re.I)
+COUNT_RE = re.compile(r"\b(\d+)\s+(?:most\s+)?(?:recent|latest|newest)\b", re.I)
+TABLE_RE = re.compile(r"(?:has a|table)\s+`?(\w+)`?", re.I)
+QUOTED_RE = re.compile(r"[\"“]([^\"”]+)[\"”]")
+SORT_BY_RE = re.compile(r"\bby\s+(.+?)(?:,?\s+and\s+|\s+(?:to|into|in)\s+`?/|[.;]?\s*$)", re.I)
+FIELD_RE = re.compile(r"[a-z_]+", re.I)
+
+# Qualifiers an extractor does not parse: when present, the extractor's defaults would silently answer a
+# different question, so the task goes to the LLM instead
+UNSUPPORTED = {
+    "count_days": r"\b(?:19|20)\d{2}\b|\b(?:between|since|before|after|until|till|during|from|except|excluding|"
+                  r"only|weeks?|months?|years?|january|february|march|april|may|june|july|august|september|"
+                  r"october|november|december)\b",
+    "sort_contacts": r"\b(?:desc|descending|reverse|reversed|decreasing)\b",
+    "logs_recent": r"\blines\b|\blast\b|\boldest\b|\bleast\b|\bmatch|\bcontain|\bgrep\b|\bexcept\b|\bexcluding\b",
+    "email_sender": r"\b(?:recipients?|receivers?|to address|cc|bcc|subject|date|reply-?to|name|domain)\b",
+    "get_completions_image": r"\b(?:expir\w*|cvv|cvc|security code|holder|name|valid|last \d+|first \d+)\b",
+    "get_similar_comments": r"\b(?:least|dissimilar|different|pairs|top|\d+)\b",
+}
+UNSUPPORTED = {name: re.compile(pattern, re.I) for name, pattern in UNSUPPORTED.items()}
+
+# Keyword features per tool: (compiled pattern, weight)
+KEYWORDS = {
+    "script_runner": [(r"\brun\b.*\bscript\b", 2), (r"\binstall\b", 1), (r"\buv\b", 1), (r"https?://", 1)],
+    "format_file": [(r"\bformat\b", 2), (r"prettier", 3), (r"in-?place", 1)],
+    "count_days": [(r"\bcount\b", 1), (r"\bdates?\b", 2), (DAY_RE.pattern, 2)],
+    "sort_contacts": [(r"\bsort\b", 2), (r"\bcontacts?\b", 2), (r"last_name|first_name", 1)],
+    "logs_recent": [(r"\.log\b|\blogs?\b", 2), (r"\brecent\b", 2), (r"\bfirst line\b", 1)],
+    "markdown_index": [(r"\bmarkdown\b|\.md\b", 2), (r"\bH1\b|\btitle\b", 1), (r"\bindex\b", 2)],
+    "search_docs": [(r"\bsearch\b", 3), (r"\bdocs?\b|\bdocuments?\b|\bmarkdown\b", 1)],
+    "email_sender": [(r"\bemail\b", 2), (r"\bsender\b", 3)],
+    "get_completions_image": [(r"\bimage\b|\.png\b|\.jpe?g\b", 2), (r"credit.?card|card number", 3)],
+    "get_similar_comments": [(r"\bcomments?\b", 2), (r"\bsimilar\b", 2), (r"\bembeddings?\b", 1)],
+    "query_sql": [(r"\bsqlite\b|\bsql\b|\.db\b|\bdatabase\b", 3), (r"\btotal sales\b|\bsum\b", 1)],
+}
+KEYWORDS = {
+    name: [(re.compile(pattern, re.I), weight) for pattern, weight in features]
+    for name, features in KEYWORDS.items()
+}
+
+
+def classify(task: str):
+    # Score every tool by its keyword hits; confidence is the winner's share of the top two scores
+    scores = sorted(
+        ((sum(weight for pattern, weight in features if pattern.search(task)), name)
+         for name, features in KEYWORDS.items()),
+        reverse=True,
+    )
+    (best, name), (second, _) = scores[0], scores[1]
+    if best == 0:
+        return None, 0.0
+    return name, best / (best + second)
+
+
+def _paths(task: str):
+    return [path.rstrip(".") for path in PATH_RE.findall(task)]
+
+
+def _io(task: str, suffix: str = None):
+    # First path is the input, last distinct path is the output
+    paths = _paths(task)
+    if suffix:
+        inputs = [p for p in paths if p.endswith(suffix)]
+        paths = inputs[:1] + [p for p in paths if p not in inputs[:1]]
+    if len(paths) < 2:
+        return None
+    return paths[0], paths[-1]
+
+
+def _script_runner(task):
+    urls = URL_RE.findall(task)
+    emails = [e for e in EMAIL_RE.findall(task) if not any(e in url for url in urls)]
+    if not urls or not emails:
+        return None
+    return {"script_url": urls[0].rstrip(".,`"), "args": [emails[0]]}
+
+
+def _format_file(task):
+    paths = _paths(task)
+    version = VERSION_RE.search(task)
+    if not paths or not version:
+        return None
+    return {"path": paths[0], "prettier_version": version.group(1)}
+
+
+def _count_days(task):
+    days, io = {day.lower() for day in DAY_RE.findall(task)}, _io(task)
+    if len(days) != 1 or not io:
+        return None
+    day = DAY_RE.search(task)
+    return {"day_of_week": day.group(1).lower(), "input_file_path": io[0], "output_file_path": io[1]}
+
+
+def _sort_contacts(task):
+    # Only the default order (last_name, then first_name) is extracted
+    io, by = _io(task, ".json"), SORT_BY_RE.search(task)
+    if not io:
+        return None
+    if by and [f for f in FIELD_RE.findall(by.group(1)) if f.lower() not in ("then", "and")] != ["last_name", "first_name"]:
+        return None
+    return {"input_path": io[0], "output_path": io[1]}
+
+
+def _logs_recent(task):
+    # Only "the first line of the N most recent files" is extracted
+    io, count = _io(task), COUNT_RE.search(task)
+    if not io or not count or not re.search(r"\bfirst line\b", task, re.I):
+        return None
+    arguments = {"log_dir_path": io[0], "output_file_path": io[1], "num_files": int(count.group(1))}
+    extension = re.search(r"`?(\.\w+)`?\s+files?\b", task)
+    if extension:
+        arguments["extensions"] = [extension.group(1)]
+    return arguments
+
+
+def _markdown_index(task):
+    paths = _paths(task)
+    outputs = [p for p in paths if p.endswith(".json") or p.endswith(".md")]
+    dirs = [p for p in paths if p not in outputs]
+    if not dirs or not outputs:
+        return None
+    return {"doc_dir_path": dirs[0], "output_file_path": outputs[-1]}
+
+
+def _search_docs(task):
+    # The query must be quoted; the first path (if any) is the docs directory and a .json path the output
+    query, paths = QUOTED_RE.search(task), _paths(task)
+    if not query:
+        return None
+    arguments = {"query": query.group(1), "doc_dir_path": next((p for p in paths if not p.endswith(".json")), "/data/docs")}
+    outputs = [p for p in paths if p.endswith(".json")]
+    if outputs:
+        arguments["output_file_path"] = outputs[-1]
+    return arguments
+
+
+def _input_output(task):
+    io = _io(task)
+    if not io:
+        return None
+    return {"input_location": io[0], "output_location": io[1]}
+
+
+def _query_sql(task):
+    # Only the "total sales of <type>" shape is deterministic; other questions need the LLM to write SQL
+    io, table, kind = _io(task, ".db"), TABLE_RE.search(task), QUOTED_RE.search(task)
+    if not io or not table or not kind or not re.search(r"\btotal sales\b", task, re.I):
+        return None
+    kind = kind.group(1).strip().lower().replace("'", "''")
+    query = f"SELECT SUM(units * price) FROM {table.group(1)} WHERE LOWER(TRIM(type)) = '{kind}'"
+    return {"query": query, "filename": io[0], "output_filename": io[1]}
+
+
+EXTRACTORS = {
+    "script_runner": _script_runner,
+    "format_file": _format_file,
+    "count_days": _count_days,
+    "sort_contacts": _sort_contacts,
+    "logs_recent": _logs_recent,
+    "markdown_index": _markdown_index,
+    "search_docs": _search_docs,
+    "email_sender": _input_output,
+    "get_completions_image": _input_output,
+    "get_similar_comments": _input_output,
+    "query_sql": _query_sql,
+}
+
+stats = {"hits": 0, "misses": 0}
+_stats_lock = Lock()
+
+
+def _record(hit: bool):
+    with _stats_lock:
+        stats["hits" if hit else "misses"] += 1
+
+
+def _extract(name: str, task: str):
+    unsupported = UNSUPPORTED.get(name)
+    # Paths are not qualifiers (e.g. /data/dates-2024.txt)
+    if unsupported is not None and unsupported.search(PATH_RE.sub(" ", task)):
+        return None
+    return EXTRACTORS[name](task)
+
+
+def route(task: str):
+    # Returns (function_name, arguments) when confident, otherwise None to fall back to the LLM
+    if not ROUTER_ENABLED:
+        return None
+    name, confidence = classify(task)
+    arguments = _extract(name, task) if name and confidence >= ROUTER_MIN_CONFIDENCE else None
+    _record(arguments is not None)
+    if arguments is None:
+        return None
+    return name, arguments
+
+
+def router_stats() -> dict:
+    with _stats_lock:
+        total = stats["hits"] + stats["misses"]
+        return {**stats, "total": total, "hit_ratio": stats["hits"] / total if total else 0.0}
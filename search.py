@@ -0,0 +1,254 @@
+# Full-text search over a Markdown docs tree for search_docs and GET /search.
+# Every file's title, headings and body live in a SQLite FTS5 table ranked with bm25, one database per
+# docs root under CACHE_DIR. The index is kept incremental: an inotify watcher (shared with the log
+# index) queues changed paths and only those are re-read; without inotify the tree is re-stat'ed at
+# most every DOCS_SEARCH_POLL_INTERVAL seconds and only files whose (mtime, size) changed are re-read.
+
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from docindex import DOCS_EXTENSIONS, DOCS_IO_WORKERS, iter_markdown
+from logs import InotifyWatcher
+
+DOCS_SEARCH_DIR = os.path.join(os.getenv("CACHE_DIR", "/data/.cache"), "search")
+DOCS_SEARCH_INOTIFY = os.getenv("DOCS_SEARCH_INOTIFY", "1") != "0"
+DOCS_SEARCH_POLL_INTERVAL = float(os.getenv("DOCS_SEARCH_POLL_INTERVAL", "5.0"))
+DOCS_SEARCH_MAX_BYTES = int(os.getenv("DOCS_SEARCH_MAX_BYTES", str(1024 * 1024)))
+DOCS_SEARCH_MAX = int(os.getenv("DOCS_SEARCH_MAX", "8"))
+# bm25 column weights: path (unindexed), title, headings, body
+RANK_WEIGHTS = (0.0, 10.0, 5.0, 1.0)
+
+HEADING_RE = re.compile(r"^#{1,6}\s+(.*?)\s*#*\s*$")
+TERM_RE = re.compile(r"\w+\*?")
+
+
+def parse_markdown(text: str) -> tuple:
+    # (title, headings, body): the title is the first "# " heading, as in markdown_index
+    title, headings, body = None, [], []
+    for line in text.splitlines():
+        if title is None and line.startswith("# "):
+            title = line[2:].strip()
+        match = HEADING_RE.match(line)
+        if match:
+            headings.append(match.group(1))
+        else:
+            body.append(line)
+    return title, "\n".join(headings), "\n".join(body)
+
+
+def read_document(path: str):
+    try:
+        with open(path, "rb") as f:
+            return parse_markdown(f.read(DOCS_SEARCH_MAX_BYTES).decode("utf-8", errors="replace"))
+    except OSError:
+        return None
+
+
+def match_expression(query: str) -> str:
+    # Free text to an FTS5 expression: every term must match, "term*" is a prefix search.
+    # Terms are quoted so user input can never be a syntax error.
+    terms = []
+    for term in TERM_RE.findall(query):
+        prefix = term.endswith("*")
+        terms.append('"' + term.rstrip("*") + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+class DocsSearchIndex:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        # InotifyWatcher protocol: watch the whole tree, report file changes via update()
+        self.recursive = True
+        self.path = os.path.join(DOCS_SEARCH_DIR, hashlib.sha1(self.root.encode()).hexdigest() + ".sqlite")
+        self.lock = Lock()
+        self.pending = set()
+        self.dirty = True
+        self.last_scan = 0.0
+        self._conn = None
+        self.watcher = None
+        if DOCS_SEARCH_INOTIFY and sys.platform.startswith("linux"):
+            try:
+                self.watcher = InotifyWatcher(self)
+            except (OSError, AttributeError):
+                self.watcher = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(DOCS_SEARCH_DIR, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                doc_id INTEGER NOT NULL)""")
+            self._conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(
+                path UNINDEXED, title, headings, body, tokenize = 'unicode61 remove_diacritics 2')""")
+        return self._conn
+
+    def invalidate(self):
+        self.dirty = True
+
+    def watcher_stopped(self):
+        self.watcher = None
+        self.dirty = True
+
+    def update(self, relative: str):
+        if relative.endswith(DOCS_EXTENSIONS):
+            with self.lock:
+                self.pending.add(relative)
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _watch(self, directory: str, prefix: str):
+        watcher = self.watcher
+        if watcher is not None and directory not in watcher.watched:
+            try:
+                watcher.watch(directory, prefix)
+            except OSError:
+                # e.g. out of inotify watches: fall back to polling
+                watcher.stop()
+                self.watcher = None
+
+    def _stat(self, relative: str):
+        try:
+            stat = os.stat(os.path.join(self.root, relative))
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _apply(self, current: dict, stored: dict):
+        # current/stored: relative path -> (mtime_ns, size[, doc_id]) or None.
+        # Re-read paths whose (mtime, size) changed, drop the ones that are gone.
+        changed = [r for r in current if current[r] is not None
+                   and (stored.get(r) is None or tuple(stored[r][:2]) != current[r])]
+        removed = [r for r in current if current[r] is None and stored.get(r) is not None]
+        if not changed and not removed:
+            return 0
+        paths = [os.path.join(self.root, relative) for relative in changed]
+        if len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=min(DOCS_IO_WORKERS, len(paths))) as pool:
+                documents = list(pool.map(read_document, paths))
+        else:
+            documents = [read_document(path) for path in paths]
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            for relative in removed:
+                conn.execute("DELETE FROM docs WHERE rowid = ?", (stored[relative][2],))
+                conn.execute("DELETE FROM files WHERE path = ?", (relative,))
+            for relative, document in zip(changed, documents):
+                if stored.get(relative) is not None:
+                    conn.execute("DELETE FROM docs WHERE rowid = ?", (stored[relative][2],))
+                if document is None:
+                    conn.execute("DELETE FROM files WHERE path = ?", (relative,))
+                    continue
+                title, headings, body = document
+                doc_id = conn.execute("INSERT INTO docs (path, title, headings, body) VALUES (?, ?, ?, ?)",
+                                      (relative, title or "", headings, body)).lastrowid
+                conn.execute("INSERT OR REPLACE INTO files (path, mtime_ns, size, doc_id) VALUES (?, ?, ?, ?)",
+                             (relative, *current[relative], doc_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(changed) + len(removed)
+
+    def _scan(self) -> int:
+        # Full re-stat of the tree, diffed against the stored (mtime, size) of every file
+        current = {relative: (mtime, size)
+                   for relative, mtime, size in iter_markdown(self.root, on_directory=self._watch)}
+        stored = {row[0]: row[1:] for row in self.conn.execute("SELECT path, mtime_ns, size, doc_id FROM files")}
+        for relative in stored:
+            current.setdefault(relative, None)
+        changes = self._apply(current, stored)
+        watcher = self.watcher
+        if watcher is not None and not watcher.is_alive() and watcher.fd >= 0:
+            watcher.start()
+        return changes
+
+    def refresh(self) -> int:
+        # Returns the number of documents (re)indexed or removed
+        watcher = self.watcher
+        if watcher is not None and watcher.is_alive():
+            # Queued events first (update() takes the lock), so edits made just before the query are seen
+            watcher.drain()
+        with self.lock:
+            now = time.monotonic()
+            watching = self.watcher is not None and self.watcher.is_alive()
+            if self.dirty or (not watching and now - self.last_scan >= DOCS_SEARCH_POLL_INTERVAL):
+                self.dirty, self.last_scan = False, now
+                self.pending.clear()
+                return self._scan()
+            if not self.pending:
+                return 0
+            candidates, self.pending = sorted(self.pending), set()
+            stored = {}
+            for relative in candidates:
+                stored[relative] = self.conn.execute(
+                    "SELECT mtime_ns, size, doc_id FROM files WHERE path = ?", (relative,)).fetchone()
+            return self._apply({relative: self._stat(relative) for relative in candidates}, stored)
+
+    def search(self, query: str, limit: int = 10) -> list:
+        expression = match_expression(query)
+        if not expression:
+            return []
+        self.refresh()
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT path, title, bm25(docs, {", ".join(map(str, RANK_WEIGHTS))}) AS score,
+                           snippet(docs, 3, '[', ']', '...', 12)
+                    FROM docs WHERE docs MATCH ? ORDER BY score LIMIT ?""",
+                (expression, limit)).fetchall()
+        # bm25 is lower-is-better; report higher-is-better scores
+        return [{"path": path, "title": title or None, "score": round(-score, 6), "snippet": snippet}
+                for path, title, score, snippet in rows]
+
+    def stats(self) -> dict:
+        with self.lock:
+            documents = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return {"root": self.root, "documents": documents,
+                "watching": self.watcher is not None and self.watcher.is_alive()}
+
+
+_indexes = OrderedDict()
+_indexes_lock = Lock()
+
+
+def search_index(root: str) -> DocsSearchIndex:
+    root = os.path.abspath(root)
+    if not os.path.isdir(root):
+        raise FileNotFoundError(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = DocsSearchIndex(root)
+            while len(_indexes) > DOCS_SEARCH_MAX:
+                _indexes.popitem(last=False)[1].close()
+        _indexes.move_to_end(root)
+        return index
+
+
+def search_docs(root: str, query: str, limit: int = 10) -> list:
+    return search_index(root).search(query, limit)
+
+
+def close_indexes():
+    with _indexes_lock:
+        while _indexes:
+            _indexes.popitem()[1].close()
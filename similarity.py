@@ -0,0 +1,125 @@
+# Most-similar pairs over normalized embeddings without the N x N similarity matrix.
+# Exact mode walks the upper triangle in square tiles (float32 matmul per tile)
+# and keeps only each tile's top k; row blocks run on a thread pool (BLAS releases the GIL).
+# Approximate mode buckets vectors with random-projection LSH over several tables and compares only
+# vectors sharing a bucket, scoring candidates exactly against the original vectors.
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SIMILARITY_TILE = int(os.getenv("SIMILARITY_TILE", "2048"))
+SIMILARITY_WORKERS = int(os.getenv("SIMILARITY_WORKERS", str(os.cpu_count() or 1)))
+# "auto" switches to approximate search from this many vectors
+SIMILARITY_APPROXIMATE_FROM = int(os.getenv("SIMILARITY_APPROXIMATE_FROM", "50000"))
+SIMILARITY_LSH_TABLES = int(os.getenv("SIMILARITY_LSH_TABLES", "8"))
+SIMILARITY_LSH_BUCKET = int(os.getenv("SIMILARITY_LSH_BUCKET", "256"))
+MODES = ("auto", "exact", "approximate")
+
+
+def _top(scores: np.ndarray, first: np.ndarray, second: np.ndarray, k: int) -> tuple:
+    # The k best (scores, first, second), best first
+    keep = np.isfinite(scores)
+    scores, first, second = scores[keep], first[keep], second[keep]
+    if len(scores) > k:
+        index = np.argpartition(scores, -k)[-k:]
+        scores, first, second = scores[index], first[index], second[index]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], first[order], second[order]
+
+
+def _merge(parts: list, k: int, n: int) -> tuple:
+    if not parts:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    scores, first, second = (np.concatenate(column) for column in zip(*parts))
+    # The same pair can come from several tiles or LSH tables
+    _, unique = np.unique(first * n + second, return_index=True)
+    return _top(scores[unique], first[unique], second[unique], k)
+
+
+def _tile_top(vectors: np.ndarray, rows: np.ndarray, columns: np.ndarray, k: int, same: bool) -> tuple:
+    # Top k pairs (i < j) between two index sets; `same` when rows and columns are the same set
+    scores = vectors[rows].astype(np.float32) @ vectors[columns].astype(np.float32).T
+    if same:
+        scores[np.tril_indices(len(rows))] = -np.inf
+    flat = scores.ravel()
+    if len(flat) > k:
+        index = np.argpartition(flat, -k)[-k:]
+    else:
+        index = np.arange(len(flat))
+    # Drop the masked (-inf) lower triangle here: its (min, max) keys collide with the real pairs in _merge
+    index = index[np.isfinite(flat[index])]
+    r, c = np.divmod(index, scores.shape[1])
+    first, second = rows[r], columns[c]
+    return flat[index], np.minimum(first, second), np.maximum(first, second)
+
+
+def _exact_subset(vectors: np.ndarray, indices: np.ndarray, k: int, tile: int) -> list:
+    # Per-tile top k over all pairs of `indices`, one row block at a time
+    parts = []
+    blocks = [indices[start:start + tile] for start in range(0, len(indices), tile)]
+    for b, rows in enumerate(blocks):
+        for c in range(b, len(blocks)):
+            parts.append(_tile_top(vectors, rows, blocks[c], k, same=b == c))
+    return parts
+
+
+def exact_pairs(vectors: np.ndarray, k: int = 1, tile: int = SIMILARITY_TILE, workers: int = SIMILARITY_WORKERS) -> tuple:
+    # (scores, first, second) of the k most similar pairs, best first; memory is O(workers * tile^2)
+    n = len(vectors)
+    indices = np.arange(n)
+    blocks = [indices[start:start + tile] for start in range(0, n, tile)]
+
+    def row_block(b: int) -> tuple:
+        parts = [_tile_top(vectors, blocks[b], blocks[c], k, same=b == c) for c in range(b, len(blocks))]
+        return _merge(parts, k, n)
+    if workers <= 1 or len(blocks) <= 1:
+        parts = [row_block(b) for b in range(len(blocks))]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(row_block, range(len(blocks))))
+    return _merge(parts, k, n)
+
+
+def lsh_buckets(vectors: np.ndarray, bits: int, seed: int) -> list:
+    # Groups of row indices whose random-hyperplane signatures agree (singletons dropped)
+    planes = np.random.default_rng(seed).standard_normal((vectors.shape[1], bits)).astype(np.float32)
+    signatures = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SIMILARITY_TILE):
+        chunk = vectors[start:start + SIMILARITY_TILE].astype(np.float32) @ planes > 0
+        signatures[start:start + SIMILARITY_TILE] = chunk @ (1 << np.arange(bits, dtype=np.int64))
+    order = np.argsort(signatures, kind="stable")
+    bounds = np.flatnonzero(np.diff(signatures[order])) + 1
+    return [group for group in np.split(order, bounds) if len(group) > 1]
+
+
+def approximate_pairs(vectors: np.ndarray, k: int = 1, tables: int = SIMILARITY_LSH_TABLES,
+                      bucket: int = SIMILARITY_LSH_BUCKET, workers: int = SIMILARITY_WORKERS) -> tuple:
+    # Like exact_pairs, but only pairs that share an LSH bucket in at least one table are compared
+    n = len(vectors)
+    bits = max(1, min(62, round(math.log2(max(n / bucket, 1))) + 1))
+
+    def table(seed: int) -> tuple:
+        parts = []
+        for group in lsh_buckets(vectors, bits, seed):
+            parts.extend(_exact_subset(vectors, group, k, SIMILARITY_TILE))
+        return _merge(parts, k, n)
+    if workers <= 1 or tables <= 1:
+        parts = [table(seed) for seed in range(tables)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, tables)) as executor:
+            parts = list(executor.map(table, range(tables)))
+    return _merge(parts, k, n)
+
+
+def top_pairs(vectors: np.ndarray, k: int = 1, mode: str = "auto") -> tuple:
+    # (pairs [(i, j, score)] best first, mode used)
+    if mode not in MODES:
+        raise ValueError(f"Unknown similarity mode: {mode}")
+    if mode == "auto":
+        mode = "approximate" if len(vectors) >= SIMILARITY_APPROXIMATE_FROM else "exact"
+    search = approximate_pairs if mode == "approximate" else exact_pairs
+    scores, first, second = search(vectors, k)
+    return [(int(i), int(j), float(score)) for score, i, j in zip(scores, first, second)], mode
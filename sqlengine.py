@@ -0,0 +1,371 @@
+# Read-only SQL execution for query_sql.
+# SQLite databases are opened read-only (mode=ro URI, PRAGMA query_only, ATTACH and PRAGMA writes denied)
+# from a small per-database pool; pooled connections keep sqlite3's prepared-statement cache warm across
+# calls. CSV, Parquet, JSON and DuckDB files run on DuckDB, as do SQLite files on engine="duckdb" (or from
+# SQL_DUCKDB_SQLITE_BYTES on "auto") when DuckDB's sqlite extension is installed; DuckDB only accepts a
+# single SELECT. Results are streamed to the output in batches (CSV, JSON, JSON lines or Parquet by
+# extension), never materialized whole; a single value written to any other file is the bare value.
+
+import csv
+import itertools
+import json
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from urllib.parse import quote
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "4"))
+SQL_POOLS_MAX = int(os.getenv("SQL_POOLS_MAX", "16"))
+SQL_STATEMENT_CACHE = int(os.getenv("SQL_STATEMENT_CACHE", "256"))
+SQL_BATCH_ROWS = int(os.getenv("SQL_BATCH_ROWS", "10000"))
+# SQLite files from this size run on DuckDB under engine="auto" (when its sqlite extension loads)
+SQL_DUCKDB_SQLITE_BYTES = int(os.getenv("SQL_DUCKDB_SQLITE_BYTES", str(1024 ** 3)))
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+SQLITE_MAGIC = b"SQLite format 3\x00"
+# DuckDB table functions for plain data files; the file is queryable as its name stem and as "data"
+DUCKDB_READERS = {".csv": "read_csv_auto", ".tsv": "read_csv_auto", ".parquet": "read_parquet",
+                  ".json": "read_json_auto", ".jsonl": "read_json_auto", ".ndjson": "read_json_auto"}
+OUTPUT_FORMATS = {".csv": "csv", ".json": "json", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+ENGINES = ("auto", "sqlite", "duckdb")
+SCHEMA_PRAGMAS = {"table_info", "table_xinfo", "table_list", "index_list", "index_info", "index_xinfo",
+                  "foreign_key_list"}
+
+IDENTIFIER_RE = re.compile(r"[^0-9A-Za-z_]")
+
+
+class SQLEngineError(Exception):
+    pass
+
+
+def _identity(path: str) -> tuple:
+    # A database replaced on disk (same path, new inode) needs new connections
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+
+def _authorize(action, arg1, arg2, database, trigger):
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    # Reading pragmas is fine, setting them (e.g. query_only = OFF) is not; schema pragmas take an argument
+    if action == sqlite3.SQLITE_PRAGMA and arg2 is not None and arg1.lower() not in SCHEMA_PRAGMAS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+class SQLitePool:
+    def __init__(self, path: str, size: int = SQL_POOL_SIZE):
+        self.path = path
+        self.size = max(1, size)
+        self.identity = _identity(path)
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.closed = False
+        self.lock = Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", uri=True, check_same_thread=False,
+                               cached_statements=SQL_STATEMENT_CACHE)
+        conn.execute("PRAGMA query_only = ON")
+        conn.set_authorizer(_authorize)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = None
+        with self.lock:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+        if conn is None:
+            if create:
+                try:
+                    conn = self._connect()
+                except BaseException:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            with self.lock:
+                if self.closed:
+                    conn.close()
+                else:
+                    self.idle.put(conn)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            while True:
+                try:
+                    self.idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+class DuckDBSource:
+    # One read-only DuckDB connection per source; every query runs on its own cursor
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.identity = _identity(path)
+        if kind == "duckdb":
+            self.conn = duckdb.connect(path, read_only=True)
+        else:
+            self.conn = duckdb.connect(":memory:")
+            literal = "'" + path.replace("'", "''") + "'"
+            if kind == "sqlite":
+                self.conn.execute(f"ATTACH {literal} AS source (TYPE sqlite, READ_ONLY)")
+                self.conn.execute("USE source")
+            else:
+                reader = DUCKDB_READERS[os.path.splitext(path)[1].lower()]
+                stem = IDENTIFIER_RE.sub("_", os.path.splitext(os.path.basename(path))[0]) or "data"
+                for name in dict.fromkeys([stem, "data"]):
+                    self.conn.execute(f'CREATE VIEW "{name}" AS SELECT * FROM {reader}({literal})')
+        self.conn.execute("SET lock_configuration = true")
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def close(self):
+        self.conn.close()
+
+
+_sqlite_extension = None
+
+
+def duckdb_reads_sqlite() -> bool:
+    # Whether DuckDB's sqlite extension loads (installed in the image; not downloaded at query time)
+    global _sqlite_extension
+    if _sqlite_extension is None:
+        try:
+            conn = duckdb.connect(":memory:", config={"autoinstall_known_extensions": False})
+            conn.execute("LOAD sqlite")
+            conn.close()
+            _sqlite_extension = True
+        except (duckdb.Error, AttributeError, TypeError):
+            _sqlite_extension = False
+    return _sqlite_extension
+
+
+def source_kind(path: str) -> str:
+    # "sqlite", "duckdb" or "file" (CSV, Parquet or JSON read through DuckDB)
+    extension = os.path.splitext(path)[1].lower()
+    if extension in DUCKDB_READERS:
+        return "file"
+    if extension == ".duckdb":
+        return "duckdb"
+    if extension in SQLITE_EXTENSIONS:
+        return "sqlite"
+    with open(path, "rb") as f:
+        if f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC:
+            return "sqlite"
+    raise SQLEngineError(f"Unsupported database file: {path}")
+
+
+def choose_engine(path: str, kind: str, engine: str = "auto") -> str:
+    if engine not in ENGINES:
+        raise SQLEngineError(f"Unknown SQL engine: {engine}")
+    if kind != "sqlite":
+        if engine == "sqlite":
+            raise SQLEngineError(f"{path} is not a SQLite database")
+        engine = "duckdb"
+    elif engine == "auto":
+        large = os.path.getsize(path) >= SQL_DUCKDB_SQLITE_BYTES
+        engine = "duckdb" if large and duckdb is not None and duckdb_reads_sqlite() else "sqlite"
+    elif engine == "duckdb" and (duckdb is None or not duckdb_reads_sqlite()):
+        raise SQLEngineError("DuckDB's sqlite extension is not installed; use engine 'sqlite'")
+    if engine == "duckdb" and duckdb is None:
+        raise SQLEngineError("Querying this file requires duckdb")
+    return engine
+
+
+_sources = OrderedDict()
+_sources_lock = Lock()
+
+
+def get_source(path: str, engine: str, kind: str):
+    # Pooled SQLitePool or DuckDBSource for the file, reopened if the file was replaced
+    key = (path, engine)
+    with _sources_lock:
+        source = _sources.get(key)
+        if source is not None and source.identity != _identity(path):
+            _sources.pop(key).close()
+            source = None
+        if source is None:
+            source = _sources[key] = SQLitePool(path) if engine == "sqlite" else DuckDBSource(path, kind)
+            while len(_sources) > SQL_POOLS_MAX:
+                _sources.popitem(last=False)[1].close()
+        _sources.move_to_end(key)
+        return source
+
+
+def close_sources():
+    with _sources_lock:
+        while _sources:
+            _sources.popitem()[1].close()
+
+
+def _batches(cursor):
+    while True:
+        rows = cursor.fetchmany(SQL_BATCH_ROWS)
+        if not rows:
+            return
+        yield rows
+
+
+def _scalar_text(value) -> str:
+    # An empty aggregate (NULL) is written as 0, as query_sql always has
+    return "0" if value is None else str(value)
+
+
+def _write_rows(columns: list, batches, path: str, output: str) -> tuple:
+    # Stream Python row batches to `path`; returns (rows written, scalar value or None)
+    batches = iter(batches)
+    if output == "text":
+        first = next(batches, [])
+        second = next(batches, []) if len(first) == 1 else []
+        if len(columns) == 1 and len(first) == 1 and not second:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(_scalar_text(first[0][0]))
+            return 1, first[0][0]
+        # Anything bigger than one value is written as CSV
+        batches, output = itertools.chain([first, second], batches), "csv"
+    rows = 0
+    if output == "parquet":
+        if pyarrow is None:
+            raise SQLEngineError("Parquet output requires pyarrow; use a .csv or .json output instead")
+        schema, writer = None, None
+        try:
+            for batch in batches:
+                values = list(zip(*batch))
+                if schema is None:
+                    arrays = [pyarrow.array(column) for column in values]
+                    schema = pyarrow.schema([(name, array.type) for name, array in zip(columns, arrays)])
+                    writer = pyarrow.parquet.ParquetWriter(path, schema)
+                else:
+                    arrays = [pyarrow.array(column, type=field.type) for column, field in zip(values, schema)]
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                rows += len(batch)
+            if writer is None:
+                schema = pyarrow.schema([(name, pyarrow.string()) for name in columns])
+                writer = pyarrow.parquet.ParquetWriter(path, schema)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as e:
+            raise SQLEngineError(f"Inconsistent column types for Parquet output: {e}")
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows, None
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if output == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for batch in batches:
+                writer.writerows(batch)
+                rows += len(batch)
+        elif output == "jsonl":
+            for batch in batches:
+                f.writelines(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in batch)
+                rows += len(batch)
+        else:
+            f.write("[")
+            for batch in batches:
+                for row in batch:
+                    f.write(("," if rows else "") + "\n" + json.dumps(dict(zip(columns, row)), default=str))
+                    rows += 1
+            f.write("\n]\n" if rows else "]\n")
+    return rows, None
+
+
+def _write_arrow(reader, path: str, output: str) -> int:
+    # Stream DuckDB's Arrow record batches straight to CSV or Parquet
+    rows = 0
+    writer = (pyarrow.csv.CSVWriter(path, reader.schema) if output == "csv"
+              else pyarrow.parquet.ParquetWriter(path, reader.schema))
+    try:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+    return rows
+
+
+def _check_select(cursor, query: str):
+    statements = cursor.extract_statements(query)
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        raise SQLEngineError("Only a single SELECT statement can be run")
+
+
+def output_format(path: str) -> str:
+    return OUTPUT_FORMATS.get(os.path.splitext(path)[1].lower(), "text")
+
+
+def run_query(path: str, query: str, output_path: str, engine: str = "auto") -> dict:
+    # Runs `query` read-only against `path` and streams the result to `output_path` (written atomically)
+    path = os.path.abspath(path)
+    kind = source_kind(path)
+    engine = choose_engine(path, kind, engine or "auto")
+    output = output_format(output_path)
+    # A unique temp file beside the output, so concurrent queries to one output never share it
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)),
+                                    prefix=f".{os.path.basename(output_path)}.", suffix=".tmp")
+    os.close(fd)
+    os.chmod(tmp_path, 0o644)
+    start = time.perf_counter()
+    value = None
+    try:
+        if engine == "sqlite":
+            with get_source(path, engine, kind).connection() as conn:
+                cursor = conn.execute(query)
+                try:
+                    columns = [column[0] for column in cursor.description or []]
+                    rows, value = _write_rows(columns, _batches(cursor), tmp_path, output)
+                finally:
+                    cursor.close()
+        else:
+            cursor = get_source(path, engine, kind).cursor()
+            try:
+                _check_select(cursor, query)
+                cursor.execute(query)
+                columns = [column[0] for column in cursor.description or []]
+                if pyarrow is not None and output in ("csv", "parquet"):
+                    rows = _write_arrow(cursor.fetch_record_batch(SQL_BATCH_ROWS), tmp_path, output)
+                else:
+                    rows, value = _write_rows(columns, _batches(cursor), tmp_path, output)
+            finally:
+                cursor.close()
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    summary = {"engine": engine, "columns": columns, "rows": rows, "format": output,
+               "elapsed_ms": round((time.perf_counter() - start) * 1000, 3)}
+    if output == "text" and value is not None:
+        summary["value"] = value
+    return summary
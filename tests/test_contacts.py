@@ -0,0 +1,68 @@
+import json
+import random
+
+import pytest
+
+import contacts
+from contacts import SortSpec, external_sort_contacts, sort_contacts_file, sort_in_memory
+
+FIRST = ["Ann", "ann", "Émile", "Zoë", "bob", "Bob", "Ünal", "Amy", "amy", "Chen"]
+LAST = ["Smith", "smith", "Østergaard", "Ng", "O'Brien", "Álvarez", "ng", "Zhou", "de la Cruz", "Smith"]
+
+SPECS = [
+    ([{"field": "last_name", "descending": False}, {"field": "first_name", "descending": False}], "binary"),
+    ([{"field": "last_name", "descending": True}, {"field": "first_name", "descending": True}], "binary"),
+    ([{"field": "last_name", "descending": False}, {"field": "first_name", "descending": True}], "casefold"),
+    ([{"field": "first_name", "descending": True}, {"field": "last_name", "descending": False}], "casefold"),
+]
+
+
+@pytest.fixture(scope="module")
+def people():
+    rng = random.Random(7)
+    # Few distinct names, so most keys tie and stability decides the order
+    return [{"first_name": rng.choice(FIRST), "last_name": rng.choice(LAST), "email": f"user{i}@example.com"}
+            for i in range(3000)]
+
+
+def reference(records: list, keys: list, collation: str) -> bytes:
+    # One stable sort per key, last key first, dumped with json.dump
+    collate = (lambda value: value.casefold()) if collation == "casefold" else (lambda value: value)
+    result = list(records)
+    for key in reversed(keys):
+        result.sort(key=lambda record: collate(record[key["field"]]), reverse=key["descending"])
+    return json.dumps(result).encode()
+
+
+@pytest.mark.parametrize("keys, collation", SPECS)
+@pytest.mark.parametrize("workers", [1, 4])
+def test_external_sort_matches_json_dump(tmp_path, monkeypatch, people, keys, collation, workers):
+    # Small runs and a small fan-in force many spilled runs and a multi-pass merge
+    monkeypatch.setattr(contacts, "CONTACTS_MERGE_FAN_IN", 3)
+    source, output = tmp_path / "contacts.json", tmp_path / "sorted.json"
+    source.write_text(json.dumps(people))
+    count = external_sort_contacts(str(source), str(output), SortSpec(keys, collation),
+                                   memory_budget=20000, workers=workers)
+    assert count == len(people)
+    assert output.read_bytes() == reference(people, keys, collation)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["contacts.json", "sorted.json"]
+
+
+@pytest.mark.parametrize("keys, collation", SPECS)
+def test_in_memory_modes_match_json_dump(tmp_path, monkeypatch, people, keys, collation):
+    monkeypatch.setattr(contacts, "CONTACTS_PARALLEL_THRESHOLD", 100)
+    spec = SortSpec(keys, collation)
+    expected = reference(people, keys, collation)
+    assert json.dumps(sort_in_memory(people, spec, workers=1)).encode() == expected
+    assert json.dumps(sort_in_memory(people, spec, workers=4)).encode() == expected
+    source, output = tmp_path / "contacts.json", tmp_path / "sorted.json"
+    source.write_text(json.dumps(people))
+    sort_contacts_file(str(source), str(output), spec)
+    assert output.read_bytes() == expected
+
+
+def test_empty_array(tmp_path):
+    source, output = tmp_path / "contacts.json", tmp_path / "sorted.json"
+    source.write_text("[]")
+    assert external_sort_contacts(str(source), str(output), memory_budget=100, workers=1) == 0
+    assert output.read_text() == "[]"
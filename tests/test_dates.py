@@ -0,0 +1,40 @@
+import warnings
+
+import pytest
+
+from dates import DateHistogram, count_weekdays
+
+# Offsets near midnight: the line's own calendar day (Monday 2024-03-04 or Tuesday 2024-03-05) is what counts,
+# whichever day the instant falls on in UTC
+LINES = [
+    "2024-03-04T23:30:00+05:00",
+    "2024-03-04T23:30:00-05:00",
+    "2024-03-04T23:30:00",
+    "2024-03-05 00:15:00 +0900",
+    "2024-03-05 00:15:00 -0800",
+    "Mar 05 2024 23:59 -0800",
+    "2024/03/05",
+    "not a date",
+]
+
+
+@pytest.fixture
+def histogram(tmp_path):
+    path = tmp_path / "dates.txt"
+    path.write_text("\n".join(LINES) + "\n")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        data = count_weekdays(str(path))
+    return DateHistogram({"key": None, **data})
+
+
+def test_offsets_count_on_the_written_day(histogram):
+    assert histogram.data["weekdays"] == [3, 4, 0, 0, 0, 0, 0]
+    assert histogram.data["day_keys"] == ["2024-03-04", "2024-03-05"]
+    assert histogram.data["malformed"] == 1
+
+
+@pytest.mark.parametrize("weekday", range(7))
+def test_range_counts_match_totals(histogram, weekday):
+    assert histogram.count(weekday, "2024-01-01", "2024-12-31") == histogram.count(weekday)
+    assert histogram.count(weekday, "2024-03-04", "2024-03-04") == (3 if weekday == 0 else 0)
@@ -0,0 +1,56 @@
+from app import plan_dependencies
+
+
+def count_days(source, output):
+    return ("count_days", {"input_file_path": source, "day": "wednesday", "output_file_path": output})
+
+
+def sort_contacts(source, output):
+    return ("sort_contacts", {"input_path": source, "output_path": output})
+
+
+def script(url):
+    return ("script_runner", {"script_url": url, "args": ["user@example.com"]})
+
+
+def test_independent_calls_run_concurrently():
+    calls = [count_days("/data/dates.txt", "/data/a.txt"), sort_contacts("/data/contacts.json", "/data/b.json")]
+    assert plan_dependencies(calls) == [set(), set()]
+
+
+def test_reader_waits_for_earlier_writer():
+    calls = [sort_contacts("/data/contacts.json", "/data/sorted.json"),
+             count_days("/data/sorted.json", "/data/a.txt")]
+    assert plan_dependencies(calls) == [set(), {0}]
+
+
+def test_earlier_reader_keeps_listed_order():
+    # count_days must read dates.txt before sort_contacts overwrites it, not after
+    calls = [count_days("/data/dates.txt", "/data/a.txt"), sort_contacts("/data/contacts.json", "/data/dates.txt")]
+    assert plan_dependencies(calls) == [set(), {0}]
+
+
+def test_write_write_keeps_listed_order():
+    calls = [count_days("/data/dates.txt", "/data/out.txt"), count_days("/data/other.txt", "/data/out.txt")]
+    assert plan_dependencies(calls) == [set(), {0}]
+
+
+def test_directory_contains_path():
+    calls = [sort_contacts("/data/contacts.json", "/data/logs/new.log"),
+             ("logs_recent", {"log_dir_path": "/data/logs", "num_files": 10, "output_file_path": "/data/r.txt"})]
+    assert plan_dependencies(calls) == [set(), {0}]
+
+
+def test_barrier_orders_against_everything():
+    calls = [count_days("/data/dates.txt", "/data/a.txt"), script("https://example.com/datagen.py"),
+             sort_contacts("/data/contacts.json", "/data/b.json")]
+    # The last call is ordered after the first through the barrier
+    assert plan_dependencies(calls) == [set(), {0}, {1}]
+
+
+def test_edges_only_point_backwards():
+    calls = [count_days("/data/x.txt", "/data/y.txt"), count_days("/data/y.txt", "/data/x.txt"),
+             count_days("/data/x.txt", "/data/y.txt")]
+    deps = plan_dependencies(calls)
+    assert deps == [set(), {0}, {0, 1}]
+    assert all(d < i for i, edges in enumerate(deps) for d in edges)
@@ -0,0 +1,38 @@
+# Card images rendered the way datagen's a8_credit_card_image draws them
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr import read_card_number
+
+
+def render_card(path, number: str):
+    image = Image.new("RGB", (1012, 638), (25, 68, 141))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    font.size = 60
+    draw.text((50, 250), " ".join(number[i:i + 4] for i in range(0, 16, 4)), fill=(255, 255, 255), font=font)
+    draw.text((50, 400), "VALID\nTHRU", fill=(255, 255, 255))
+    draw.text((50, 480), "04/29", fill=(255, 255, 255))
+    draw.text((250, 480), "123", fill=(255, 255, 255))
+    draw.text((50, 550), "JANE DOE", fill=(255, 255, 255))
+    image.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("number", [
+    "3597822575132071",  # 359782257513 is a Luhn-valid prefix
+    "346136740815134",   # 15 digits, drawn as 4-4-4-3
+    "30053268451526",    # 14 digits
+    "4539578763621486",
+])
+def test_reads_the_whole_number_not_a_luhn_valid_part(tmp_path, number):
+    result = read_card_number(render_card(tmp_path / "card.png", number))
+    assert result["number"] == number
+    assert result.confident
+
+
+def test_partial_read_is_not_confident(tmp_path):
+    # A 19-digit number shows only its first 16 digits, which fail Luhn; its Luhn-valid
+    # 12-digit prefix must not be returned as a confident answer
+    result = read_card_number(render_card(tmp_path / "card.png", "4741410857687896123"))
+    assert not result.confident
@@ -0,0 +1,57 @@
+import pytest
+
+import router
+
+# Task phrasings from evaluate.py, which the router answers without the LLM
+ROUTED = [
+    ("The file `/data/dates.txt` contains a list of dates, one per line. Count the number of Wednesdays in the "
+     "list, and write just the number to `/data/dates-wednesdays.txt`", "count_days"),
+    ("Sort the array of contacts in `/data/contacts.json` by `last_name`, then `first_name`, and write the result "
+     "to `/data/contacts-sorted.json`", "sort_contacts"),
+    ("Write the first line of the 10 most recent `.log` file in `/data/logs/` to `/data/logs-recent.txt`, most "
+     "recent first", "logs_recent"),
+    ("`/data/email.txt` contains an email message. Pass the content to an LLM with instructions to extract the "
+     "sender's email address, and write just the email address to `/data/email-sender.txt`", "email_sender"),
+    ("`/data/credit_card.png` contains a credit card number. Pass the image to an LLM, have it extract the card "
+     "number, and write it without spaces to `/data/credit-card.txt`", "get_completions_image"),
+    ("`/data/comments.txt` contains a list of comments, one per line. Using embeddings, find the most similar pair "
+     "of comments and write them to `/data/comments-similar.txt`, one per line", "get_similar_comments"),
+]
+
+# Qualifiers the extractors don't parse: these must fall back to the LLM rather than run with defaults
+NOT_ROUTED = [
+    "Sort the array of contacts in `/data/contacts.json` by `first_name` descending and write the result to "
+    "`/data/contacts-sorted.json`",
+    "Sort the array of contacts in `/data/contacts.json` by `first_name`, then `last_name`, and write the result "
+    "to `/data/contacts-sorted.json`",
+    "Sort the array of contacts in `/data/contacts.json` by `email` and write the result to `/data/out.json`",
+    "The file `/data/dates.txt` contains a list of dates, one per line. Count the number of Wednesdays between "
+    "2010 and 2015, and write just the number to `/data/dates-wednesdays.txt`",
+    "The file `/data/dates.txt` contains a list of dates. Count the Wednesdays in March and write the number to "
+    "`/data/out.txt`",
+    "Count the Wednesdays and Fridays in the dates of `/data/dates.txt` and write the number to `/data/out.txt`",
+    "Write the last 5 lines of the 10 most recent `.log` file in `/data/logs/` to `/data/logs-recent.txt`",
+    "Write the lines matching ERROR of the 10 most recent `.log` file in `/data/logs/` to `/data/logs-recent.txt`",
+    "Write the first line of the 10 oldest `.log` file in `/data/logs/` to `/data/logs-recent.txt`",
+    "`/data/email.txt` contains an email message. Extract the recipient's email address and write it to "
+    "`/data/email-recipient.txt`",
+    "`/data/email.txt` contains an email message. Extract the sender's name and write it to `/data/email-sender.txt`",
+    "`/data/email.txt` contains an email message. Extract the subject and write it to `/data/email-subject.txt`",
+    "`/data/credit_card.png` contains a credit card. Pass the image to an LLM, have it extract the expiry date, "
+    "and write it to `/data/credit-card.txt`",
+    "`/data/comments.txt` contains a list of comments, one per line. Using embeddings, find the least similar pair "
+    "of comments and write them to `/data/comments-similar.txt`",
+    "`/data/comments.txt` contains a list of comments, one per line. Using embeddings, find the 3 most similar pairs "
+    "of comments and write them to `/data/comments-similar.txt`",
+]
+
+
+@pytest.mark.parametrize("task,name", ROUTED)
+def test_routes_known_phrasings(task, name):
+    routed = router.route(task)
+    assert routed is not None and routed[0] == name
+
+
+@pytest.mark.parametrize("task", NOT_ROUTED)
+def test_unparsed_qualifiers_fall_back_to_the_llm(task):
+    assert router.route(task) is None
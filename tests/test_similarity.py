@@ -0,0 +1,45 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from similarity import exact_pairs, approximate_pairs, top_pairs
+
+
+def brute_force(vectors: np.ndarray, k: int) -> list:
+    scores = vectors.astype(np.float32) @ vectors.astype(np.float32).T
+    pairs = sorted(((float(scores[i, j]), i, j) for i, j in itertools.combinations(range(len(vectors)), 2)),
+                   key=lambda pair: -pair[0])
+    return pairs[:k]
+
+
+def normalized(n: int, dim: int = 8, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("n", [2, 3, 4, 5])
+@pytest.mark.parametrize("k", [1, 2, 3, 10])
+def test_exact_matches_brute_force(n, k):
+    vectors = normalized(n, seed=n * 100 + k)
+    pairs, mode = top_pairs(vectors, k, "exact")
+    expected = brute_force(vectors, k)
+    assert mode == "exact"
+    assert [(i, j) for i, j, _ in pairs] == [(i, j) for _, i, j in expected]
+    assert [score for _, _, score in pairs] == pytest.approx([score for score, _, _ in expected], abs=1e-5)
+
+
+@pytest.mark.parametrize("tile", [1, 2, 3, 7])
+def test_exact_across_tiles(tile):
+    vectors = normalized(20, seed=tile)
+    scores, first, second = exact_pairs(vectors, 15, tile=tile, workers=1)
+    expected = brute_force(vectors, 15)
+    assert list(zip(first.tolist(), second.tolist())) == [(i, j) for _, i, j in expected]
+    assert scores.tolist() == pytest.approx([score for score, _, _ in expected], abs=1e-5)
+
+
+def test_approximate_pairs_are_valid():
+    vectors = normalized(200, seed=1)
+    scores, first, second = approximate_pairs(vectors, 5, workers=1)
+    assert len(scores) and (first < second).all() and np.isfinite(scores).all()
+    assert len(set(zip(first.tolist(), second.tolist()))) == len(scores)
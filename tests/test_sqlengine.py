@@ -0,0 +1,57 @@
+import json
+import sqlite3
+
+import pytest
+
+from sqlengine import close_sources, run_query
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "tickets.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tickets (type TEXT, units INTEGER, price REAL)")
+    conn.executemany("INSERT INTO tickets VALUES (?, ?, ?)", [("Gold", 3, 1.5), ("Silver", 4, 2.0), ("Gold", 5, 1.5)])
+    conn.commit()
+    conn.close()
+    yield path
+    close_sources()
+
+
+def query(database, sql: str, output: str = "out.json"):
+    return run_query(str(database), sql, str(database.parent / output), "sqlite")
+
+
+def test_select(database):
+    summary = query(database, "SELECT SUM(units * price) FROM tickets WHERE type = 'Gold'", "out.txt")
+    assert summary["engine"] == "sqlite" and summary["value"] == 12.0
+    assert (database.parent / "out.txt").read_text() == "12.0"
+
+
+def test_schema_pragmas_allowed(database):
+    query(database, "PRAGMA table_info(tickets)")
+    assert [column["name"] for column in json.loads((database.parent / "out.json").read_text())] == \
+        ["type", "units", "price"]
+
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO tickets VALUES ('Bronze', 1, 1.0)",
+    "UPDATE tickets SET units = 0",
+    "DELETE FROM tickets",
+    "DROP TABLE tickets",
+    "CREATE TABLE other (x)",
+    "PRAGMA query_only = OFF",
+    "PRAGMA writable_schema = ON",
+    "PRAGMA journal_mode = DELETE",
+    "ATTACH DATABASE ':memory:' AS other",
+])
+def test_writes_and_pragmas_rejected(database, sql):
+    with pytest.raises(sqlite3.DatabaseError):
+        query(database, sql)
+    # Nothing written: no output and no temp file left behind
+    assert sorted(path.name for path in database.parent.iterdir()) == ["tickets.db"]
+    # The pooled connection is still read-only afterwards
+    with pytest.raises(sqlite3.DatabaseError):
+        query(database, "DELETE FROM tickets")
+    query(database, "SELECT COUNT(*) FROM tickets", "count.txt")
+    assert (database.parent / "count.txt").read_text() == "3"
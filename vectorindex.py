@@ -0,0 +1,331 @@
+# Persistent nearest-neighbour index over the lines of a text file for similar_search and GET /similar.
+# Items (id, text, vector-cache row, slot) live in SQLite; the vectors themselves stay in the embeddings
+# cache's memory-mapped storage, so nothing is embedded twice. The ANN structure is random-hyperplane LSH:
+# SIMILAR_LSH_TABLES signatures of SIMILAR_LSH_BITS bits per item, appended by slot to a memory-mapped file.
+# A query probes its bucket and every bucket one bit away in each table, then re-ranks the candidates
+# exactly; indexes below SIMILAR_EXACT_BELOW items are scanned exactly. The source file is re-synced when
+# its (mtime, size) changes: new lines are embedded and added, vanished lines deleted.
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+from embeddings import EMBEDDING_CACHE_DTYPE, embed_rows, get_backend, vector_cache
+
+VECTOR_INDEX_DIR = os.path.join(os.getenv("CACHE_DIR", "/data/.cache"), "vectors")
+SIMILAR_LSH_TABLES = int(os.getenv("SIMILAR_LSH_TABLES", "8"))
+SIMILAR_LSH_BITS = int(os.getenv("SIMILAR_LSH_BITS", "12"))
+SIMILAR_EXACT_BELOW = int(os.getenv("SIMILAR_EXACT_BELOW", "20000"))
+SIMILAR_INDEX_MAX = int(os.getenv("SIMILAR_INDEX_MAX", "8"))
+# Query vectors kept in memory (queries are not written to the persistent embeddings cache)
+SIMILAR_QUERY_CACHE = int(os.getenv("SIMILAR_QUERY_CACHE", "256"))
+SCAN_ROWS = 65536
+
+
+def read_items(path: str) -> list:
+    # Unique non-empty stripped lines, in file order; each line is its own id
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+
+class VectorIndex:
+    def __init__(self, source: str, backend=None):
+        self.source = os.path.abspath(source)
+        self.backend = backend or get_backend()
+        self.cache = vector_cache(self.backend.name)
+        key = f"{self.source}:{self.backend.name}:{EMBEDDING_CACHE_DTYPE}"
+        self.dir = os.path.join(VECTOR_INDEX_DIR, hashlib.sha1(key.encode()).hexdigest())
+        self.lock = Lock()
+        self._sync_lock = None
+        self._conn = None
+        self.planes = None
+        self.signatures = np.zeros((0, SIMILAR_LSH_TABLES), dtype=np.int64)
+        # Live items: slot and vector-cache row, plus per-table (sorted signatures, positions) for probing
+        self.slots = np.zeros(0, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.tables = []
+        with self.lock:
+            self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def _signature_path(self, generation: int = None) -> str:
+        # Compaction writes a new generation, so the committed file is never rewritten in place
+        generation = self._meta("generation", 0) if generation is None else generation
+        return self._path(f"signatures.{generation}.bin")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.dir, exist_ok=True)
+            self._conn = sqlite3.connect(self._path("index.sqlite"), check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS items (
+                id TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                slot INTEGER NOT NULL UNIQUE,
+                row INTEGER NOT NULL)""")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        return self._conn
+
+    def _meta(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, **values):
+        self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values.items())
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _load(self):
+        # Live items from SQLite, signatures from the memory-mapped file (rows past the committed count are
+        # a torn append and ignored)
+        committed = self._meta("slots", 0)
+        if os.path.exists(self._path("planes.npy")):
+            self.planes = np.load(self._path("planes.npy"))
+        if committed:
+            self.signatures = np.memmap(self._signature_path(), dtype=np.int64, mode="r",
+                                        shape=(committed, SIMILAR_LSH_TABLES))
+        items = self.conn.execute("SELECT slot, row FROM items ORDER BY slot").fetchall()
+        items = np.array(items, dtype=np.int64).reshape(-1, 2)
+        self.slots, self.rows = items[:, 0].copy(), items[:, 1].copy()
+        self.tables = []
+        if len(self.slots) >= SIMILAR_EXACT_BELOW:
+            signatures = np.asarray(self.signatures[self.slots])
+            for table in range(SIMILAR_LSH_TABLES):
+                order = np.argsort(signatures[:, table], kind="stable")
+                self.tables.append((signatures[order, table], order))
+
+    def _signatures(self, vectors: np.ndarray) -> np.ndarray:
+        # (n, tables) int64: one SIMILAR_LSH_BITS-bit random-hyperplane signature per table
+        if self.planes is None:
+            rng = np.random.default_rng(int.from_bytes(hashlib.sha1(self.dir.encode()).digest()[:8], "little"))
+            self.planes = rng.standard_normal((vectors.shape[1], SIMILAR_LSH_TABLES * SIMILAR_LSH_BITS)).astype(np.float32)
+            os.makedirs(self.dir, exist_ok=True)
+            np.save(self._path("planes.npy"), self.planes)
+        weights = 1 << np.arange(SIMILAR_LSH_BITS, dtype=np.int64)
+        signatures = np.zeros((len(vectors), SIMILAR_LSH_TABLES), dtype=np.int64)
+        for start in range(0, len(vectors), SCAN_ROWS):
+            bits = vectors[start:start + SCAN_ROWS].astype(np.float32) @ self.planes > 0
+            signatures[start:start + SCAN_ROWS] = bits.reshape(len(bits), SIMILAR_LSH_TABLES, SIMILAR_LSH_BITS) @ weights
+        return signatures
+
+    def _compact(self):
+        # Rewrite the signature file without dead slots once they are the majority; reads the committed
+        # state from SQLite, so it runs before the in-memory view is reloaded
+        committed = self._meta("slots", 0)
+        slots = np.array([row[0] for row in self.conn.execute("SELECT slot FROM items ORDER BY slot")],
+                         dtype=np.int64)
+        if committed < 1024 or len(slots) * 2 > committed:
+            return
+        generation = self._meta("generation", 0)
+        old, new = self._signature_path(generation), self._signature_path(generation + 1)
+        signatures = np.memmap(old, dtype=np.int64, mode="r", shape=(committed, SIMILAR_LSH_TABLES))
+        with open(new, "wb") as f:
+            f.write(np.ascontiguousarray(signatures[slots]).tobytes())
+        del signatures
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            # Renumber through negative slots to keep the UNIQUE constraint satisfied
+            conn.executemany("UPDATE items SET slot = ? WHERE slot = ?",
+                             ((-1 - slot, int(previous)) for slot, previous in enumerate(slots)))
+            conn.execute("UPDATE items SET slot = -1 - slot")
+            self._set_meta(slots=len(slots), generation=generation + 1)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+    def _write(self, ids: list, texts: list, rows: np.ndarray, signatures: np.ndarray, deleted: list):
+        with self.lock:
+            conn = self.conn
+            committed = self._meta("slots", 0)
+            if len(ids):
+                with open(self._signature_path(), "ab") as f:
+                    f.truncate(committed * SIMILAR_LSH_TABLES * 8)
+                    f.write(np.ascontiguousarray(signatures).tobytes())
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("DELETE FROM items WHERE id = ?", ((item,) for item in deleted + ids))
+                conn.executemany("INSERT INTO items (id, text, slot, row) VALUES (?, ?, ?, ?)",
+                                 zip(ids, texts, range(committed, committed + len(ids)), map(int, rows)))
+                self._set_meta(slots=committed + len(ids))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._compact()
+            self._load()
+
+    def _query(self, sql: str, parameters=()) -> list:
+        with self.lock:
+            return self.conn.execute(sql, parameters).fetchall()
+
+    def _set_meta_locked(self, **values):
+        with self.lock:
+            self._set_meta(**values)
+
+    # The coroutines below never take self.lock themselves: SQLite, numpy and _write (which holds the lock
+    # through a whole sync) all run in worker threads, so a slow sync can't stall the event loop
+
+    async def upsert(self, ids: list, texts: list) -> int:
+        # Add or replace items; unchanged (id, text) pairs are skipped. Returns the number written.
+        items = dict(zip(ids, texts))
+        stored = dict(await asyncio.to_thread(self._query, "SELECT id, text FROM items")) if items else {}
+        items = {item: text for item, text in items.items() if stored.get(item) != text}
+        if not items:
+            return 0
+        ids, texts = list(items), list(items.values())
+        cache, rows, _ = await embed_rows(texts, self.backend, job=self.source)
+        signatures = await asyncio.to_thread(lambda: self._signatures(cache.rows(rows)))
+        await asyncio.to_thread(self._write, ids, texts, rows, signatures, [])
+        return len(ids)
+
+    async def delete(self, ids: list) -> int:
+        placeholders = ",".join("?" * len(ids))
+        present = [row[0] for row in await asyncio.to_thread(
+            self._query, f"SELECT id FROM items WHERE id IN ({placeholders})", ids)]
+        if present:
+            await asyncio.to_thread(self._write, [], [], np.zeros(0, dtype=np.int64),
+                                    np.zeros((0, SIMILAR_LSH_TABLES), dtype=np.int64), present)
+        return len(present)
+
+    async def sync(self) -> int:
+        # Bring the index in line with the source file when its (mtime, size) changed; returns items changed
+        if self._sync_lock is None:
+            self._sync_lock = asyncio.Lock()
+        async with self._sync_lock:
+            stat = await asyncio.to_thread(os.stat, self.source)
+            meta = dict(await asyncio.to_thread(
+                self._query, "SELECT key, value FROM meta WHERE key IN ('mtime_ns', 'size')"))
+            if (meta.get("mtime_ns"), meta.get("size")) == (stat.st_mtime_ns, stat.st_size):
+                return 0
+            stored = {row[0] for row in await asyncio.to_thread(self._query, "SELECT id FROM items")}
+            items = await asyncio.to_thread(read_items, self.source)
+            current = set(items)
+            added = await self.upsert([item for item in items if item not in stored],
+                                      [item for item in items if item not in stored])
+            removed = await self.delete([item for item in stored if item not in current])
+            await asyncio.to_thread(self._set_meta_locked, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            return added + removed
+
+    def _candidates(self, signature: np.ndarray) -> np.ndarray:
+        # Positions of live items sharing a bucket with `signature`, or one bit away, in any table
+        flips = np.concatenate([[0], 1 << np.arange(SIMILAR_LSH_BITS, dtype=np.int64)])
+        found = []
+        for table, (keys, order) in enumerate(self.tables):
+            probes = np.sort(signature[table] ^ flips)
+            for start, end in zip(np.searchsorted(keys, probes, "left"), np.searchsorted(keys, probes, "right")):
+                if end > start:
+                    found.append(order[start:end])
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def _rank(self, query: np.ndarray, positions: np.ndarray, rows: np.ndarray, k: int) -> tuple:
+        # Exact top k of `positions` by cosine similarity, scanned in chunks
+        best_scores, best_positions = np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        for start in range(0, len(positions), SCAN_ROWS):
+            chunk = positions[start:start + SCAN_ROWS]
+            scores = self.cache.rows(rows[chunk]).astype(np.float32) @ query
+            best_scores = np.concatenate([best_scores, scores])
+            best_positions = np.concatenate([best_positions, chunk])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_scores, best_positions = best_scores[keep], best_positions[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        return best_scores[order], best_positions[order]
+
+    async def search(self, text: str, k: int = 10) -> tuple:
+        # ([{"id", "text", "score"}] best first, search stats)
+        changed = await self.sync()
+        query = await embed_query(text, self.backend)
+        results, stats = await asyncio.to_thread(self._search, query, k)
+        return results, {**stats, "synced": changed}
+
+    def _search(self, query: np.ndarray, k: int) -> tuple:
+        # Bucket probing, exact re-ranking and the item lookup, in a worker thread
+        with self.lock:
+            slots, item_rows, approximate = self.slots, self.rows, bool(self.tables)
+            positions = self._candidates(self._signatures(query[None])[0]) if approximate else np.arange(len(slots))
+            if len(positions) < k:
+                # Too few LSH candidates: scan everything
+                positions, approximate = np.arange(len(slots)), False
+            scores, best = self._rank(query, positions, item_rows, k)
+            placeholders = ",".join("?" * len(best))
+            found = dict((slot, (item, item_text)) for slot, item, item_text in self.conn.execute(
+                f"SELECT slot, id, text FROM items WHERE slot IN ({placeholders})", [int(s) for s in slots[best]]))
+        results = [{"id": found[int(slot)][0], "text": found[int(slot)][1], "score": round(float(score), 6)}
+                   for slot, score in zip(slots[best], scores)]
+        return results, {"items": len(slots), "candidates": len(positions),
+                         "mode": "approximate" if approximate else "exact"}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"source": self.source, "backend": self.backend.name, "items": len(self.slots),
+                    "slots": self._meta("slots", 0), "ann": bool(self.tables)}
+
+
+_queries = OrderedDict()
+_queries_lock = Lock()
+
+
+async def embed_query(text: str, backend) -> np.ndarray:
+    # One query vector, from a small in-memory LRU or straight from the backend
+    key = (backend.name, text)
+    with _queries_lock:
+        if key in _queries:
+            _queries.move_to_end(key)
+            return _queries[key]
+    query = (await backend.embed([text]))[0].astype(np.float32)
+    with _queries_lock:
+        _queries[key] = query
+        while len(_queries) > SIMILAR_QUERY_CACHE:
+            _queries.popitem(last=False)
+    return query
+
+
+_indexes = OrderedDict()
+_indexes_lock = Lock()
+
+
+def vector_index(source: str, backend: str = None) -> VectorIndex:
+    source = os.path.abspath(source)
+    if not os.path.isfile(source):
+        raise FileNotFoundError(source)
+    backend = get_backend(backend)
+    key = (source, backend.name)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = VectorIndex(source, backend)
+            while len(_indexes) > SIMILAR_INDEX_MAX:
+                _indexes.popitem(last=False)[1].close()
+        _indexes.move_to_end(key)
+        return index
+
+
+async def similar_search(source: str, text: str, k: int = 10, backend: str = None) -> tuple:
+    # Opening an index loads every item, so it happens off the event loop too
+    index = await asyncio.to_thread(vector_index, source, backend)
+    return await index.search(text, k)
+
+
+def close_vector_indexes():
+    with _indexes_lock:
+        while _indexes:
+            _indexes.popitem()[1].close()